@@ -0,0 +1,294 @@
+import os
+import shutil
+import struct
+from io import BytesIO
+
+from PIL import Image
+
+
+class AnimationWriter:
+    """
+    逐帧写入的动画文件，用于在不持有所有帧的情况下生成动画
+    第一帧需要是完整的画面，之后的每一帧都可以只写入和上一帧相比发生变化的区域，
+    写入完成前内容会保存在临时文件中，关闭时才会替换到目标路径
+
+    Usage:
+        with GifWriter('timelapse.gif', (width, height)) as writer:
+            writer.write(first_frame, (0, 0), 200)
+            writer.write(changed_region, (x, y), 200)
+    """
+    # 目标路径
+    file_path = ''
+    # 画面尺寸
+    size = None
+    # 已经写入的帧数
+    frames = 0
+
+    def __init__(self, file_path, size):
+        """新建动画文件
+
+        Args:
+            file_path: 要保存到的路径
+            size: 画面尺寸 (width, height)
+        """
+        self.file_path = file_path
+        self.size = size
+        self.frames = 0
+        self._temp_path = f'{file_path}.{os.getpid()}.tmp'
+        self._file = open(self._temp_path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, image, offset, duration):
+        """写入一帧
+
+        Args:
+            image: Image 该帧中发生变化的区域，第一帧必须和画面尺寸一致
+            offset: 该区域在画面中的位置 (x, y)
+            duration: 该帧的显示时间（毫秒）
+        """
+        if self.frames == 0 and (image.size != tuple(self.size) or tuple(offset) != (0, 0)):
+            raise ValueError(f'第一帧必须是完整的画面 {self.size}')
+        if offset[0] + image.size[0] > self.size[0] or offset[1] + image.size[1] > self.size[1]:
+            raise ValueError(f'区域 {offset} {image.size} 超出了画面 {self.size}')
+
+        self._write_frame(image.convert('RGB'), offset, duration)
+        self.frames += 1
+
+    def close(self):
+        """写入结束标记并保存到目标路径
+        """
+        if self.frames == 0:
+            self.abort()
+            raise ValueError('没有写入任何帧')
+
+        self._finish()
+        self._file.close()
+        os.replace(self._temp_path, self.file_path)
+
+    def abort(self):
+        """放弃写入并删除临时文件
+        """
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def _write_frame(self, image, offset, duration):
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+
+class GifWriter(AnimationWriter):
+    """
+    逐帧写入的 gif 动画
+    每一帧（变化区域）都单独量化为 256 色并写入自己的局部调色板，之后的帧只编码变化区域并保留之前的画面，
+    gif 单帧最多只能有 256 种颜色，颜色更多的区域会损失细节，需要无损结果时请使用 webp 或帧序列
+    """
+    def __init__(self, file_path, size, loop=0):
+        """
+        Args:
+            loop: 循环次数，0 为无限循环
+        """
+        super().__init__(file_path, size)
+        self.loop = loop
+
+        # 逻辑屏幕描述中不设置全局调色板，每一帧都使用局部调色板
+        self._file.write(b'GIF89a' + struct.pack('<HHBBB', size[0], size[1], 0, 0, 0))
+        self._file.write(b'!\xff\x0bNETSCAPE2.0' + struct.pack('<BBHB', 3, 1, loop, 0))
+
+    def _write_frame(self, image, offset, duration):
+        palette, interlace, data = self._encode(image.quantize(256, method=Image.FASTOCTREE))
+        # 图形控制扩展，disposal 1 表示保留该帧，下一帧只覆盖自己的区域，延迟的单位为 10 毫秒
+        self._file.write(b'!\xf9\x04' + struct.pack('<BHBB', 1 << 2, round(duration / 10), 0, 0))
+        # 图像描述，附带局部调色板，调色板大小为 2 ** (n + 1)，交错标记和 Pillow 编码时保持一致
+        flags = 0x80 | interlace | ((len(palette) // 3).bit_length() - 2)
+        self._file.write(b',' + struct.pack('<HHHHB', offset[0], offset[1], image.size[0], image.size[1], flags))
+        self._file.write(palette + data)
+
+    def _finish(self):
+        self._file.write(b';')
+
+    def _encode(self, image):
+        """使用 Pillow 把一帧保存为单张 gif，再从中取出调色板和图像数据
+
+        Args:
+            image: Image P 模式的一帧
+
+        Returns:
+            tuple: (调色板, 交错标记, 图像数据)，调色板已经补齐到 2 的整数次幂，图像数据包含 LZW 最小码长和所有数据子块
+        """
+        buffer = BytesIO()
+        image.save(buffer, 'GIF')
+        gif = buffer.getvalue()
+
+        flags = gif[10]
+        position = 13
+        palette = b''
+        if flags & 0x80:
+            palette = gif[position:position + 3 * 2 ** ((flags & 0x07) + 1)]
+            position += len(palette)
+
+        while gif[position] == 0x21:
+            # 跳过扩展块
+            position += 2
+            while gif[position]:
+                position += gif[position] + 1
+            position += 1
+
+        if gif[position] != 0x2c:
+            raise ValueError('无法解析 Pillow 保存的 gif')
+        flags = gif[position + 9]
+        position += 10
+        if flags & 0x80:
+            palette = gif[position:position + 3 * 2 ** ((flags & 0x07) + 1)]
+            position += len(palette)
+
+        start = position
+        position += 1
+        while gif[position]:
+            position += gif[position] + 1
+
+        return palette, flags & 0x40, gif[start:position + 1]
+
+
+class WebpWriter(AnimationWriter):
+    """
+    逐帧写入的 webp 动画
+    每一帧都单独编码为 webp 后封装为 ANMF 块，文件大小在关闭时回填
+    webp 要求帧的位置为偶数，所以变化区域的 x y 需要是偶数
+    """
+    def __init__(self, file_path, size, quality=None, loop=0):
+        """
+        Args:
+            quality: 0 - 100，为 None 时使用无损压缩
+            loop: 循环次数，0 为无限循环
+        """
+        super().__init__(file_path, size)
+        self.quality = quality
+        self.loop = loop
+
+        self._file.write(b'RIFF\x00\x00\x00\x00WEBP')
+        # VP8X 中只设置动画标记，画布尺寸保存为减一后的 24 位整数
+        self._write_chunk(b'VP8X', struct.pack('<I', 0x02) + self._pack_int24(size[0] - 1) + self._pack_int24(size[1] - 1))
+        # 背景色为不透明黑色
+        self._write_chunk(b'ANIM', struct.pack('<IH', 0xff000000, loop))
+
+    def _write_frame(self, image, offset, duration):
+        if offset[0] % 2 or offset[1] % 2:
+            raise ValueError(f'webp 帧的位置 {offset} 必须是偶数')
+
+        buffer = BytesIO()
+        if self.quality is None:
+            image.save(buffer, 'WEBP', lossless=True)
+        else:
+            image.save(buffer, 'WEBP', quality=self.quality)
+
+        header = (
+            self._pack_int24(offset[0] // 2) + self._pack_int24(offset[1] // 2) +
+            self._pack_int24(image.size[0] - 1) + self._pack_int24(image.size[1] - 1) +
+            self._pack_int24(duration) +
+            # 不和上一帧混合，显示后不清除
+            b'\x02'
+        )
+        self._write_chunk(b'ANMF', header + self._get_bitstream(buffer.getvalue()))
+
+    def _finish(self):
+        self._file.seek(4)
+        self._file.write(struct.pack('<I', os.path.getsize(self._temp_path) - 8))
+
+    def _get_bitstream(self, webp):
+        """从单张 webp 中取出图像数据块
+
+        Args:
+            webp: bytes webp 文件内容
+
+        Returns:
+            bytes: ALPH、VP8 或 VP8L 块
+        """
+        chunks = []
+        position = 12
+        while position < len(webp):
+            chunk_type = webp[position:position + 4]
+            chunk_size = struct.unpack('<I', webp[position + 4:position + 8])[0]
+            end = position + 8 + chunk_size + chunk_size % 2
+            if chunk_type in (b'ALPH', b'VP8 ', b'VP8L'):
+                chunks.append(webp[position:end])
+            position = end
+
+        return b''.join(chunks)
+
+    def _write_chunk(self, chunk_type, data):
+        """写入一个 riff 数据块，长度为奇数时补齐一个字节
+
+        Args:
+            chunk_type: bytes 块类型
+            data: bytes 块内容
+        """
+        self._file.write(chunk_type + struct.pack('<I', len(data)) + data + b'\x00' * (len(data) % 2))
+
+    def _pack_int24(self, value):
+        return struct.pack('<I', value)[:3]
+
+
+class FrameSequenceWriter(AnimationWriter):
+    """
+    逐帧保存为编号 png 的帧序列，可以交给 ffmpeg 等工具合成视频
+    所有帧按照 frame_duration 等间隔保存，显示时间更长的帧会以硬链接的形式重复，
+    file_path 为保存帧序列的目录，写入过程中会保存到临时目录
+    """
+    def __init__(self, file_path, size, frame_duration):
+        """
+        Args:
+            frame_duration: 每个文件对应的显示时间（毫秒）
+        """
+        self.file_path = file_path
+        self.size = size
+        self.frames = 0
+        self.frame_duration = frame_duration
+        self._temp_path = f'{file_path}.{os.getpid()}.tmp'
+        self._canvas = Image.new('RGB', size)
+        self._files = 0
+        os.makedirs(self._temp_path)
+
+    def _write_frame(self, image, offset, duration):
+        self._canvas.paste(image, offset)
+        first_path = self._get_file_path(self._files)
+        self._canvas.save(first_path)
+        self._files += 1
+
+        for _ in range(max(round(duration / self.frame_duration), 1) - 1):
+            self._link(first_path, self._get_file_path(self._files))
+            self._files += 1
+
+    def close(self):
+        if self.frames == 0:
+            self.abort()
+            raise ValueError('没有写入任何帧')
+
+        if os.path.exists(self.file_path):
+            shutil.rmtree(self.file_path)
+        os.replace(self._temp_path, self.file_path)
+
+    def abort(self):
+        if os.path.exists(self._temp_path):
+            shutil.rmtree(self._temp_path)
+
+    def _get_file_path(self, index):
+        return f'{self._temp_path}/{index:05d}.png'
+
+    def _link(self, source, target):
+        """重复保存同一帧，不支持硬链接时直接复制
+        """
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
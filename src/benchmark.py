@@ -0,0 +1,340 @@
+import argparse
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from os import devnull, makedirs
+
+from PIL import Image
+
+from screeps_world_view import ScreepsWorldView, ROOM_PIXEL, ROOM_PRE_SECTOR, ZOOM, COLORS, STATUS_MASKS, get_avatar_key
+from room_store import RoomStore
+from room_index import RoomIndex
+from http_cache import HttpCache
+from screeps_session import ScreepsSession
+from fake_server import FakeScreepsServer
+from region_server import RegionRenderer, RegionServer
+from http_client import create_session
+
+# shard0 的世界宽度，放大 3 倍后正好是 12000 * 12000 像素
+SHARD0_WIDTH = 182
+# 合成数据中各房间状态的比例
+ROOM_STATUS_WEIGHT = {
+    'normal': 80,
+    'out of borders': 15,
+    'respawn': 3,
+    'novice': 2
+}
+
+
+def create_view(width, room_ratio, owner_ratio, player_num, seed, cache_root):
+    """创建一个使用合成数据的 ScreepsWorldView
+    不会访问网络，底图为纯色，房间信息和头像都是随机生成的
+
+    Args:
+        width: 世界宽度，对应 world-size 接口返回的 width
+        room_ratio: 有信息的房间占所有房间的比例
+        owner_ratio: 有信息的房间中有所有者的比例
+        player_num: 玩家数量
+        seed: 随机种子，相同的种子会生成相同的世界
+        cache_root: 缓存目录
+
+    Returns:
+        ScreepsWorldView: 准备好绘制的实例
+    """
+    rand = random.Random(seed)
+
+    view = ScreepsWorldView.__new__(ScreepsWorldView)
+    view.shard = 0
+    view.shard_info = { 'width': width, 'height': width }
+    view.cache_path = f'{cache_root}/0'
+    view.dist_path = f'{cache_root}/dist'
+    view.avatar_path = f'{cache_root}/avatar'
+    view.sprite_atlas = False
+    view.sprites = {}
+    view.missing_avatars = set()
+    view.room_index = RoomIndex.get(view._get_quadrant_size())
+    view.rooms = RoomStore(view.room_index)
+    view.result_name = 'benchmark'
+    for dir_path in (view.cache_path, view.dist_path, view.avatar_path):
+        makedirs(dir_path, exist_ok=True)
+    view.avatar_cache = HttpCache(view.avatar_path)
+
+    side = view._get_sector_num() * ROOM_PRE_SECTOR * ROOM_PIXEL * ZOOM
+    view.background = Image.new('RGBA', (side, side), (0x80, 0x80, 0x80, 0xff))
+
+    players = [f'player{i}' for i in range(player_num)]
+    for player in players:
+        Image.new('RGBA', (100, 100), (rand.randrange(256), rand.randrange(256), rand.randrange(256), 0xff)).save(view.avatar_cache.get_path(get_avatar_key({ 'type': player })))
+
+    all_rooms = view._get_room_name()
+    for room_name in rand.sample(all_rooms, int(len(all_rooms) * room_ratio)):
+        status = rand.choices(list(ROOM_STATUS_WEIGHT), list(ROOM_STATUS_WEIGHT.values()))[0]
+        owner, rcl = None, 0
+        if status == 'normal' and rand.random() < owner_ratio:
+            owner = rand.choice(players)
+            rcl = rand.randint(0, 8)
+            view.rooms.add_owner(owner, { 'type': owner })
+        view.rooms.set(room_name, status, owner, rcl)
+
+    return view
+
+
+def pixel2room(view, pos):
+    """旧的像素位置转换，通过浮点运算把像素位置换算为房间名，仅用于比对
+
+    Args:
+        view: ScreepsWorldView 所在的实例
+        pos: tuple, 包含位置的 x y 值，如 (1400, 1400)
+
+    Returns:
+        string: 该位置所在的房间名称
+    """
+    room = ''
+    quadrant_size = view._get_quadrant_size()
+    pos_direction = ( ('E', 'W'), ('S', 'N'))
+
+    for i, axis in enumerate(pos):
+        code = quadrant_size - axis / (ROOM_PIXEL * ZOOM)
+        # 根据 code 的正负判断其所在象限
+        room += f'{pos_direction[i][0]}{math.floor(-code)}' if code <= 0 else f'{pos_direction[i][1]}{math.floor(code - 1)}'
+
+    return room
+
+
+def add_blend_mask(view, x, y, mask_type):
+    """旧的蒙版绘制，每个房间单独和纯色蒙版调用一次 Image.blend，仅用于比对
+
+    Args:
+        view: ScreepsWorldView 要绘制的实例
+        x: 要添加到的房间左上角的 x 轴像素位置
+        y: 要添加到的房间左上角的 y 轴像素位置
+        mask_type: 蒙版类型, inactivated respawn novice 三者之一
+    """
+    size = ROOM_PIXEL * ZOOM
+    mask = Image.new('RGBA', (size, size), COLORS[mask_type])
+    room = view.background.crop((x, y, x + size, y + size))
+    view.background.paste(Image.blend(room, mask, 0.3), (x, y))
+
+
+def draw_by_scan(view):
+    """旧的绘制循环
+    从像素角度遍历画布上所有的房间格子，再通过 pixel2room 查找房间信息，并逐个房间混色蒙版、粘贴头像，仅用于比对
+
+    Args:
+        view: ScreepsWorldView 要绘制的实例
+    """
+    sector_num = view._get_sector_num()
+    room_size = ROOM_PIXEL * ZOOM
+    for x in range(0, sector_num * ROOM_PRE_SECTOR * room_size, room_size):
+        for y in range(0, sector_num * ROOM_PRE_SECTOR * room_size * 2, room_size):
+            room = view.rooms.get(pixel2room(view, (x, y)))
+            if room is None:
+                continue
+
+            if room['status'] in STATUS_MASKS:
+                add_blend_mask(view, x, y, STATUS_MASKS[room['status']])
+            if 'owner' in room:
+                avatar = view._get_avatar_sprite(room['owner'], rcl=room['rcl'])
+                if not avatar: continue
+                view.background.paste(avatar, (x + int((room_size - avatar.size[0]) / 2), y + int((room_size - avatar.size[1]) / 2)), mask=avatar)
+
+
+def draw_by_index(view):
+    """新的绘制循环
+    直接遍历房间信息中有信息的房间，并一次性绘制所有区域蒙版，和 ScreepsWorldView.draw_world 一致
+
+    Args:
+        view: ScreepsWorldView 要绘制的实例
+    """
+    view._draw_rooms(view._get_room_rows())
+
+
+def bench_draw_world(args):
+    """比较两种绘制循环的耗时
+    两者都会在同一份合成数据的副本上绘制，并校验绘制结果是否一致
+    """
+    with tempfile.TemporaryDirectory() as cache_root:
+        view = create_view(args.width, args.room_ratio, args.owner_ratio, args.player_num, args.seed, cache_root)
+        background = view.background.copy()
+        print(f'世界宽度 {args.width}，画布 {view.background.size[0]}px，房间 {len(view.rooms)} 个，玩家 {len(view.users)} 名')
+
+        results = {}
+        for name, draw in (('scan', draw_by_scan), ('index', draw_by_index)):
+            view.background = background.copy()
+            view.sprites = {}
+            with open(devnull, 'w') as null, redirect_stdout(null):
+                start = time.perf_counter()
+                draw(view)
+                cost = time.perf_counter() - start
+            results[name] = view.background
+            print(f'{name:>6}: {cost:.3f}s')
+
+        print('结果一致' if results['scan'].tobytes() == results['index'].tobytes() else '结果不一致！')
+
+
+def run_draw(shard, server):
+    """在当前目录下完整地绘制一次指定 shard
+
+    Args:
+        shard: 要绘制的 shard
+        server: FakeScreepsServer 提供接口的服务器
+
+    Returns:
+        dict: 总耗时、各阶段的耗时以及从服务器下载的字节数
+    """
+    requests, bytes_sent = server.requests, server.bytes_sent
+    api = ScreepsSession(api_url=server.api_url, token_path=None)
+
+    with open(devnull, 'w') as null, redirect_stdout(null):
+        start = time.perf_counter()
+        view = ScreepsWorldView(shard, quiet=True, api=api, tile_url=server.tile_url)
+        view.draw()
+        cost = time.perf_counter() - start
+
+    return {
+        'total': cost,
+        'stages': { name: record['time'] for name, record in view.report.to_dict()['stages'].items() },
+        'requests': server.requests - requests,
+        'bytes': server.bytes_sent - bytes_sent
+    }
+
+
+def bench_draw(args):
+    """测试 ScreepsWorldView.draw 的端到端耗时
+    会启动离线的接口服务器，先在空的缓存目录中绘制一次（冷缓存），再在同一个目录中重复绘制（热缓存），
+    热缓存的结果取多次中最快的一次，指定了 --baseline 时会和之前保存的结果比较
+    """
+    cwd = os.getcwd()
+    results = {}
+    with FakeScreepsServer(args.seed, args.latency) as server, tempfile.TemporaryDirectory() as root:
+        os.chdir(root)
+        try:
+            with open('config.json', 'w') as config:
+                json.dump({ 'username': 'benchmark', 'password': 'benchmark' }, config)
+
+            results['cold'] = run_draw(args.shard, server)
+            warm_runs = [ run_draw(args.shard, server) for _ in range(args.repeat) ]
+            results['warm'] = min(warm_runs, key=lambda result: result['total'])
+        finally:
+            os.chdir(cwd)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print(f'shard{args.shard}，模拟延迟 {args.latency}s')
+    for name, result in results.items():
+        print(f'{name}: {result["total"]:.3f}s，请求 {result["requests"]} 次，下载 {result["bytes"] / 1024 / 1024:.1f} MB')
+        for stage, cost in [('total', result['total']), *result['stages'].items()]:
+            line = f'{stage:>12}: {cost:8.3f}s'
+            if baseline and name in baseline:
+                before = baseline[name]['total'] if stage == 'total' else baseline[name]['stages'].get(stage)
+                if before:
+                    line += f'  {(cost - before) / before:+.0%}'
+            print(line)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=4)
+        print(f'结果已保存至 {args.output}')
+
+
+def bench_region(args):
+    """测试按需绘制区域服务器的吞吐量和延迟
+    先使用离线的接口服务器完整绘制一次，生成底图缓存和历史房间信息，再启动区域绘制服务器，
+    由 --concurrency 个线程按区块发送 --requests 次请求，其中 --hot-ratio 的请求集中在十分之一的热门区块上
+    """
+    cwd = os.getcwd()
+    with FakeScreepsServer(args.seed, args.latency) as server, tempfile.TemporaryDirectory() as root:
+        os.chdir(root)
+        try:
+            with open('config.json', 'w') as config:
+                json.dump({ 'username': 'benchmark', 'password': 'benchmark' }, config)
+            run_draw(args.shard, server)
+
+            renderer = RegionRenderer()
+            with open(devnull, 'w') as null, redirect_stdout(null):
+                x_sectors_name, y_sectors_name = renderer.get_view(args.shard)._get_sectors_name()
+            sectors = [ x_name + y_name for y_name in y_sectors_name for x_name in x_sectors_name ]
+
+            rand = random.Random(args.seed)
+            hot_sectors = rand.sample(sectors, max(len(sectors) // 10, 1))
+            targets = [ rand.choice(hot_sectors) if rand.random() < args.hot_ratio else rand.choice(sectors) for _ in range(args.requests) ]
+
+            with RegionServer(renderer) as region_server:
+                session = create_session(args.concurrency)
+
+                def request(sector):
+                    start = time.perf_counter()
+                    r = session.get(f'{region_server.url}/region', params={ 'shard': args.shard, 'sector': sector, 'zoom': args.zoom })
+                    r.raise_for_status()
+                    return time.perf_counter() - start, r.headers['X-Region-Cache'] == 'hit'
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                    responses = list(executor.map(request, targets))
+                total = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+
+    latencies = sorted(latency for latency, _ in responses)
+    percentile = lambda ratio: latencies[min(int(len(latencies) * ratio), len(latencies) - 1)]
+    result = {
+        'throughput': len(responses) / total,
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'hit_ratio': sum(hit for _, hit in responses) / len(responses)
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print(f'shard{args.shard}，{len(sectors)} 个区块，{args.requests} 次请求，并发 {args.concurrency}，缩放 {args.zoom}')
+    for name, value in result.items():
+        line = f'{name:>12}: ' + (f'{value:8.1f} req/s' if name == 'throughput' else f'{value:8.1%}' if name == 'hit_ratio' else f'{value * 1000:8.1f} ms')
+        if baseline and baseline.get(name):
+            line += f'  {(value - baseline[name]) / baseline[name]:+.0%}'
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=4)
+        print(f'结果已保存至 {args.output}')
+
+
+BENCHMARKS = {
+    'draw_world': bench_draw_world,
+    'draw': bench_draw,
+    'region': bench_region
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='使用合成数据测试绘制性能')
+    parser.add_argument('benchmark', choices=list(BENCHMARKS), help='要运行的测试')
+    parser.add_argument('--width', type=int, default=SHARD0_WIDTH, help='世界宽度，默认为 shard0 的尺寸')
+    parser.add_argument('--room-ratio', type=float, default=1.0, help='有信息的房间占所有房间的比例')
+    parser.add_argument('--owner-ratio', type=float, default=0.2, help='普通房间中有所有者的比例')
+    parser.add_argument('--player-num', type=int, default=1500, help='玩家数量')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--shard', type=int, default=3, choices=range(4), help='draw / region 测试要绘制的 shard，世界规模和官方服务器接近')
+    parser.add_argument('--latency', type=float, default=0, help='draw / region 测试中每个请求的模拟延迟（秒）')
+    parser.add_argument('--repeat', type=int, default=3, help='draw 测试中热缓存绘制的次数')
+    parser.add_argument('--requests', type=int, default=500, help='region 测试的请求次数')
+    parser.add_argument('--concurrency', type=int, default=8, help='region 测试同时发送请求的线程数')
+    parser.add_argument('--zoom', type=float, default=0.5, help='region 测试请求的缩放比例')
+    parser.add_argument('--hot-ratio', type=float, default=0.8, help='region 测试中请求热门区块的比例')
+    parser.add_argument('--output', help='draw / region 测试结果的保存路径')
+    parser.add_argument('--baseline', help='之前保存的 draw / region 测试结果，会显示各项结果的变化')
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,340 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from io import BytesIO
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image
+
+# 各个 shard 的世界宽度，和官方服务器的规模接近
+FAKE_SHARD_WIDTH = {
+    0: 182,
+    1: 82,
+    2: 82,
+    3: 42
+}
+# 各个 shard 的玩家数量
+FAKE_SHARD_PLAYERS = {
+    0: 1500,
+    1: 400,
+    2: 400,
+    3: 150
+}
+# 有信息的房间中各状态的比例，novice 和 respawn 会转换为对应的时间戳字段
+FAKE_ROOM_STATUS_WEIGHT = {
+    'normal': 80,
+    'out of borders': 15,
+    'respawn': 3,
+    'novice': 2
+}
+# 普通房间中有所有者的比例
+FAKE_OWNER_RATIO = 0.2
+# 新手区和重生区的结束时间，设置在很远的未来，保证每次生成的结果都一样
+FAKE_AREA_TIMESTAMP = 4102444800000
+# 合成瓦片中每个地形格子的边长像素值，瓦片边长为 200 像素
+FAKE_TERRAIN_PIXEL = 10
+
+
+class FakeScreepsWorld:
+    """
+    确定性的合成世界
+    同样的种子和 shard 每次都会生成同样的房间信息、头像和瓦片，不需要提前生成，请求到哪里就生成到哪里
+
+    Usage:
+        world = FakeScreepsWorld(seed=0)
+        world.get_world_size(3)
+        world.get_map_stats(3, ['W1N1', 'W1N2'])
+    """
+    # 随机种子
+    seed = 0
+
+    def __init__(self, seed=0):
+        self.seed = seed
+
+    def get_world_size(self, shard):
+        """生成 /api/game/world-size 的返回值
+
+        Args:
+            shard: number 要获取的 shard
+
+        Returns:
+            dict: 世界尺寸
+        """
+        width = FAKE_SHARD_WIDTH[shard]
+        return { 'ok': 1, 'width': width, 'height': width }
+
+    def get_map_stats(self, shard, room_names):
+        """生成 /api/game/map-stats 的返回值
+
+        Args:
+            shard: number 房间所在的 shard
+            room_names: 要获取的房间名列表
+
+        Returns:
+            dict: 房间信息及其中出现的玩家信息
+        """
+        stats = {}
+        users = {}
+        for room_name in room_names:
+            rand = random.Random(f'{self.seed}/{shard}/{room_name}')
+            status = rand.choices(list(FAKE_ROOM_STATUS_WEIGHT), list(FAKE_ROOM_STATUS_WEIGHT.values()))[0]
+            room = { 'status': 'normal' if status in ('novice', 'respawn') else status }
+            if status == 'novice':
+                room['novice'] = FAKE_AREA_TIMESTAMP
+            elif status == 'respawn':
+                room['respawnArea'] = FAKE_AREA_TIMESTAMP
+            elif status == 'normal' and rand.random() < FAKE_OWNER_RATIO:
+                user_id = f'user{rand.randrange(FAKE_SHARD_PLAYERS[shard])}'
+                room['own'] = { 'user': user_id, 'level': rand.randint(0, 8) }
+                users[user_id] = { '_id': user_id, 'username': user_id, 'badge': self.get_badge(user_id) }
+            stats[room_name] = room
+
+        return { 'ok': 1, 'stats': stats, 'users': users }
+
+    def get_badge(self, username):
+        """生成玩家的头像设置
+
+        Args:
+            username: string 玩家名
+
+        Returns:
+            dict: 头像设置
+        """
+        rand = random.Random(f'{self.seed}/badge/{username}')
+        color = lambda: '#%06x' % rand.randrange(0x1000000)
+        return { 'type': rand.randint(1, 24), 'color1': color(), 'color2': color(), 'color3': color(), 'param': rand.randint(-100, 100), 'flip': rand.random() < 0.5 }
+
+    def get_badge_svg(self, username):
+        """生成 /api/user/badge-svg 的返回值
+
+        Args:
+            username: string 玩家名
+
+        Returns:
+            bytes: 头像 svg
+        """
+        badge = self.get_badge(username)
+        return (
+            '<svg xmlns="http://www.w3.org/2000/svg" width="100" height="100" viewBox="0 0 100 100">'
+            f'<circle cx="50" cy="50" r="50" fill="{badge["color1"]}"/>'
+            f'<rect x="{50 + badge["param"] // 4}" y="0" width="25" height="100" fill="{badge["color2"]}"/>'
+            f'<circle cx="50" cy="50" r="{badge["type"]}" fill="{badge["color3"]}"/>'
+            '</svg>'
+        ).encode()
+
+    def get_tile(self, shard, sector_name):
+        """生成区块瓦片
+        由随机的地形格子组成，压缩后的体积和真实瓦片接近
+
+        Args:
+            shard: number 区块所在的 shard
+            sector_name: string 区块名
+
+        Returns:
+            bytes: png 图片
+        """
+        rand = random.Random(f'{self.seed}/{shard}/tile/{sector_name}')
+        size = 200 // FAKE_TERRAIN_PIXEL
+        terrain = Image.frombytes('L', (size, size), bytes(rand.choice((0x2b, 0x2b, 0x2b, 0x43, 0x11)) for _ in range(size * size)))
+
+        buffer = BytesIO()
+        terrain.resize((200, 200), Image.NEAREST).convert('RGBA').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+
+class FakeScreepsHandler(BaseHTTPRequestHandler):
+    """
+    模拟 screeps 接口和瓦片 cdn 的请求处理器
+    接口地址为 {url}/api，瓦片地址为 {url}/map
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        world = self.server.world
+
+        if url.path == '/api/game/world-size':
+            return self._send_json(world.get_world_size(self._parse_shard(query['shard'][0])))
+        if url.path == '/api/user/badge-svg':
+            return self._send(world.get_badge_svg(query['username'][0]), 'image/svg+xml')
+
+        match = re.fullmatch(r'/map/shard(\d+)/zoom1/(\w+)\.png', url.path)
+        if match:
+            return self._send(world.get_tile(int(match[1]), match[2]), 'image/png')
+
+        self.send_error(404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or '{}')
+        world = self.server.world
+
+        if url.path == '/api/auth/signin':
+            return self._send_json({ 'ok': 1, 'token': self.server.create_token() })
+        if url.path == '/api/game/map-stats':
+            if not self.server.check_token(self.headers.get('X-Token')):
+                return self.send_error(401)
+            return self._send_json(world.get_map_stats(self._parse_shard(body['shard']), body['rooms']), { 'X-Token': self.server.create_token() })
+
+        self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+    def _parse_shard(self, shard_name):
+        """将 shard 名转换为编号
+
+        Args:
+            shard_name: string 如 shard3
+
+        Returns:
+            number: shard 编号
+        """
+        return int(shard_name.replace('shard', ''))
+
+    def _send_json(self, content, headers=None):
+        """返回 json 响应
+        """
+        self._send(json.dumps(content).encode(), 'application/json', headers)
+
+    def _send(self, content, content_type, headers=None):
+        """返回响应，会先等待 latency 秒用于模拟网络延迟
+        响应中带有内容哈希作为 ETag，请求的 If-None-Match 和 ETag 一致时返回 304
+        """
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        etag = f'"{hashlib.sha1(content).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.server.count(0)
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.server.count(len(content))
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakeScreepsServer(ThreadingHTTPServer):
+    """
+    离线的 screeps 接口服务器
+    在后台线程中运行，用于在没有账号和网络的情况下测试绘制流程
+
+    Usage:
+        with FakeScreepsServer(seed=0) as server:
+            api = ScreepsSession(api_url=server.api_url, token_path=None)
+            view = ScreepsWorldView(3, api=api, tile_url=server.tile_url)
+    """
+    daemon_threads = True
+    # 合成世界，见 FakeScreepsWorld
+    world = None
+    # 每个请求的模拟延迟（秒）
+    latency = 0
+    # 已处理的请求数量及返回的字节数
+    requests = 0
+    bytes_sent = 0
+
+    def __init__(self, seed=0, latency=0, host='127.0.0.1', port=0):
+        """
+        Args:
+            seed: 合成世界的随机种子
+            latency: 每个请求的模拟延迟（秒）
+            host: 监听地址
+            port: 监听端口，为 0 时使用随机端口
+        """
+        super().__init__((host, port), FakeScreepsHandler)
+        self.world = FakeScreepsWorld(seed)
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self._tokens = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    @property
+    def api_url(self):
+        return f'{self.url}/api'
+
+    @property
+    def tile_url(self):
+        return f'{self.url}/map'
+
+    def start(self):
+        """在后台线程中启动服务器
+
+        Returns:
+            self: 自身
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """关闭服务器
+        """
+        self.shutdown()
+        self.server_close()
+
+    def create_token(self):
+        """生成一个新的 token，和官方接口一样每次请求后都会换成新的 token
+
+        Returns:
+            string: token
+        """
+        with self._lock:
+            token = f'token{len(self._tokens)}'
+            self._tokens.add(token)
+        return token
+
+    def check_token(self, token):
+        """检查 token 是否由本服务器生成
+
+        Returns:
+            bool: 是否有效
+        """
+        with self._lock:
+            return token in self._tokens
+
+    def count(self, size):
+        """记录一次请求
+
+        Args:
+            size: 返回的字节数
+        """
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += size
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='启动离线的 screeps 接口服务器')
+    parser.add_argument('--port', type=int, default=21025, help='监听端口')
+    parser.add_argument('--seed', type=int, default=0, help='合成世界的随机种子')
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的模拟延迟（秒）')
+    args = parser.parse_args()
+
+    server = FakeScreepsServer(args.seed, args.latency, port=args.port)
+    print(f'接口地址 {server.api_url}，瓦片地址 {server.tile_url}')
+    server.serve_forever()
@@ -0,0 +1,26 @@
+import os
+import threading
+
+
+def write_atomic(file_path, content, permission=None):
+    """原子地写入文件
+    先写入同目录下的临时文件再替换过去，中途被打断也不会留下写了一半的文件
+
+    Args:
+        file_path: string 要写入的文件路径
+        content: bytes | string 要写入的内容，也可以是产生 bytes 的迭代器，用于分批写入较大的内容
+        permission: 文件权限，如 0o600，为 None 时使用默认权限，保存 token 等敏感内容时使用
+    """
+    temp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    mode = 'w' if isinstance(content, str) else 'wb'
+    chunks = [ content ] if isinstance(content, (bytes, str)) else content
+    try:
+        # 指定权限时在创建临时文件时就设置好，替换后的文件不会有其他用户可读的时刻
+        opener = None if permission is None else lambda file_path, flags: os.open(file_path, flags, permission)
+        with open(temp_path, mode, opener=opener) as file:
+            for chunk in chunks:
+                file.write(chunk)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
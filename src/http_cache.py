@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import time
+from os import path
+
+from file_utils import write_atomic
+
+# 缓存目录中保存条件请求验证信息的文件名
+VALIDATORS_NAME = 'validators.json'
+
+
+class HttpCache:
+    """
+    支持条件请求和 LRU 淘汰的下载缓存
+    每个缓存文件都会记录服务器返回的 ETag / Last-Modified，超过 revalidate_after 秒后再使用时会带上
+    If-None-Match / If-Modified-Since 向服务器重新验证，服务器返回 304 时直接使用缓存，不需要重新下载
+    每次使用缓存文件都会更新它的修改时间，目录超过 max_size 时会从最久没有使用的文件开始删除
+
+    验证信息在 save 时会和磁盘上的最新内容合并后保存，多个进程共用一个目录时最多只会丢失部分验证信息，
+    丢失后对应的文件会在下次验证时重新下载一次
+
+    Usage:
+        cache = HttpCache('.screeps_cache/avatar', max_size=64 * 1024 * 1024)
+        if not cache.is_fresh(key):
+            r = cache.fetch(key, lambda headers: session.get(url, headers=headers))
+            if r is not None: cache.put(key, r.content, r)
+        cache.evict()
+        cache.save()
+    """
+    # 缓存目录
+    root = ''
+    # 缓存目录的大小上限（字节），为 None 时不限制
+    max_size = None
+    # 缓存文件在多久之后需要重新验证（秒），为 None 时永远不需要重新验证
+    revalidate_after = None
+
+    def __init__(self, root, max_size=None, revalidate_after=None):
+        """
+        Args:
+            root: 缓存目录，不存在时会自动创建
+            max_size: 见 HttpCache.max_size
+            revalidate_after: 见 HttpCache.revalidate_after
+        """
+        self.root = root
+        self.max_size = max_size
+        self.revalidate_after = revalidate_after
+        os.makedirs(root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._validators = self._load_validators()
+        # 本次修改过和删除的验证信息，保存时只合并这些内容
+        self._changed = set()
+        # 本次使用过的文件，淘汰时不会删除
+        self._used = set()
+
+    def get_path(self, key):
+        """获取缓存文件的路径
+
+        Args:
+            key: string 缓存文件名
+
+        Returns:
+            string: 缓存文件路径
+        """
+        return f'{self.root}/{key}'
+
+    def has(self, key):
+        return path.exists(self.get_path(key))
+
+    def is_fresh(self, key):
+        """缓存文件是否存在并且不需要重新验证
+        没有验证信息的文件（如旧版本留下的缓存）会从现在开始计算验证时间
+
+        Returns:
+            bool: 是否可以直接使用
+        """
+        if not self.has(key):
+            return False
+        if self.revalidate_after is None:
+            return True
+
+        with self._lock:
+            if key not in self._validators:
+                self._validators[key] = { 'validated': time.time() }
+                self._changed.add(key)
+            return time.time() - self._validators[key]['validated'] < self.revalidate_after
+
+    def touch(self, key):
+        """标记缓存文件被使用了一次，用于 LRU 淘汰
+
+        Args:
+            key: string 缓存文件名
+        """
+        with self._lock:
+            self._used.add(key)
+        try:
+            os.utime(self.get_path(key))
+        except FileNotFoundError:
+            pass
+
+    def fetch(self, key, send):
+        """向服务器请求新内容，已有缓存时会带上条件请求头
+
+        Args:
+            key: string 缓存文件名
+            send: 发送请求的函数，参数为要附加的请求头，返回 requests.Response
+
+        Returns:
+            requests.Response: 服务器返回的新内容，缓存仍然有效（服务器返回 304）时为 None
+        """
+        headers = {}
+        if self.has(key):
+            with self._lock:
+                validator = self._validators.get(key, {})
+            if validator.get('etag'):
+                headers['If-None-Match'] = validator['etag']
+            if validator.get('last_modified'):
+                headers['If-Modified-Since'] = validator['last_modified']
+
+        r = send(headers)
+        r.raise_for_status()
+        if r.status_code != 304:
+            return r
+
+        with self._lock:
+            self._validators.setdefault(key, {})['validated'] = time.time()
+            self._changed.add(key)
+        self.touch(key)
+        return None
+
+    def put(self, key, content, response=None):
+        """保存缓存文件
+
+        Args:
+            key: string 缓存文件名
+            content: bytes 要保存的内容，可以和响应内容不同（如转换后的图片）
+            response: requests.Response 内容对应的响应，用于记录验证信息
+
+        Returns:
+            bool: 内容是否和之前的缓存不同，之前没有缓存时为 True
+        """
+        file_path = self.get_path(key)
+        changed = True
+        if path.exists(file_path):
+            with open(file_path, 'rb') as cache_file:
+                changed = cache_file.read() != content
+        if changed:
+            write_atomic(file_path, content)
+
+        headers = response.headers if response is not None else {}
+        with self._lock:
+            self._validators[key] = {
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'validated': time.time()
+            }
+            self._changed.add(key)
+        self.touch(key)
+        return changed
+
+    def evict(self):
+        """按照 LRU 删除缓存文件直到目录大小不超过 max_size
+        本次使用过的文件不会被删除
+
+        Returns:
+            number: 删除的字节数
+        """
+        if self.max_size is None:
+            return 0
+
+        files = []
+        for entry in os.scandir(self.root):
+            if entry.is_file() and entry.name != VALIDATORS_NAME and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.name))
+
+        total_size = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, key in sorted(files):
+            if total_size - removed <= self.max_size:
+                break
+            if key in self._used:
+                continue
+            try:
+                os.remove(self.get_path(key))
+            except FileNotFoundError:
+                continue
+            removed += size
+            with self._lock:
+                self._validators.pop(key, None)
+                self._changed.add(key)
+
+        return removed
+
+    def save(self):
+        """保存验证信息，会先和磁盘上其他进程保存的内容合并
+        """
+        with self._lock:
+            if not self._changed:
+                return
+            validators = self._load_validators()
+            for key in self._changed:
+                if key in self._validators:
+                    validators[key] = self._validators[key]
+                else:
+                    validators.pop(key, None)
+            self._validators = validators
+            self._changed = set()
+            write_atomic(f'{self.root}/{VALIDATORS_NAME}', json.dumps(validators))
+
+    def _load_validators(self):
+        """读取磁盘上的验证信息
+
+        Returns:
+            dict: 键为缓存文件名，值为 etag、last_modified 和最后一次验证的时间 validated
+        """
+        validators_path = f'{self.root}/{VALIDATORS_NAME}'
+        if not path.exists(validators_path):
+            return {}
+        try:
+            with open(validators_path) as validators_file:
+                return json.load(validators_file)
+        except ValueError:
+            return {}
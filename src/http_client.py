@@ -0,0 +1,32 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 并发下载时的最大线程数，同时也是连接池的大小
+DOWNLOAD_WORKERS = 8
+# 单次请求的超时时间（秒）
+REQUEST_TIMEOUT = 30
+# 单次请求失败后的最大重试次数
+REQUEST_RETRIES = 3
+# 重试的退避系数，第 n 次重试前会等待 backoff * 2 ^ (n - 1) 秒
+REQUEST_BACKOFF = 0.5
+
+
+def create_session(pool_size=DOWNLOAD_WORKERS, retries=REQUEST_RETRIES):
+    """新建带连接池的会话
+    会话中的所有请求会复用连接，并在连接失败或服务器返回 5xx / 429 时自动重试
+
+    Args:
+        pool_size: 连接池大小，应不小于使用该会话的线程数
+        retries: 单次请求的最大重试次数
+
+    Returns:
+        requests.Session: 新建的会话
+    """
+    retry = Retry(total=retries, backoff_factor=REQUEST_BACKOFF, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
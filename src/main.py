@@ -1,10 +1,10 @@
-from screeps_world_view import ScreepsWorldView
+from render_scheduler import render_shards, RENDER_WORKERS
 
 # 要绘制的 shard
 DRAW_SHARD = [ 3, 2, 1, 0 ]
 
 if __name__ == "__main__":
-    # 遍历所有 shard 进行下载
-    for i in DRAW_SHARD:
-        view = ScreepsWorldView(i)
-        view.draw()
\ No newline at end of file
+    # 绘制所有 shard
+    failures = render_shards(DRAW_SHARD, RENDER_WORKERS)
+    for shard, err in failures.items():
+        print(f'Shard{shard} 绘制失败:\n', err)
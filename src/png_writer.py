@@ -0,0 +1,115 @@
+import os
+import struct
+import zlib
+
+# png 文件头
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# 每个 IDAT 块的最大长度
+IDAT_SIZE = 1 << 20
+
+
+class PngWriter:
+    """
+    逐行写入的 png 文件，用于在不持有整张图片的情况下保存超大图片
+    只支持 RGBA 图片，写入完成前内容会保存在临时文件中，关闭时才会替换到目标路径
+
+    Usage:
+        with PngWriter('result.png', (width, height)) as writer:
+            writer.write(band)
+    """
+    # 目标路径
+    file_path = ''
+    # 图片尺寸
+    size = None
+    # 已经写入的行数
+    rows = 0
+
+    def __init__(self, file_path, size, compress_level=6):
+        """新建 png 文件
+
+        Args:
+            file_path: 要保存到的路径
+            size: 图片尺寸 (width, height)
+            compress_level: zlib 压缩等级，0 - 9
+        """
+        self.file_path = file_path
+        self.size = size
+        self.rows = 0
+        self._temp_path = f'{file_path}.{os.getpid()}.tmp'
+        self._file = open(self._temp_path, 'wb')
+        self._compressor = zlib.compressobj(compress_level)
+        self._buffer = b''
+
+        self._file.write(PNG_SIGNATURE)
+        # 位深 8，颜色类型 6 (RGBA)，默认压缩方式，默认过滤方式，不隔行扫描
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, 6, 0, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, image):
+        """追加写入若干行
+
+        Args:
+            image: Image 要写入的图片，宽度需要和整张图片一致
+        """
+        if image.size[0] != self.size[0]:
+            raise ValueError(f'图片宽度 {image.size[0]} 与 {self.size[0]} 不一致')
+        if self.rows + image.size[1] > self.size[1]:
+            raise ValueError(f'写入的行数超过了图片高度 {self.size[1]}')
+
+        raw = image.convert('RGBA').tobytes()
+        stride = self.size[0] * 4
+        # 每行前面都要加上过滤类型，这里统一使用 0（不过滤）
+        self._buffer += self._compressor.compress(b''.join(b'\x00' + raw[i:i + stride] for i in range(0, len(raw), stride)))
+        self.rows += image.size[1]
+        self._flush(IDAT_SIZE)
+
+    def close(self):
+        """写入结束标记并保存到目标路径
+        写入的行数必须和图片高度一致
+        """
+        if self.rows != self.size[1]:
+            self.abort()
+            raise ValueError(f'只写入了 {self.rows} 行，图片高度为 {self.size[1]}')
+
+        self._buffer += self._compressor.flush()
+        self._flush(1)
+        self._write_chunk(b'IEND', b'')
+        self._file.close()
+        os.replace(self._temp_path, self.file_path)
+
+    def abort(self):
+        """放弃写入并删除临时文件
+        """
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def _flush(self, min_size):
+        """把缓冲区中的压缩数据写入为 IDAT 块
+
+        Args:
+            min_size: 缓冲区至少达到该长度时才写入
+        """
+        while len(self._buffer) >= min_size and self._buffer:
+            self._write_chunk(b'IDAT', self._buffer[:IDAT_SIZE])
+            self._buffer = self._buffer[IDAT_SIZE:]
+
+    def _write_chunk(self, chunk_type, data):
+        """写入一个 png 数据块
+
+        Args:
+            chunk_type: bytes 块类型
+            data: bytes 块内容
+        """
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
@@ -0,0 +1,52 @@
+import mmap
+import struct
+
+from PIL import Image
+
+from file_utils import write_atomic
+
+# 文件头标识
+RAW_MAGIC = b'SWVRAW01'
+# 文件头长度，标识后面跟着图片的宽高
+RAW_HEADER_SIZE = len(RAW_MAGIC) + 8
+# 保存时每次写入的行数
+RAW_WRITE_ROWS = 256
+
+
+def save_raw(file_path, image):
+    """将图片保存为未压缩的 RGBA 数据
+    会分批写入，不会额外复制整张图片
+
+    Args:
+        file_path: 保存路径
+        image: Image 要保存的图片
+    """
+    image = image.convert('RGBA')
+    width, height = image.size
+
+    def chunks():
+        yield RAW_MAGIC + struct.pack('>II', width, height)
+        for top in range(0, height, RAW_WRITE_ROWS):
+            yield image.crop((0, top, width, min(top + RAW_WRITE_ROWS, height))).tobytes()
+
+    write_atomic(file_path, chunks())
+
+
+def load_raw(file_path):
+    """通过内存映射加载未压缩的 RGBA 数据
+    加载时不需要解码，返回的图片是只读的，修改时 pillow 会自动复制一份
+
+    Args:
+        file_path: 文件路径
+
+    Returns:
+        Image: 加载的图片
+    """
+    with open(file_path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mapped[:len(RAW_MAGIC)] != RAW_MAGIC:
+        raise ValueError(f'{file_path} 不是有效的 raw 图片')
+    size = struct.unpack('>II', mapped[len(RAW_MAGIC):RAW_HEADER_SIZE])
+
+    return Image.frombuffer('RGBA', size, memoryview(mapped)[RAW_HEADER_SIZE:], 'raw', 'RGBA', 0, 1)
@@ -0,0 +1,399 @@
+import argparse
+import json
+import re
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from io import BytesIO
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image
+
+from screeps_world_view import ScreepsWorldView, ROOM_PIXEL, ROOM_PRE_SECTOR, ZOOM
+from room_archive import RoomArchive, ARCHIVE_PATH
+
+# 绘制好的区域的缓存大小上限（字节），按照编码后的大小计算，超出时从最久没有访问的区域开始删除
+REGION_CACHE_SIZE = 64 * 1024 * 1024
+# 同时保留房间信息的日期数量，超出时从最久没有访问的日期开始释放
+REGION_DATES = 4
+# 单个区域放大前的最大像素数，避免一次请求绘制过大的区域
+REGION_MAX_PIXELS = 6000 * 6000
+# 按照玩家请求区域时，在玩家所有房间的外围额外包含的房间数
+REGION_OWNER_PADDING = 1
+# 支持的输出格式及对应的 Content-Type
+REGION_FORMATS = {
+    'png': 'image/png',
+    'webp': 'image/webp'
+}
+
+
+class RegionCache:
+    """
+    按照编码后的大小限制总量的 LRU 缓存，可以在多个线程中使用
+    """
+    # 缓存大小上限（字节）
+    max_size = 0
+    # 命中及未命中的次数
+    hits = 0
+    misses = 0
+
+    def __init__(self, max_size=REGION_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """获取缓存的内容并标记为最近使用
+
+        Returns:
+            bytes: 缓存的内容，没有缓存时为 None
+        """
+        with self._lock:
+            content = self._items.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return content
+
+    def put(self, key, content):
+        """保存内容，超出上限时删除最久没有使用的内容，比上限还大的内容不会保存
+
+        Args:
+            key: 缓存键
+            content: bytes 要保存的内容
+        """
+        if len(content) > self.max_size:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= len(self._items.pop(key))
+            self._items[key] = content
+            self.size += len(content)
+            while self.size > self.max_size:
+                self.size -= len(self._items.popitem(last=False)[1])
+
+
+class RegionRenderer:
+    """
+    按需绘制世界中的一块区域
+    每个 shard 的底图只会加载一次，每个日期的房间信息从历史房间信息中加载（见 room_archive.RoomArchive），
+    渲染好的头像按照日期保留，绘制好的区域编码后保存在 LRU 缓存中，再次请求同一区域时不需要重新绘制
+
+    Usage:
+        renderer = RegionRenderer()
+        content, hit = renderer.render(3, sector='W9N9', zoom=0.5)
+    """
+    # 历史房间信息的保存路径
+    archive_path = ARCHIVE_PATH
+    # 绘制好的区域，见 RegionCache
+    cache = None
+
+    def __init__(self, cache_size=REGION_CACHE_SIZE, archive_path=ARCHIVE_PATH, **options):
+        """
+        Args:
+            cache_size: 见 REGION_CACHE_SIZE
+            archive_path: 历史房间信息的保存路径
+            options: 创建 ScreepsWorldView 时的其他参数，不支持分块绘制
+        """
+        self.archive_path = archive_path
+        self.cache = RegionCache(cache_size)
+        self.options = dict(options, tiled=False, quiet=True)
+        self.archive = RoomArchive(archive_path, check_same_thread=False)
+        self._views = {}
+        # 键为 (shard, 日期)，值为 (房间信息, 渲染好的头像)
+        self._dates = OrderedDict()
+        # 绘制时会临时替换 ScreepsWorldView 的房间信息和头像，所以同一时间只能绘制一个区域
+        self._lock = threading.Lock()
+        self._archive_lock = threading.Lock()
+
+    def get_snapshot_date(self, shard, date=None):
+        """获取请求的日期所使用的房间信息日期
+
+        Args:
+            shard: 要绘制的 shard
+            date: 日期，为 None 时使用最新的日期
+
+        Returns:
+            string: 日期
+        """
+        with self._archive_lock:
+            snapshot_date = self.archive.get_snapshot_date(shard, date or '9999-99-99')
+        if snapshot_date is None:
+            raise LookupError(f'shard{shard} 在 {date} 之前没有保存过房间信息')
+        return snapshot_date
+
+    def get_view(self, shard, snapshot_date=None):
+        """获取 shard 对应的 ScreepsWorldView，第一次获取时会按照最新的世界尺寸加载底图
+        请求的日期比当前底图更新并且世界尺寸发生了变化时（如世界扩张后）会按照该日期重新加载底图，
+        每个 shard 只保留最新的底图，更早的世界尺寸不会再切换回去
+
+        Args:
+            shard: 要绘制的 shard
+            snapshot_date: 请求的日期所使用的房间信息日期，见 get_snapshot_date，为 None 时不检查世界尺寸
+
+        Returns:
+            ScreepsWorldView: 准备好底图的实例
+        """
+        with self._archive_lock:
+            shard_info = self.archive.get_shard_info(shard, snapshot_date) if snapshot_date else None
+
+        with self._lock:
+            view = self._views.get(shard)
+            if view is None:
+                view = self._create_view(shard, self.get_snapshot_date(shard))
+            elif shard_info is not None and view.shard_info != shard_info and snapshot_date > view.archive_date:
+                view = self._create_view(shard, snapshot_date)
+            self._views[shard] = view
+
+        if shard_info is not None and view.shard_info != shard_info:
+            raise LookupError(f'shard{shard} 在 {snapshot_date} 的世界尺寸和当前底图不同')
+        return view
+
+    def _create_view(self, shard, snapshot_date):
+        """按照指定日期的世界尺寸创建 ScreepsWorldView 并加载底图
+
+        Returns:
+            ScreepsWorldView: 准备好底图的实例
+        """
+        try:
+            return ScreepsWorldView(shard, archive_date=snapshot_date, archive_path=self.archive_path, **self.options)
+        except Exception as err:
+            # 底图缓存损坏等问题属于服务器内部错误，不能被当作请求参数错误
+            raise RuntimeError(f'无法加载 shard{shard} 的底图: {err}') from err
+
+    def render(self, shard, date=None, zoom=1, image_format='png', rooms=None, sector=None, owner=None):
+        """绘制一块区域，区域可以由房间范围、区块或者玩家指定
+
+        Args:
+            shard: 要绘制的 shard
+            date: 日期，为 None 时使用最新的日期，没有保存该日期时使用它之前最近的一次
+            zoom: 相对于绘制结果的缩放比例，如 0.5 为缩小一半
+            image_format: 输出格式，见 REGION_FORMATS
+            rooms: 区域对角的两个房间名，如 ('W10N10', 'W1N1')
+            sector: 区块名，如 W9N9
+            owner: 玩家名，会绘制包含该玩家所有房间的区域
+
+        Returns:
+            content, hit: 编码后的图片及是否命中缓存
+        """
+        if image_format not in REGION_FORMATS:
+            raise ValueError(f'不支持的输出格式 {image_format}')
+        if not 0 < zoom <= ZOOM:
+            raise ValueError(f'缩放比例需要在 0 到 {ZOOM} 之间')
+
+        snapshot_date = self.get_snapshot_date(shard, date)
+        view = self.get_view(shard, snapshot_date)
+        # 按照房间和区块请求的区域和日期无关，可以在加载房间信息前就确定是否命中缓存
+        box = None if owner else self._get_box(view, rooms, sector)
+        key = (shard, snapshot_date, box or owner, zoom, image_format)
+        content = self.cache.get(key)
+        if content is not None:
+            return content, True
+
+        room_store, sprites = self._get_date(view, shard, snapshot_date)
+        if box is None:
+            box = self._get_owner_box(view, room_store, owner)
+
+        left, top, right, bottom = box
+        room_size = ROOM_PIXEL * ZOOM
+        if (right - left) * (bottom - top) * room_size * room_size > REGION_MAX_PIXELS:
+            raise ValueError(f'请求的区域过大，最多 {REGION_MAX_PIXELS} 像素')
+
+        with self._lock:
+            view.rooms, view.sprites = room_store, sprites
+            image = view.draw_region(left, top, right, bottom)
+
+        if zoom != 1:
+            size = (max(round(image.size[0] * zoom), 1), max(round(image.size[1] * zoom), 1))
+            image = image.resize(size, Image.BOX if zoom < 1 else Image.NEAREST)
+
+        buffer = BytesIO()
+        image.save(buffer, image_format.upper())
+        content = buffer.getvalue()
+        self.cache.put(key, content)
+        return content, False
+
+    def _get_date(self, view, shard, snapshot_date):
+        """获取指定日期的房间信息及渲染好的头像，只保留最近使用的 REGION_DATES 个日期
+
+        Returns:
+            rooms, sprites: RoomStore 房间信息及该日期使用的头像
+        """
+        key = (shard, snapshot_date)
+        with self._lock:
+            if key in self._dates:
+                self._dates.move_to_end(key)
+                return self._dates[key]
+
+            with self._archive_lock:
+                _, room_store = self.archive.get_snapshot(shard, snapshot_date)
+
+            # 头像设置可能和其他日期不同，所以每个日期单独加载头像
+            view.rooms, view.sprites = room_store, {}
+            view._load_sprite_atlas()
+            self._dates[key] = (room_store, view.sprites)
+            while len(self._dates) > REGION_DATES:
+                self._dates.popitem(last=False)
+            return self._dates[key]
+
+    def _get_box(self, view, rooms=None, sector=None):
+        """获取由房间范围或者区块指定的区域
+
+        Returns:
+            tuple: 区域的网格范围 (left, top, right, bottom)，right 和 bottom 不包含在内
+        """
+        index = view.room_index
+        if rooms:
+            indexes = [ index.get_index(room_name) for room_name in rooms ]
+            if len(indexes) != 2 or None in indexes:
+                raise ValueError(f'无效的房间范围 {":".join(rooms)}')
+        elif sector:
+            match = re.fullmatch(r'([WE]\d+)([NS]\d+)', sector)
+            indexes = index.get_sector_indexes(match[1], match[2], ROOM_PRE_SECTOR) if match else []
+            if not indexes:
+                raise ValueError(f'无效的区块名 {sector}')
+        else:
+            raise ValueError('需要指定 rooms、sector 或者 owner')
+
+        return self._get_bounding_box(view, indexes)
+
+    def _get_owner_box(self, view, room_store, owner):
+        """获取包含玩家所有房间的区域，会在外围额外包含 REGION_OWNER_PADDING 个房间
+
+        Returns:
+            tuple: 区域的网格范围 (left, top, right, bottom)
+        """
+        indexes = [ index for index, _, room_owner, _ in room_store.rows() if room_owner == owner ]
+        if not indexes:
+            raise LookupError(f'玩家 {owner} 没有任何房间')
+
+        left, top, right, bottom = self._get_bounding_box(view, indexes)
+        side = view.room_index.side
+        return (
+            max(left - REGION_OWNER_PADDING, 0), max(top - REGION_OWNER_PADDING, 0),
+            min(right + REGION_OWNER_PADDING, side), min(bottom + REGION_OWNER_PADDING, side)
+        )
+
+    def _get_bounding_box(self, view, indexes):
+        positions = [ view.room_index.get_position(index) for index in indexes ]
+        xs, ys = [ x for x, _ in positions ], [ y for _, y in positions ]
+        return (min(xs), min(ys), max(xs) + 1, max(ys) + 1)
+
+
+class RegionHandler(BaseHTTPRequestHandler):
+    """
+    区域绘制的请求处理器
+    请求格式为 /region?shard=3&sector=W9N9&date=2020-05-19&zoom=0.5&format=png，
+    区域可以由 rooms=W10N10:W1N1、sector=W9N9 或者 owner=玩家名 指定，响应头 X-Region-Cache 表示是否命中缓存
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/region':
+            return self._send_json({ 'error': f'未知的路径 {url.path}' }, 404)
+
+        query = { key: values[0] for key, values in parse_qs(url.query).items() }
+        try:
+            content, hit = self.server.renderer.render(
+                int(query.get('shard', 3)),
+                date=query.get('date'),
+                zoom=float(query.get('zoom', 1)),
+                image_format=query.get('format', 'png'),
+                rooms=query['rooms'].split(':') if 'rooms' in query else None,
+                sector=query.get('sector'),
+                owner=query.get('owner')
+            )
+        except LookupError as err:
+            return self._send_json({ 'error': str(err) }, 404)
+        except ValueError as err:
+            return self._send_json({ 'error': str(err) }, 400)
+        except Exception as err:
+            # 底图缓存缺失、损坏等无法绘制的情况
+            return self._send_json({ 'error': f'绘制失败: {err}' }, 500)
+
+        self._send(content, REGION_FORMATS[query.get('format', 'png')], { 'X-Region-Cache': 'hit' if hit else 'miss' })
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, content, status=200):
+        self._send(json.dumps(content, ensure_ascii=False).encode(), 'application/json', status=status)
+
+    def _send(self, content, content_type, headers=None, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class RegionServer(ThreadingHTTPServer):
+    """
+    按需绘制区域的本地 http 服务器
+
+    Usage:
+        with RegionServer(RegionRenderer(), port=8080) as server:
+            requests.get(f'{server.url}/region', params={ 'shard': 3, 'sector': 'W9N9' })
+    """
+    daemon_threads = True
+    # 绘制区域使用的 RegionRenderer
+    renderer = None
+
+    def __init__(self, renderer, host='127.0.0.1', port=0):
+        """
+        Args:
+            renderer: RegionRenderer 绘制区域使用的实例
+            host: 监听地址
+            port: 监听端口，为 0 时使用随机端口
+        """
+        super().__init__((host, port), RegionHandler)
+        self.renderer = renderer
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def start(self):
+        """在后台线程中启动服务器
+
+        Returns:
+            self: 自身
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """关闭服务器
+        """
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='启动按需绘制区域的本地服务器')
+    parser.add_argument('--port', type=int, default=8080, help='监听端口')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--cache-size', type=int, default=REGION_CACHE_SIZE // 1024 // 1024, help='绘制好的区域的缓存大小上限（MB）')
+    parser.add_argument('--archive', default=ARCHIVE_PATH, help='历史房间信息的保存路径')
+    args = parser.parse_args()
+
+    server = RegionServer(RegionRenderer(args.cache_size * 1024 * 1024, args.archive), args.host, args.port)
+    print(f'区域绘制地址 {server.url}/region?shard=3&sector=W9N9')
+    server.serve_forever()
@@ -0,0 +1,69 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from screeps_world_view import ScreepsWorldView
+from screeps_session import get_shared_session
+
+# 同时绘制的 shard 数量，每个 shard 都会在独立的进程中绘制，shard0 的内存占用较大，请按照机器配置调整
+RENDER_WORKERS = 2
+
+
+def render_shard(shard, warm=None, token=None, **options):
+    """绘制单个 shard
+    会在子进程中调用，所以放在模块顶层
+
+    Args:
+        shard: 要绘制的 shard
+        warm: WarmCache 常驻进程中保留的内容，见 warm_cache.WarmCache，只能在当前进程中使用
+        token: 父进程登陆后的 token，子进程中的会话还没有 token 时直接使用，不需要各自登陆
+        options: 传递给 ScreepsWorldView 的其他参数
+    """
+    session = get_shared_session()
+    if token and not session.token:
+        session.token = token
+
+    try:
+        view = ScreepsWorldView(shard, warm=warm.get(shard) if warm else None, **options)
+        view.draw()
+    finally:
+        if warm: warm.trim()
+
+
+def render_shards(shards, workers=RENDER_WORKERS, warm=None, **options):
+    """绘制多个 shard
+    每个 shard 在进程池中独立绘制，某个 shard 绘制失败不会影响其他 shard
+    workers 不大于 1 或者指定了 warm 时会在当前进程中依次绘制
+
+    Args:
+        shards: 要绘制的 shard 列表
+        workers: 同时绘制的 shard 数量
+        warm: WarmCache 常驻进程中保留的内容，指定后每个 shard 的底图、上次的结果和头像都会保留到下次绘制
+        options: 传递给 ScreepsWorldView 的其他参数
+
+    Returns:
+        dict: 绘制失败的 shard，键为 shard，值为对应的异常，全部成功时为空
+    """
+    failures = {}
+
+    if workers <= 1 or warm is not None:
+        for shard in shards:
+            try:
+                render_shard(shard, warm, **options)
+            except Exception as err:
+                failures[shard] = err
+        return failures
+
+    # 先在父进程中登陆一次，子进程直接使用同一个 token，已经有 token 时不会重新登陆
+    try:
+        token = get_shared_session().login()
+    except Exception as err:
+        return { shard: err for shard in shards }
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+        tasks = { executor.submit(render_shard, shard, token=token, **options): shard for shard in shards }
+        for task in as_completed(tasks):
+            try:
+                task.result()
+            except Exception as err:
+                failures[tasks[task]] = err
+
+    return failures
@@ -0,0 +1,332 @@
+import argparse
+import json
+import re
+import sqlite3
+
+from room_index import RoomIndex
+from room_store import RoomStore
+
+# 历史房间信息的保存路径
+ARCHIVE_PATH = '.screeps_cache/archive.sqlite'
+# 区块边长对应的房间数量，见 screeps_world_view.ROOM_PRE_SECTOR
+SECTOR_SIZE = 10
+# 等待其他进程写入完成的最长时间（秒），多个 shard 在不同进程中绘制时会同时写入
+ARCHIVE_TIMEOUT = 30
+
+ARCHIVE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshots (
+    shard INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    quadrant_size INTEGER NOT NULL,
+    shard_info TEXT NOT NULL,
+    PRIMARY KEY (shard, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rooms (
+    shard INTEGER NOT NULL,
+    room TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    rcl INTEGER NOT NULL,
+    start TEXT NOT NULL,
+    end TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rooms_by_end ON rooms (shard, end, start);
+CREATE INDEX IF NOT EXISTS rooms_by_room ON rooms (shard, room, start);
+CREATE INDEX IF NOT EXISTS rooms_by_owner ON rooms (shard, owner, start) WHERE owner IS NOT NULL;
+CREATE TABLE IF NOT EXISTS badges (
+    shard INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    badge TEXT NOT NULL,
+    start TEXT NOT NULL,
+    end TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS badges_by_end ON badges (shard, end, start);
+CREATE INDEX IF NOT EXISTS badges_by_username ON badges (shard, username, start);
+'''
+
+
+class RoomArchive:
+    """
+    按天保存的历史房间信息
+    每个房间的信息保存为 [start, end] 日期区间，只有状态、所有者或等级发生变化时才会新增一行，
+    没有变化的房间只会把区间延长到当天，玩家头像设置也按照同样的方式保存，
+    按照房间、所有者、日期都有索引，几个月的历史也可以在毫秒级完成查询
+
+    Usage:
+        archive = RoomArchive()
+        archive.append(3, '2020-05-19', shard_info, rooms)
+        archive.get_owner_history(3, 'hopgoldy')
+        shard_info, rooms = archive.get_snapshot(3, '2020-05-19')
+    """
+    # 保存路径
+    archive_path = ARCHIVE_PATH
+
+    def __init__(self, archive_path=ARCHIVE_PATH, check_same_thread=True):
+        """
+        Args:
+            archive_path: 保存路径，不存在时会自动新建
+            check_same_thread: 为 False 时可以在其他线程中使用，调用方需要自己保证同一时间只有一个线程在使用
+        """
+        self.archive_path = archive_path
+        self.db = sqlite3.connect(archive_path, timeout=ARCHIVE_TIMEOUT, check_same_thread=check_same_thread)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(ARCHIVE_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def get_dates(self, shard):
+        """获取已经保存的日期
+
+        Returns:
+            list: 按顺序排列的日期
+        """
+        return [ row['date'] for row in self.db.execute('SELECT date FROM snapshots WHERE shard = ? ORDER BY date', (shard,)) ]
+
+    def append(self, shard, date, shard_info, rooms):
+        """保存一天的房间信息
+        只能按照日期顺序保存，重复保存最后一天时会覆盖该天的信息
+
+        Args:
+            shard: 房间所在的 shard
+            date: string 日期，如 2020-05-19
+            shard_info: dict 世界尺寸信息，见 ScreepsWorldView.shard_info
+            rooms: RoomStore 当天的房间信息
+        """
+        with self.db:
+            dates = self.get_dates(shard)
+            if dates and date < dates[-1]:
+                raise ValueError(f'只能按照日期顺序保存，shard{shard} 已经保存到了 {dates[-1]}')
+            if dates and date == dates[-1]:
+                self._remove_last_date(shard, date, dates[-2] if len(dates) > 1 else None)
+                dates.pop()
+            previous = dates[-1] if dates else None
+
+            self.db.execute('INSERT INTO snapshots VALUES (?, ?, ?, ?)', (shard, date, rooms.index.quadrant_size, json.dumps(shard_info)))
+            self._append_intervals(
+                'rooms', ('room', 'status', 'owner', 'rcl'), shard, date, previous,
+                ((rooms.get_name(index), status, owner, int(rcl)) for index, status, owner, rcl in rooms.rows())
+            )
+            self._append_intervals(
+                'badges', ('username', 'badge'), shard, date, previous,
+                ((username, json.dumps(rooms.badges.get(username), sort_keys=True)) for username in rooms.owners)
+            )
+
+    def _append_intervals(self, table, columns, shard, date, previous, values):
+        """把当天的信息追加到区间表中，和上次保存时一样的行会延长到当天，其他的行新增区间
+
+        Args:
+            table: 表名
+            columns: 除了 shard、start、end 之外的列，第一列为键
+            shard: 所在的 shard
+            date: 当天的日期
+            previous: 上次保存的日期，没有时为 None
+            values: 当天每一行的值，顺序和 columns 一致
+        """
+        opened = {}
+        if previous:
+            for row in self.db.execute(f'SELECT rowid, {", ".join(columns)} FROM {table} WHERE shard = ? AND end = ?', (shard, previous)):
+                opened[row[1]] = (row[0], tuple(row)[1:])
+
+        extended = []
+        inserted = []
+        for value in values:
+            row = opened.get(value[0])
+            if row and row[1] == tuple(value):
+                extended.append((date, row[0]))
+            else:
+                inserted.append((shard, *value, date, date))
+
+        self.db.executemany(f'UPDATE {table} SET end = ? WHERE rowid = ?', extended)
+        self.db.executemany(f'INSERT INTO {table} (shard, {", ".join(columns)}, start, end) VALUES ({", ".join("?" * (len(columns) + 3))})', inserted)
+
+    def _remove_last_date(self, shard, date, previous):
+        """撤销最后一天的保存，用于重复保存同一天
+
+        Args:
+            shard: 所在的 shard
+            date: 最后一天的日期
+            previous: 倒数第二天的日期，没有时为 None
+        """
+        self.db.execute('DELETE FROM snapshots WHERE shard = ? AND date = ?', (shard, date))
+        for table in ('rooms', 'badges'):
+            self.db.execute(f'DELETE FROM {table} WHERE shard = ? AND start = ?', (shard, date))
+            # 剩下的以这一天结束的行都是从倒数第二天延长过来的
+            self.db.execute(f'UPDATE {table} SET end = ? WHERE shard = ? AND end = ?', (previous, shard, date))
+
+    def get_snapshot_date(self, shard, date):
+        """获取指定日期所使用的保存日期，没有保存该日期时使用它之前最近的一次
+
+        Returns:
+            string: 保存的日期，指定日期之前没有任何保存时为 None
+        """
+        row = self.db.execute('SELECT max(date) FROM snapshots WHERE shard = ? AND date <= ?', (shard, date)).fetchone()
+        return row[0]
+
+    def get_shard_info(self, shard, date):
+        """获取指定日期的世界尺寸信息
+
+        Args:
+            shard: 要获取的 shard
+            date: string 日期，没有保存该日期时使用它之前最近的一次
+
+        Returns:
+            dict: 世界尺寸信息，见 ScreepsWorldView.shard_info
+        """
+        snapshot_date = self.get_snapshot_date(shard, date)
+        if snapshot_date is None:
+            raise ValueError(f'shard{shard} 在 {date} 之前没有保存过房间信息')
+
+        row = self.db.execute('SELECT shard_info FROM snapshots WHERE shard = ? AND date = ?', (shard, snapshot_date)).fetchone()
+        return json.loads(row[0])
+
+    def get_snapshot(self, shard, date):
+        """还原指定日期的房间信息
+
+        Args:
+            shard: 要还原的 shard
+            date: string 日期，没有保存该日期时使用它之前最近的一次
+
+        Returns:
+            shard_info, rooms: 世界尺寸信息及 RoomStore 房间信息
+        """
+        snapshot_date = self.get_snapshot_date(shard, date)
+        if snapshot_date is None:
+            raise ValueError(f'shard{shard} 在 {date} 之前没有保存过房间信息')
+
+        quadrant_size, shard_info = self.db.execute(
+            'SELECT quadrant_size, shard_info FROM snapshots WHERE shard = ? AND date = ?', (shard, snapshot_date)
+        ).fetchone()
+        rooms = RoomStore(RoomIndex.get(quadrant_size))
+
+        for row in self.db.execute('SELECT username, badge FROM badges WHERE shard = ? AND end >= ? AND start <= ?', (shard, snapshot_date, snapshot_date)):
+            rooms.add_owner(row['username'], json.loads(row['badge']))
+        for row in self.db.execute('SELECT room, status, owner, rcl FROM rooms WHERE shard = ? AND end >= ? AND start <= ?', (shard, snapshot_date, snapshot_date)):
+            rooms.set(row['room'], row['status'], row['owner'], row['rcl'])
+
+        return json.loads(shard_info), rooms
+
+    def get_room_history(self, shard, room_name, start=None, end=None):
+        """获取房间的历史信息
+
+        Args:
+            shard: 房间所在的 shard
+            room_name: string 房间名
+            start: 开始日期，为 None 时不限制
+            end: 结束日期（包含），为 None 时不限制
+
+        Returns:
+            list: 按时间排列的区间，元素为包含 status、owner、rcl、start、end 的字典
+        """
+        return self._query_history('room = ?', (room_name,), shard, start, end)
+
+    def get_owner_history(self, shard, username, room_names=None, start=None, end=None):
+        """获取玩家占领或者预定过的房间
+
+        Args:
+            shard: 房间所在的 shard
+            username: string 玩家名
+            room_names: 只查询这些房间，为 None 时查询所有房间
+            start: 开始日期，为 None 时不限制
+            end: 结束日期（包含），为 None 时不限制
+
+        Returns:
+            list: 按时间排列的区间，元素为包含 room、status、rcl、start、end 的字典
+        """
+        condition, params = 'owner = ?', (username,)
+        if room_names is not None:
+            room_names = list(room_names)
+            condition += f' AND room IN ({", ".join("?" * len(room_names))})'
+            params += tuple(room_names)
+        return self._query_history(condition, params, shard, start, end)
+
+    def _query_history(self, condition, params, shard, start, end):
+        """查询和 [start, end] 有重叠的区间
+
+        Returns:
+            list: 按时间排列的区间
+        """
+        sql = f'SELECT room, status, owner, rcl, start, end FROM rooms WHERE shard = ? AND {condition}'
+        params = (shard, *params)
+        if start:
+            sql += ' AND end >= ?'
+            params += (start,)
+        if end:
+            sql += ' AND start <= ?'
+            params += (end,)
+
+        return [ dict(row) for row in self.db.execute(sql + ' ORDER BY start, room', params) ]
+
+    def get_sector_rooms(self, shard, sector_name, date=None):
+        """获取区块中的所有房间名，区块的划分方式和瓦片相同
+
+        Args:
+            shard: 区块所在的 shard
+            sector_name: string 区块名，如 W9N9，见 ScreepsWorldView._get_sectors_name
+            date: 使用该日期的世界尺寸，为 None 时使用最后一次保存的世界尺寸
+
+        Returns:
+            list: 房间名
+        """
+        match = re.fullmatch(r'([WE]\d+)([NS]\d+)', sector_name)
+        if not match:
+            raise ValueError(f'无效的区块名 {sector_name}')
+
+        snapshot_date = self.get_snapshot_date(shard, date or '9999-99-99')
+        if snapshot_date is None:
+            raise ValueError(f'shard{shard} 没有保存过房间信息')
+        quadrant_size = self.db.execute('SELECT quadrant_size FROM snapshots WHERE shard = ? AND date = ?', (shard, snapshot_date)).fetchone()[0]
+
+        index = RoomIndex.get(quadrant_size)
+        return [ index.get_name(room) for room in index.get_sector_indexes(match[1], match[2], SECTOR_SIZE) ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='查询历史房间信息')
+    parser.add_argument('--archive', default=ARCHIVE_PATH, help='历史房间信息的保存路径')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    dates_parser = commands.add_parser('dates', help='列出已经保存的日期')
+    dates_parser.add_argument('shard', type=int)
+
+    room_parser = commands.add_parser('room', help='查询房间的历史信息')
+    room_parser.add_argument('shard', type=int)
+    room_parser.add_argument('room', help='房间名，如 W1N1')
+
+    owner_parser = commands.add_parser('owner', help='查询玩家占领或者预定过的房间')
+    owner_parser.add_argument('shard', type=int)
+    owner_parser.add_argument('username', help='玩家名')
+    owner_parser.add_argument('--sector', help='只查询该区块中的房间，如 W9N9')
+
+    render_parser = commands.add_parser('render', help='不访问接口，直接使用历史房间信息绘制指定日期的地图')
+    render_parser.add_argument('shard', type=int)
+    render_parser.add_argument('date', help='日期，如 2020-05-19')
+
+    for command_parser in (room_parser, owner_parser):
+        command_parser.add_argument('--start', help='开始日期，如 2020-05-01')
+        command_parser.add_argument('--end', help='结束日期（包含）')
+    args = parser.parse_args()
+
+    if args.command == 'render':
+        # 绘制需要 cairosvg 等依赖，只在这里导入
+        from screeps_world_view import ScreepsWorldView
+        ScreepsWorldView(args.shard, archive_date=args.date, archive_path=args.archive).draw()
+        raise SystemExit
+
+    with RoomArchive(args.archive) as archive:
+        if args.command == 'dates':
+            history = archive.get_dates(args.shard)
+        elif args.command == 'room':
+            history = archive.get_room_history(args.shard, args.room, args.start, args.end)
+        else:
+            room_names = archive.get_sector_rooms(args.shard, args.sector) if args.sector else None
+            history = archive.get_owner_history(args.shard, args.username, room_names, args.start, args.end)
+
+    for item in history:
+        print(item if isinstance(item, str) else ' '.join(f'{key}={value}' for key, value in item.items()))
@@ -0,0 +1,169 @@
+import json
+from os import path
+
+from file_utils import write_atomic
+
+# 每个 shard 的房间索引缓存文件名，保存在 shard 的缓存路径下
+ROOM_INDEX_NAME = 'room_index.json'
+
+
+class RoomIndex:
+    """
+    房间坐标索引
+    整个世界的房间按照网格位置 (x, y) 编号为 y * side + x，网格位置乘以房间边长像素值即为房间左上角的像素位置，
+    房间名、编号、网格位置、像素区域之间的转换都只需要一次查表或者整数运算
+    同一尺寸的世界在进程中只会生成一次，并且会缓存到 shard 的缓存路径下
+
+    Usage:
+        index = RoomIndex.load('.screeps_cache/3', quadrant_size)
+        index.get_index('W1N1')
+        index.get_pixel_rect(index.get_index('W1N1'), 60)
+    """
+    # 象限边长对应的房间数量，见 ScreepsWorldView._get_quadrant_size
+    quadrant_size = 0
+    # 世界边长对应的房间数量
+    side = 0
+    # 房间编号对应的房间名
+    names = None
+    # 房间名对应的房间编号
+    indexes = None
+
+    # 进程内已经生成的索引，键为 quadrant_size
+    _cache = {}
+
+    def __init__(self, quadrant_size, names=None):
+        """
+        Args:
+            quadrant_size: 象限边长对应的房间数量
+            names: 按编号排列的房间名，为 None 时重新生成
+        """
+        self.quadrant_size = quadrant_size
+        self.side = quadrant_size * 2
+        if names is None:
+            # W 和 N 从象限中心向左上方递增，E 和 S 从象限中心向右下方递增
+            x_names = [ f'W{quadrant_size - x - 1}' for x in range(quadrant_size) ] + [ f'E{x}' for x in range(quadrant_size) ]
+            y_names = [ f'N{quadrant_size - y - 1}' for y in range(quadrant_size) ] + [ f'S{y}' for y in range(quadrant_size) ]
+            names = [ x_name + y_name for y_name in y_names for x_name in x_names ]
+
+        self.names = names
+        self.indexes = { name: index for index, name in enumerate(names) }
+
+    @classmethod
+    def get(cls, quadrant_size):
+        """获取指定尺寸的索引，同一尺寸在进程中只会生成一次
+
+        Returns:
+            RoomIndex: 房间索引
+        """
+        if quadrant_size not in cls._cache:
+            cls._cache[quadrant_size] = cls(quadrant_size)
+        return cls._cache[quadrant_size]
+
+    @classmethod
+    def load(cls, cache_path, quadrant_size):
+        """获取指定尺寸的索引，会优先使用进程中及 cache_path 下缓存的索引，世界尺寸变化时重新生成
+
+        Args:
+            cache_path: shard 的缓存路径
+            quadrant_size: 象限边长对应的房间数量
+
+        Returns:
+            RoomIndex: 房间索引
+        """
+        if quadrant_size in cls._cache:
+            return cls._cache[quadrant_size]
+
+        index_path = f'{cache_path}/{ROOM_INDEX_NAME}'
+        if path.exists(index_path):
+            with open(index_path) as index_file:
+                cache = json.load(index_file)
+            if cache['quadrant_size'] == quadrant_size:
+                cls._cache[quadrant_size] = cls(quadrant_size, cache['names'])
+                return cls._cache[quadrant_size]
+
+        index = cls.get(quadrant_size)
+        if path.exists(cache_path):
+            write_atomic(index_path, json.dumps({ 'quadrant_size': quadrant_size, 'names': index.names }))
+        return index
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_index(self, room_name):
+        """获取房间编号
+
+        Returns:
+            number: 房间编号，房间名无效或者不在世界范围内时为 None
+        """
+        return self.indexes.get(room_name)
+
+    def get_name(self, index):
+        """获取房间名
+
+        Returns:
+            string: 房间名
+        """
+        return self.names[index]
+
+    def get_position(self, index):
+        """获取房间的网格位置
+
+        Returns:
+            tuple: (x, y)
+        """
+        y, x = divmod(index, self.side)
+        return x, y
+
+    def get_pixel_rect(self, index, room_size):
+        """获取房间在整个世界中的像素区域
+
+        Args:
+            index: 房间编号
+            room_size: 房间边长像素值
+
+        Returns:
+            tuple: (left, top, right, bottom)
+        """
+        y, x = divmod(index, self.side)
+        return (x * room_size, y * room_size, (x + 1) * room_size, (y + 1) * room_size)
+
+    def get_pixel_index(self, x, y, room_size):
+        """获取像素位置所在的房间编号
+
+        Args:
+            x: x 轴像素位置
+            y: y 轴像素位置
+            room_size: 房间边长像素值
+
+        Returns:
+            number: 房间编号，位置不在世界范围内时为 None
+        """
+        x, y = x // room_size, y // room_size
+        if not (0 <= x < self.side and 0 <= y < self.side):
+            return None
+        return y * self.side + x
+
+    def get_sector_indexes(self, x_sector_name, y_sector_name, sector_size):
+        """获取区块中的所有房间编号
+
+        Args:
+            x_sector_name: string 区块名的 x 轴部分，如 W9，见 ScreepsWorldView._get_sectors_name
+            y_sector_name: string 区块名的 y 轴部分，如 N9
+            sector_size: 区块边长对应的房间数量
+
+        Returns:
+            list: 房间编号
+        """
+        xs, ys = (self._get_sector_range(sector_name, sector_size) for sector_name in (x_sector_name, y_sector_name))
+        return [ y * self.side + x for y in ys for x in xs ]
+
+    def _get_sector_range(self, sector_name, sector_size):
+        """获取区块在一个轴上覆盖的网格位置
+
+        Returns:
+            range: 网格位置
+        """
+        direction, number = sector_name[0], int(sector_name[1:])
+        # W 和 N 的区块以编号最大的房间命名，E 和 S 的区块以编号最小的房间命名
+        start = self.quadrant_size - number - 1 if direction in 'WN' else self.quadrant_size + number
+        return range(max(start, 0), min(start + sector_size, self.side))
@@ -0,0 +1,280 @@
+import base64
+from array import array
+
+from room_index import RoomIndex
+
+# numpy 为可选依赖，未安装时使用 array 保存各列，比较房间时会退回到逐个比较
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# 房间状态，状态码为其在元组中的位置，0 表示没有该房间的信息，接口返回的其他状态会在使用时追加编号
+ROOM_STATUS = (None, 'normal', 'out of borders', 'respawn', 'novice')
+# 没有所有者的房间的所有者编号
+NO_OWNER = -1
+
+
+class RoomStore:
+    """
+    紧凑的房间信息存储
+    房间按照 RoomIndex 中的编号保存，状态、所有者、等级分别保存在三个数组列中，
+    所有者名和头像设置只保存一份，房间中只记录所有者的编号，不需要为每个房间都新建一个字典
+
+    Usage:
+        rooms = RoomStore(RoomIndex.get(quadrant_size))
+        rooms.add_owner('hopgoldy', badge)
+        rooms.set('W1N1', 'normal', 'hopgoldy', 8)
+        for index, status, owner, rcl in rooms.rows():
+            ...
+    """
+    # 房间坐标索引，见 room_index.RoomIndex
+    index = None
+    # 世界边长对应的房间数量
+    side = 0
+    # 状态码、所有者编号、等级三列，长度均为 side * side
+    status = None
+    owner = None
+    rcl = None
+    # 状态码对应的状态名
+    statuses = None
+    # 所有者编号对应的玩家名，同时也是按照出现顺序排列的玩家列表
+    owners = None
+    # 玩家的头像设置，键为玩家名
+    badges = None
+
+    def __init__(self, index):
+        """
+        Args:
+            index: RoomIndex 该世界的房间坐标索引
+        """
+        self.index = index
+        self.side = index.side
+        room_num = len(index)
+        if numpy is not None:
+            self.status = numpy.zeros(room_num, numpy.uint8)
+            self.owner = numpy.full(room_num, NO_OWNER, numpy.int32)
+            self.rcl = numpy.zeros(room_num, numpy.int8)
+        else:
+            self.status = array('B', bytes(room_num))
+            self.owner = array('i', [NO_OWNER]) * room_num
+            self.rcl = array('b', bytes(room_num))
+
+        self.statuses = list(ROOM_STATUS)
+        self.owners = []
+        self.badges = {}
+        self._status_codes = { status: code for code, status in enumerate(self.statuses) }
+        self._owner_ids = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, room_name):
+        index = self.get_index(room_name)
+        return index is not None and self.status[index] != 0
+
+    def get_index(self, room_name):
+        """获取房间编号，见 RoomIndex.get_index
+
+        Returns:
+            number: 房间编号，房间名无效或者不在世界范围内时为 None
+        """
+        return self.index.get_index(room_name)
+
+    def get_position(self, index):
+        """获取房间的网格位置，见 RoomIndex.get_position
+
+        Returns:
+            tuple: (x, y)
+        """
+        return self.index.get_position(index)
+
+    def get_name(self, index):
+        """获取房间名，见 RoomIndex.get_name
+
+        Returns:
+            string: 房间名
+        """
+        return self.index.names[index]
+
+    def add_owner(self, username, badge=None):
+        """登记一个玩家，已经登记过的玩家只会更新头像设置
+
+        Args:
+            username: string 玩家名
+            badge: 头像设置，为 None 时不更新
+
+        Returns:
+            number: 所有者编号
+        """
+        owner_id = self._owner_ids.get(username)
+        if owner_id is None:
+            owner_id = self._owner_ids[username] = len(self.owners)
+            self.owners.append(username)
+        if badge is not None:
+            self.badges[username] = badge
+        return owner_id
+
+    def set(self, room_name, status, owner=None, rcl=0):
+        """保存房间信息
+
+        Args:
+            room_name: string 房间名
+            status: string 房间状态
+            owner: string 所有者名，没有所有者时为 None
+            rcl: 0-8 房间等级
+
+        Returns:
+            bool: 是否保存成功，房间不在世界范围内时为 False
+        """
+        index = self.get_index(room_name)
+        if index is None:
+            return False
+
+        if status not in self._status_codes:
+            self._status_codes[status] = len(self.statuses)
+            self.statuses.append(status)
+        if self.status[index] == 0:
+            self._size += 1
+
+        self.status[index] = self._status_codes[status]
+        self.owner[index] = NO_OWNER if owner is None else self.add_owner(owner)
+        self.rcl[index] = rcl or 0
+        return True
+
+    def get(self, room_name):
+        """获取房间信息
+
+        Returns:
+            dict: 包含 status 及 owner、rcl（有所有者时）的房间信息，没有该房间的信息时为 None
+        """
+        index = self.get_index(room_name)
+        if index is None or self.status[index] == 0:
+            return None
+
+        room = { 'status': self.statuses[self.status[index]] }
+        if self.owner[index] != NO_OWNER:
+            room['owner'] = self.owners[self.owner[index]]
+            room['rcl'] = int(self.rcl[index])
+        return room
+
+    def indexes(self):
+        """获取所有有信息的房间编号
+
+        Returns:
+            list: 房间编号
+        """
+        if numpy is not None:
+            return numpy.flatnonzero(self.status).tolist()
+        return [ index for index, code in enumerate(self.status) if code ]
+
+    def rows(self, indexes=None):
+        """遍历房间信息
+
+        Args:
+            indexes: 要遍历的房间编号，默认为所有有信息的房间，没有信息的房间会被跳过
+
+        Returns:
+            generator: 元素为 (房间编号, 状态, 所有者名或 None, 等级)
+        """
+        if indexes is None:
+            indexes = self.indexes()
+
+        if numpy is not None:
+            selected = numpy.asarray(indexes, numpy.int64)
+            columns = zip(indexes, self.status[selected].tolist(), self.owner[selected].tolist(), self.rcl[selected].tolist())
+        else:
+            columns = ((index, self.status[index], self.owner[index], self.rcl[index]) for index in indexes)
+
+        for index, code, owner_id, rcl in columns:
+            if code:
+                yield index, self.statuses[code], None if owner_id == NO_OWNER else self.owners[owner_id], rcl
+
+    def items(self):
+        """遍历房间名及房间信息，格式见 get
+
+        Returns:
+            generator: 元素为 (房间名, 房间信息)
+        """
+        for index, status, owner, rcl in self.rows():
+            room = { 'status': status }
+            if owner is not None:
+                room['owner'] = owner
+                room['rcl'] = rcl
+            yield self.get_name(index), room
+
+    def get_changed_indexes(self, other, stale_owners=()):
+        """获取和另一份房间信息相比发生变化的房间
+        房间状态、所有者、等级发生变化，或者所有者更换了头像的房间都会被视为发生了变化
+
+        Args:
+            other: RoomStore 世界尺寸相同的另一份房间信息
+            stale_owners: 无论是否变化都需要视为发生了变化的玩家，如上次绘制时头像缺失的玩家
+
+        Returns:
+            list: 发生变化的房间编号
+        """
+        if other.side != self.side:
+            raise ValueError(f'世界尺寸不一致 {other.side} {self.side}')
+
+        # 两者的状态码和所有者编号都是各自独立分配的，先把 other 的编号换算成自身的编号，自身没有的状态或玩家换算为 -2
+        status_map = [ self._status_codes.get(status, -2) for status in other.statuses ]
+        owner_map = [ self._owner_ids.get(username, -2) for username in other.owners ] + [ NO_OWNER ]
+        # 头像发生变化以及需要强制重新绘制的玩家
+        rebadged = { self._owner_ids[username] for username in self.owners if self.badges.get(username) != other.badges.get(username) }
+        rebadged |= { self._owner_ids[username] for username in stale_owners if username in self._owner_ids }
+
+        if numpy is not None:
+            other_status = numpy.asarray(status_map, numpy.int32)[other.status]
+            other_owner = numpy.asarray(owner_map, numpy.int32)[other.owner]
+            changed = (self.status != other_status) | (self.owner != other_owner) | (self.rcl != other.rcl)
+            if rebadged:
+                changed |= numpy.isin(self.owner, list(rebadged))
+            return numpy.flatnonzero(changed).tolist()
+
+        return [
+            index for index in range(self.side * self.side)
+            if self.status[index] != status_map[other.status[index]] or self.owner[index] != owner_map[other.owner[index]]
+            or self.rcl[index] != other.rcl[index] or self.owner[index] in rebadged
+        ]
+
+    def to_dict(self):
+        """转换为可以保存为 json 的字典，三列会以 base64 编码保存
+
+        Returns:
+            dict: 房间信息
+        """
+        return {
+            'quadrant_size': self.index.quadrant_size,
+            'statuses': self.statuses,
+            'owners': self.owners,
+            'badges': self.badges,
+            'columns': { name: base64.b64encode(getattr(self, name).tobytes()).decode() for name in ('status', 'owner', 'rcl') }
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """由 to_dict 的结果还原
+
+        Args:
+            data: dict 房间信息
+
+        Returns:
+            RoomStore: 房间信息
+        """
+        store = cls(RoomIndex.get(data['quadrant_size']))
+        for name in ('status', 'owner', 'rcl'):
+            column = getattr(store, name)
+            content = base64.b64decode(data['columns'][name])
+            if numpy is not None:
+                column[:] = numpy.frombuffer(content, column.dtype)
+            else:
+                setattr(store, name, array(column.typecode, content))
+
+        for username in data['owners']:
+            store.add_owner(username, data['badges'].get(username))
+        store.statuses = list(data['statuses'])
+        store._status_codes = { status: code for code, status in enumerate(store.statuses) }
+        store._size = len(store.indexes())
+        return store
@@ -0,0 +1,184 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from file_utils import write_atomic
+
+# resource 只在类 unix 系统上可用，没有时不记录内存占用
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def get_peak_memory():
+    """获取当前进程的内存占用峰值
+
+    Returns:
+        number: 内存占用峰值（MB），无法获取时为 None
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 下的单位为字节，其他系统为 KB
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def get_current_memory():
+    """获取当前进程此刻的内存占用（RSS）
+    通过 /proc/self/statm 读取，只在 linux 上可用
+
+    Returns:
+        number: 内存占用（MB），无法获取时为 None
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def get_memory_delta(start, end):
+    """计算两次内存读数的差值
+
+    Returns:
+        number: 差值（MB），任意一次无法获取时为 None
+    """
+    if start is None or end is None:
+        return None
+    return end - start
+
+
+def round_memory(memory):
+    """把内存数据保留一位小数，无法获取时为 None
+    """
+    return None if memory is None else round(memory, 1)
+
+
+class RunReport:
+    """
+    单个 shard 的绘制报告
+    记录每个阶段的耗时、调用次数、内存变化以及下载字节数、缓存命中数等计数，进程的内存占用峰值只记录在报告顶层
+
+    每个阶段记录两项内存数据：
+    memory_delta_mb 为单次调用结束时比开始时多占用的内存（RSS），多次调用时取最大值，可以看出该阶段留下了多少内存
+    peak_growth_mb 为该阶段把进程的内存占用峰值推高了多少，多次调用时累加，可以看出峰值是由哪个阶段造成的
+    流水线绘制时多个阶段会同时进行，同一时间段内的内存变化会同时计入这些阶段
+
+    Usage:
+        report = RunReport(3)
+        with report.stage('map-stats'):
+            report.count('bytes_downloaded', 1024)
+        report.save('report.json')
+    """
+    # 对应的 shard
+    shard = 3
+    # 开始时间戳
+    started = 0
+    # 各阶段的记录，键为阶段名
+    stages = None
+
+    def __init__(self, shard):
+        self.shard = shard
+        self.started = time.time()
+        self.stages = {}
+        self._stack = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """记录一个阶段
+        阶段可以嵌套，外层阶段的耗时包含内层阶段，同名阶段的耗时会累加
+
+        Args:
+            name: 阶段名
+        """
+        with self._lock:
+            record = self._get_record(name)
+            self._stack.append(name)
+        start_memory, start_peak = get_current_memory(), get_peak_memory()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            memory_delta = get_memory_delta(start_memory, get_current_memory())
+            peak_growth = get_memory_delta(start_peak, get_peak_memory())
+            with self._lock:
+                record['time'] += time.perf_counter() - start
+                record['calls'] += 1
+                if memory_delta is not None and (record['memory_delta_mb'] is None or memory_delta > record['memory_delta_mb']):
+                    record['memory_delta_mb'] = memory_delta
+                if peak_growth is not None:
+                    record['peak_growth_mb'] = (record['peak_growth_mb'] or 0) + peak_growth
+                # 流水线绘制时多个阶段会在不同线程中同时进行，所以移除本阶段最后一次出现的位置而不是直接弹出栈顶
+                del self._stack[len(self._stack) - 1 - self._stack[::-1].index(name)]
+
+    def count(self, key, value=1):
+        """给当前阶段的计数器加上指定值
+        可以在其他线程中调用，没有进行中的阶段时会记录到 other 中
+
+        Args:
+            key: 计数器名，如 bytes_downloaded、cache_hit、cache_miss
+            value: 要加上的值
+        """
+        with self._lock:
+            counters = self._get_record(self._stack[-1] if self._stack else 'other')['counters']
+            counters[key] = counters.get(key, 0) + value
+
+    def to_dict(self):
+        """转换为可以保存为 json 的字典
+
+        Returns:
+            dict: 报告内容
+        """
+        with self._lock:
+            return {
+                'shard': self.shard,
+                'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+                'total_time': round(time.time() - self.started, 3),
+                'peak_memory_mb': round_memory(get_peak_memory()),
+                'stages': { name: dict(
+                    record, time=round(record['time'], 3), counters=dict(record['counters']),
+                    memory_delta_mb=round_memory(record['memory_delta_mb']), peak_growth_mb=round_memory(record['peak_growth_mb'])
+                ) for name, record in self.stages.items() }
+            }
+
+    def save(self, file_path):
+        """保存为 json 文件
+
+        Args:
+            file_path: 保存路径
+        """
+        write_atomic(file_path, json.dumps(self.to_dict(), indent=4, ensure_ascii=False))
+
+    def _get_record(self, name):
+        """获取阶段的记录，没有的话就新建一个
+
+        Returns:
+            dict: 阶段记录
+        """
+        return self.stages.setdefault(name, { 'time': 0, 'calls': 0, 'memory_delta_mb': None, 'peak_growth_mb': None, 'counters': {} })
+
+
+def instrument(name):
+    """将方法记录为一个阶段的装饰器
+    被装饰的方法所在的实例需要有 report 属性，为 None 时不做记录
+
+    Args:
+        name: 阶段名
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if self.report is None:
+                return func(self, *args, **kwargs)
+            with self.report.stage(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
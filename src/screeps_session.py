@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from os import path
+
+from http_client import create_session, REQUEST_TIMEOUT
+from file_utils import write_atomic
+
+# screeps 接口地址
+API_URL = 'https://screeps.com/api'
+# 登陆信息的配置文件路径
+CONFIG_PATH = 'config.json'
+# 是否将 token 保存到本地，保存后下次启动时可以直接使用，不需要重新登陆
+PERSIST_TOKEN = True
+# token 的保存路径
+TOKEN_PATH = '.screeps_cache/token.json'
+
+
+class ScreepsSession:
+    """
+    screeps 接口会话
+    所有请求共用一个连接池，需要登陆的接口只会在第一次请求时登陆一次，
+    之后每次请求都会换成接口返回的最新 X-Token，token 失效时会自动重新登陆
+
+    Usage:
+        session = ScreepsSession()
+        session.get('/game/world-size', params={ 'shard': 'shard3' })
+        session.post('/game/map-stats', auth=True, json=params)
+    """
+    # 接口地址
+    api_url = API_URL
+    # 登陆信息的配置文件路径
+    config_path = CONFIG_PATH
+    # token 的保存路径，为 None 时不保存
+    token_path = TOKEN_PATH
+    # 当前的 token，未登陆时为 None
+    token = None
+    # 带连接池的 http 会话，也可以直接用于请求其他地址
+    session = None
+
+    def __init__(self, api_url=API_URL, config_path=CONFIG_PATH, token_path=TOKEN_PATH if PERSIST_TOKEN else None):
+        """
+        Args:
+            api_url: 接口地址
+            config_path: 登陆信息的配置文件路径
+            token_path: token 的保存路径，为 None 时不保存
+        """
+        self.api_url = api_url
+        self.config_path = config_path
+        self.token_path = token_path
+        self.token = None
+        self.session = create_session()
+        # 登陆时会在持有锁的情况下更新 token，所以使用可重入锁
+        self._lock = threading.RLock()
+
+        # 读取之前保存的 token
+        if self.token_path and path.exists(self.token_path):
+            with open(self.token_path) as token_file:
+                self.token = json.load(token_file)['token']
+
+    def get(self, route, auth=False, **kwargs):
+        """发送 get 请求，参数见 request
+
+        Returns:
+            requests.Response: 响应
+        """
+        return self.request('GET', route, auth=auth, **kwargs)
+
+    def post(self, route, auth=False, **kwargs):
+        """发送 post 请求，参数见 request
+
+        Returns:
+            requests.Response: 响应
+        """
+        return self.request('POST', route, auth=auth, **kwargs)
+
+    def request(self, method, route, auth=False, **kwargs):
+        """发送请求
+        需要登陆的请求会带上当前的 token，如果返回 401 则重新登陆后再请求一次
+
+        Args:
+            method: 请求方法
+            route: 接口路径，如 /game/world-size
+            auth: 是否需要登陆
+            kwargs: 传递给 requests 的其他参数，默认超时时间为 REQUEST_TIMEOUT
+
+        Returns:
+            requests.Response: 响应
+        """
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        token = self.token
+        if auth and not token:
+            token = self.login()
+
+        r = self._send(method, route, auth, kwargs, token)
+        if auth and r.status_code == 401:
+            token = self.login(token)
+            r = self._send(method, route, auth, kwargs, token)
+        r.raise_for_status()
+
+        # 每次请求后 token 都会更新，换成最新的
+        if auth and 'X-Token' in r.headers:
+            self._set_token(r.headers['X-Token'])
+        return r
+
+    def login(self, stale_token=None):
+        """登陆
+        会读取 config_path 中的用户名和密码进行登陆
+        多个线程同时请求时，只有第一个线程会真正登陆，其他线程发现 token 已经被替换后直接使用新的 token
+
+        Args:
+            stale_token: 发送请求时使用的 token，当前 token 已经不是它时说明请求之后已经有其他线程更新过 token，不需要重新登陆
+
+        Returns:
+            string: 最新的 token
+        """
+        with self._lock:
+            if self.token and self.token != stale_token:
+                return self.token
+
+            with open(self.config_path) as auth:
+                d = json.load(auth)
+                username = d["username"]
+                password = d["password"]
+
+            r = self.session.post(f'{self.api_url}/auth/signin', json={'email': username, 'password': password}, timeout=REQUEST_TIMEOUT)
+            r.raise_for_status()
+            self._set_token(json.loads(r.text)["token"])
+            return self.token
+
+    def _send(self, method, route, auth, kwargs, token=None):
+        """实际发送请求
+
+        Args:
+            token: 需要登陆的请求使用的 token
+
+        Returns:
+            requests.Response: 响应
+        """
+        if auth:
+            kwargs = dict(kwargs, headers=dict(kwargs.get('headers') or {}, **{ 'X-Token': token, 'X-Username': token }))
+        return self.session.request(method, f'{self.api_url}{route}', **kwargs)
+
+    def _set_token(self, token):
+        """更新 token，需要的话保存到本地
+
+        Args:
+            token: 新的 token
+        """
+        with self._lock:
+            self.token = token
+            if self.token_path and path.exists(path.dirname(self.token_path) or '.'):
+                # token 可以直接用于登陆后的接口，只允许当前用户读写
+                write_atomic(self.token_path, json.dumps({ 'token': token, 'time': int(time.time()) }), permission=0o600)
+
+
+# 当前进程共用的会话，在 get_shared_session 中初始化
+_shared_session = None
+
+
+def get_shared_session():
+    """获取当前进程共用的会话
+    同一进程中绘制的所有 shard 共用一个会话，只需要登陆一次
+
+    Returns:
+        ScreepsSession: 共用的会话
+    """
+    global _shared_session
+    if _shared_session is None:
+        _shared_session = ScreepsSession()
+    return _shared_session
@@ -1,14 +1,36 @@
 import json
-from os import path, makedirs
+import hashlib
+from os import path, makedirs, listdir, remove
+from shutil import rmtree
 import time
 import math
+import queue
+import sqlite3
+import multiprocessing
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 from PIL import Image, ImageDraw, UnidentifiedImageError
 import cairosvg
-import requests
+from requests import RequestException
+# numpy 为可选依赖，未安装时放大底图会退回到 pillow 引擎
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from simple_bar import Bar
+from http_client import DOWNLOAD_WORKERS, REQUEST_TIMEOUT, REQUEST_BACKOFF
+from screeps_session import get_shared_session
+from file_utils import write_atomic
+from http_cache import HttpCache
+from png_writer import PngWriter
+from tile_pyramid import TilePyramid
+from raw_image import save_raw, load_raw
+from run_report import RunReport, instrument
+from room_store import RoomStore
+from room_index import RoomIndex
+from room_archive import RoomArchive, ARCHIVE_PATH
 
 # 每个房间的边长像素值
 ROOM_PIXEL = 20
@@ -18,6 +40,62 @@ ROOM_PRE_SECTOR = 10
 ZOOM = 3
 # shard0 在放大 3 倍后的像素值，注释本行会引起 pillow 的 DecompressionBombWarning 警告
 Image.MAX_IMAGE_PIXELS = 144000001
+# 区块瓦片的下载地址，后面会拼接上 /shard{shard}/zoom1/{区块名}.png
+TILE_URL = 'https://d3os7yery2usni.cloudfront.net/map'
+# 区块瓦片缓存在多久之后需要向服务器重新验证（秒），瓦片发生变化时会重新绘制底图，为 None 时永远使用缓存的瓦片
+TILE_REVALIDATE_AFTER = 7 * 24 * 3600
+# 放大底图使用的引擎，numpy / pillow / pixel 三者之一，pixel 为最早的逐像素实现，速度非常慢，仅用于比对结果
+RESIZE_ENGINE = 'numpy'
+# 同时获取房间信息的区块数量
+STATS_WORKERS = 4
+# 获取单个区块房间信息的超时时间（秒）
+STATS_TIMEOUT = 60
+# 获取单个区块房间信息失败后的最大重试次数
+STATS_RETRIES = 3
+# 将头像 svg 转换为 png 时使用的进程数，为 None 时使用 cpu 核数
+RASTERIZE_WORKERS = None
+# 转换头像的进程的启动方式，创建进程池时已经有下载线程在运行，直接 fork 会把线程持有的锁一起复制到子进程中导致死锁，
+# 所以使用 forkserver，不支持的系统（如 windows）上使用 spawn，子进程会重新导入入口脚本，入口代码需要放在 if __name__ == "__main__" 中
+RASTERIZE_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+# 头像缓存在多久之后需要向服务器重新验证（秒），头像按照头像设置的哈希保存，设置变化时总会重新下载，为 None 时不重新验证
+AVATAR_REVALIDATE_AFTER = 30 * 24 * 3600
+# 头像缓存目录的大小上限（字节），超过后会从最久没有使用的头像开始删除，为 None 时不限制
+AVATAR_CACHE_SIZE = 64 * 1024 * 1024
+# 是否将渲染好的头像保存为磁盘上的精灵图，下次绘制时未变更头像的玩家可以直接使用
+SPRITE_ATLAS = True
+# 精灵图每行包含的玩家数量
+SPRITE_ATLAS_COLUMNS = 32
+# 是否按行分块绘制，开启后底图和结果都不会完整地保存在内存中，可以大幅降低 shard0 的内存占用
+TILED = False
+# 分块绘制时的输出格式，png 为单张图片，pyramid 为 z/x/y 格式的瓦片金字塔，见 PYRAMID_PATH
+TILED_OUTPUT = 'png'
+# 是否在保存结果的同时更新瓦片金字塔，可以用于在网页上缩放查看，分块绘制时由 TILED_OUTPUT 决定
+PYRAMID_OUTPUT = False
+# 瓦片金字塔的保存路径，后面会拼接上 /{z}/{x}/{y}.png，每天都会更新到同一个目录中，只有内容变化的瓦片会重新保存
+PYRAMID_PATH = 'tiles'
+# 是否增量绘制，开启后会以上次绘制的结果为基础，只重新绘制发生变化的房间，分块绘制时不生效
+DELTA_RENDER = True
+# 底图缓存的格式，raw 为未压缩的 RGBA 数据，加载时通过内存映射直接使用，几乎没有解码开销但会占用更多磁盘空间，png 为压缩后的图片
+CACHE_FORMAT = 'raw'
+# 结果的保存格式，png 为无损 png，palette 为压缩到 256 色的 png，webp 为 webp 图片，分块绘制时只支持 png
+OUTPUT_FORMAT = 'png'
+# png 的压缩等级，0 - 9，越大文件越小但保存越慢
+PNG_COMPRESS_LEVEL = 6
+# webp 的质量，0 - 100，为 None 时使用无损压缩
+WEBP_QUALITY = None
+# 是否以流水线方式绘制，开启后底图、房间信息和头像会同时下载，每个区块的房间信息和玩家头像准备好后就会立刻绘制到底图上，
+# 可以缩短没有缓存时的绘制耗时，流水线绘制总是完整绘制整个世界，分块绘制时不生效
+PIPELINE = False
+# 是否把每天的房间信息保存到历史房间信息中，之后可以按照房间或者玩家查询，也可以不访问接口绘制之前某天的地图，见 room_archive.RoomArchive
+ARCHIVE = True
+# 从历史房间信息绘制的地图的保存目录，后面会拼接上 /{日期}.png，和每天的结果分开保存，不会覆盖当天实际绘制的结果
+ARCHIVE_DIST_NAME = 'archive'
+# 是否在绘制完成后保存绘制报告，报告中包含各阶段的耗时、下载字节数、缓存命中数和内存占用峰值
+RUN_REPORT = True
+# 是否为安静模式，安静模式下进度条每隔 QUIET_BAR_INTERVAL 秒才刷新一次，可以减少逐个房间刷新进度的开销
+QUIET = False
+# 安静模式下进度条的刷新间隔（秒）
+QUIET_BAR_INTERVAL = 1
 # 头像边框的颜色
 AVATAR_OUTLINE_COLOR = '#151515'
 # 地图指定区域的颜色
@@ -29,31 +107,138 @@ COLORS = {
     # 新手保护区
     "novice": '#7cff7c'
 }
+# 房间状态对应的蒙版类型，不在其中的状态不需要添加蒙版
+STATUS_MASKS = {
+    "out of borders": 'inactivated',
+    "respawn": 'respawn',
+    "novice": 'novice'
+}
+# 各类蒙版的混色查找表，在 ScreepsWorldView._get_mask_lut 中生成
+MASK_LUTS = {}
+
+def svg2png(svg):
+    """将 svg 转换为 png
+    会在进程池中调用，所以放在模块顶层
+
+    Args:
+        svg: bytes svg 内容
+
+    Returns:
+        bytes: png 内容
+    """
+    return cairosvg.svg2png(bytestring=svg)
+
+
+def create_rasterizer():
+    """新建用于将头像 svg 转换为 png 的进程池
+
+    Returns:
+        ProcessPoolExecutor: 进程池，见 RASTERIZE_WORKERS 及 RASTERIZE_START_METHOD
+    """
+    return ProcessPoolExecutor(max_workers=RASTERIZE_WORKERS, mp_context=multiprocessing.get_context(RASTERIZE_START_METHOD))
+
+
+def get_avatar_key(badge):
+    """获取头像在缓存目录中的文件名
+    头像按照头像设置的哈希保存，头像设置相同的玩家共用一个文件，玩家改名或者更换头像后不需要按玩家名比较设置
+
+    Args:
+        badge: 接口返回的头像设置
+
+    Returns:
+        string: 头像文件名
+    """
+    return hashlib.sha1(json.dumps(badge, sort_keys=True).encode()).hexdigest() + '.png'
+
 
 class ScreepsWorldView:
     # 要绘制的 shard，在初始化时会修改为指定的值
     shard = 3
     # 持有的地图 Image 对象
     background = None
-    # 头像缓存路径
+    # 头像缓存路径，所有 shard 共用
     avatar_path = '.screeps_cache/avatar'
+    # 区块瓦片及头像的下载缓存，见 http_cache.HttpCache
+    tile_cache = None
+    avatar_cache = None
     # 缓存路径
     cache_path = None
     # 成果路径
     dist_path = None
     # 世界尺寸信息，在 _init_world 中初始化
     shard_info = None
-    # 房间信息，用于在底图上添加用户头像，键为房间名，值为房间配置信息
+    # 房间信息，用于在底图上添加用户头像，见 room_store.RoomStore，在 _init_world 后初始化
     rooms = None
-    # 地图中出现的用户名，用于下载头像
-    users = None
-    # 所有的用户名头像设置，键为玩家名，值为玩家的头像设置字符串
-    avatars_setting = None
     # 结果文件名
     result_name = ''
-
-    def __init__(self, shard=3):
+    # 放大底图使用的引擎，见 RESIZE_ENGINE
+    resize_engine = RESIZE_ENGINE
+    # 区块瓦片的下载地址，见 TILE_URL
+    tile_url = TILE_URL
+    # screeps 接口会话，见 screeps_session.ScreepsSession
+    api = None
+    # 带连接池的 http 会话，用于下载瓦片，和 self.api 共用连接池
+    session = None
+    # 是否使用磁盘上的头像精灵图，见 SPRITE_ATLAS
+    sprite_atlas = SPRITE_ATLAS
+    # 渲染好的头像，键为 (玩家名, 是否为外矿, ZOOM)，值为头像 Image，头像失效时为 None
+    sprites = None
+    # 本次绘制是否渲染了新的头像，为 True 时才需要重新保存精灵图
+    sprites_changed = False
+    # 本次绘制中头像缺失或者失效的玩家，这些玩家的房间在下次增量绘制时会重新绘制
+    missing_avatars = None
+    # 磁盘上的精灵图及其索引，见 _open_sprite_atlas
+    sprite_atlas_file = None
+    # 房间坐标索引，见 room_index.RoomIndex，在 _init_world 后初始化
+    room_index = None
+    # 是否按行分块绘制，见 TILED
+    tiled = TILED
+    # 分块绘制时的输出格式，见 TILED_OUTPUT
+    tiled_output = TILED_OUTPUT
+    # 是否同时更新瓦片金字塔，见 PYRAMID_OUTPUT
+    pyramid_output = PYRAMID_OUTPUT
+    # 是否以流水线方式绘制，见 PIPELINE
+    pipeline = PIPELINE
+    # 下载瓦片、获取房间信息及下载头像时的线程数，流水线绘制时三者会同时进行，需要分摊连接池，见 draw_by_pipeline
+    tile_workers = DOWNLOAD_WORKERS
+    stats_workers = STATS_WORKERS
+    avatar_workers = DOWNLOAD_WORKERS
+    # 常驻进程中保留的底图、上次的结果和头像，见 warm_cache.WarmState，为 None 时每次都从磁盘加载
+    warm = None
+    # 历史房间信息，见 room_archive.RoomArchive，没有开启 ARCHIVE 时为 None
+    archive = None
+    # 要从历史房间信息中绘制的日期，为 None 时绘制当天的地图
+    archive_date = None
+    # 是否增量绘制，见 DELTA_RENDER
+    delta_render = DELTA_RENDER
+    # 底图缓存的格式，见 CACHE_FORMAT
+    cache_format = CACHE_FORMAT
+    # 结果的保存格式，见 OUTPUT_FORMAT
+    output_format = OUTPUT_FORMAT
+    # 绘制报告，见 run_report.RunReport，为 None 时不做记录
+    report = None
+    # 进度条的刷新间隔，见 QUIET
+    bar_interval = 0
+
+    def __init__(self, shard=3, resize_engine=RESIZE_ENGINE, tiled=TILED, tiled_output=TILED_OUTPUT, delta_render=DELTA_RENDER,
+                 cache_format=CACHE_FORMAT, output_format=OUTPUT_FORMAT, quiet=QUIET, api=None, tile_url=TILE_URL, pyramid_output=PYRAMID_OUTPUT,
+                 pipeline=PIPELINE, warm=None, archive_date=None, archive_path=ARCHIVE_PATH):
         self.shard = shard
+        self.tile_url = tile_url
+        self.resize_engine = resize_engine
+        # 从历史房间信息绘制时只读取缓存，不会修改每天绘制使用的底图、瓦片、精灵图和房间索引，
+        # 只保存单张图片，不会更新瓦片金字塔，也不会作为下次增量绘制的基础
+        self.tiled = tiled and not archive_date
+        self.tiled_output = 'png' if archive_date else tiled_output
+        self.pyramid_output = pyramid_output and not archive_date
+        self.pipeline = pipeline and not tiled and not archive_date
+        self.warm = None if archive_date else warm
+        self.archive_date = archive_date
+        self.delta_render = delta_render and not archive_date
+        self.cache_format = cache_format
+        self.output_format = output_format
+        self.report = RunReport(shard) if RUN_REPORT else None
+        self.bar_interval = QUIET_BAR_INTERVAL if quiet else 0
         
         print(f'--- 开始绘制 Screeps Shard{shard} {self.result_name} ---')
         # 没有缓存的话就新建缓存路径
@@ -62,32 +247,173 @@ class ScreepsWorldView:
 
         # 初始化内部属性
         self.cache_path = f'.screeps_cache/{shard}'
-        self.dist_path = f'dist/{shard}'
+        self.dist_path = f'dist/{shard}/{ARCHIVE_DIST_NAME}' if archive_date else f'dist/{shard}'
+        makedirs(self.dist_path, exist_ok=True)
         self.shard_info = {}
-        self.rooms = {}
-        self.users = []
-        self.avatars_setting = {}
-        self.result_name = time.strftime('%Y-%m-%d', time.localtime(time.time()))
-
-        # 初始化世界
+        self.sprites = {}
+        self.missing_avatars = set()
+        self.result_name = archive_date or time.strftime('%Y-%m-%d', time.localtime(time.time()))
+        # 不指定会话的话就使用当前进程共用的会话，多个 shard 只需要登陆一次
+        self.api = api or get_shared_session()
+        self.session = self.api.session
+        self.tile_cache = HttpCache(f'{self.cache_path}/room', revalidate_after=TILE_REVALIDATE_AFTER)
+        self.avatar_cache = HttpCache(self.avatar_path, max_size=AVATAR_CACHE_SIZE, revalidate_after=AVATAR_REVALIDATE_AFTER)
+        self.archive = RoomArchive(archive_path) if ARCHIVE or archive_date else None
+
+        # 初始化世界，世界尺寸发生变化时常驻内存中的内容都不能再使用
         self._init_world()
+        if self.warm is not None and self.warm.shard_info != self.shard_info:
+            self.warm.reset(self.shard_info)
+        if self.archive_date:
+            self.room_index = RoomIndex.get(self._get_quadrant_size())
+        else:
+            self.room_index = RoomIndex.load(self.cache_path, self._get_quadrant_size())
+        self.rooms = RoomStore(self.room_index)
+
+        # 初始化地图实例，分块绘制时只准备好每行的底图缓存，绘制时再逐行加载
+        # 流水线绘制时底图会在 draw 中和房间信息同时准备
+        if self.tiled:
+            self.draw_background_bands()
+        elif not self.pipeline:
+            self.background = self._prepare_background()
 
-        # 初始化地图实例
-        if path.exists(f'{self.cache_path}/background.png'):
-            self.background = Image.open(f'{self.cache_path}/background.png')
+
+    def _prepare_background(self):
+        """准备完整的世界底图，有缓存时直接使用缓存
+        从历史房间信息绘制时是只读的，不会重新验证瓦片，也不会修改每天绘制使用的底图缓存和上次绘制的信息
+
+        Returns:
+            Image: 世界底图
+        """
+        read_only = bool(self.archive_date)
+        has_cache = self._has_cached_image(f'{self.cache_path}/background')
+        background = None
+        if has_cache and (read_only or not self._revalidate_tiles()):
+            background = self._load_background_cache()
+
+        # 世界扩张后缓存的底图尺寸会和当前世界不一致，需要重新绘制
+        if background is not None and background.size == (self._get_sector_num() * ROOM_PIXEL * ROOM_PRE_SECTOR * ZOOM,) * 2:
             print('使用缓存地图 ✔')
-        else:
-            self.background = self.draw_background()
+            return background
+
+        if read_only:
+            # 历史上的世界尺寸和缓存不同，只在内存中拼接当时的底图
+            return self.draw_background(save_cache=False)
+
+        if has_cache:
+            # 地形或者世界尺寸发生了变化，上次的结果不能再用于增量绘制
+            self._discard_last_render()
+        return self.draw_background()
+
+
+    @property
+    def users(self):
+        """地图中出现的用户名，用于下载头像
+        """
+        return self.rooms.owners
+
+
+    @property
+    def avatars_setting(self):
+        """所有的用户名头像设置，键为玩家名，值为接口返回的头像设置
+        """
+        return self.rooms.badges
+
+
+    @instrument('background')
+    def _load_background_cache(self):
+        """加载缓存的底图
+
+        Returns:
+            Image: 缓存的世界底图，常驻模式下为常驻底图的副本
+        """
+        if self.warm is not None and self.warm.background is not None:
+            self._count('warm_hit')
+            return self.warm.background.copy()
+
+        self._count('cache_hit')
+        return self._keep_warm_background(self._load_cached_image(f'{self.cache_path}/background'))
+
+
+    def _keep_warm_background(self, background):
+        """常驻模式下把原始底图保留在内存中，绘制时使用它的副本
+
+        Args:
+            background: Image 原始底图
+
+        Returns:
+            Image: 用于绘制的底图
+        """
+        if self.warm is None:
+            return background
+
+        self.warm.background = background
+        return background.copy()
 
 
     def draw(self):
         """绘制地图
         
-        入口方法，会自动完成地图绘制工作
+        入口方法，会自动完成地图绘制工作，开启了 RUN_REPORT 的话会把绘制报告保存到结果旁边
+        """
+        try:
+            if self.archive_date:
+                # 房间信息来自历史房间信息，头像只使用本地缓存，不会访问接口
+                self.load_archive()
+                self.draw_world()
+            elif self.pipeline:
+                self.draw_by_pipeline()
+            else:
+                self.get_world_stats()
+                self.get_avatar()
+                self.draw_world()
+
+            if self.archive and not self.archive_date:
+                # 地图已经保存好了，历史房间信息保存失败时不需要重新绘制
+                try:
+                    self.save_archive()
+                except (sqlite3.Error, ValueError) as err:
+                    print(f'保存历史房间信息失败: {err}')
+        finally:
+            if self.report:
+                self.report.save(f'{self.dist_path}/{self.result_name}.json')
+
+
+    @instrument('archive')
+    def save_archive(self):
+        """把当天的房间信息保存到历史房间信息中
+        需要调用 self.get_world_stats()，同一天重复保存时会覆盖之前保存的信息
+
+        Returns:
+            self: 自身
+        """
+        self.archive.append(self.shard, self.result_name, self.shard_info, self.rooms)
+        self._count('rooms_archived', len(self.rooms))
+        return self
+
+
+    @instrument('archive')
+    def load_archive(self):
+        """从历史房间信息中加载 self.archive_date 当天的房间信息，代替 self.get_world_stats()
+        没有保存该日期时使用它之前最近的一次
+
+        Returns:
+            self: 自身
+        """
+        _, self.rooms = self.archive.get_snapshot(self.shard, self.archive_date)
+        self._count('rooms_loaded', len(self.rooms))
+        return self
+
+
+    def _count(self, key, value=1):
+        """给绘制报告中当前阶段的计数器加上指定值，没有开启报告时不做任何操作
+
+        Args:
+            key: 计数器名，如 bytes_downloaded、cache_hit、cache_miss
+            value: 要加上的值
         """
-        self.get_world_stats()
-        self.get_avatar()
-        self.draw_world()
+        if self.report:
+            self.report.count(key, value)
 
 
     def _init_cache_folder(self):
@@ -107,11 +433,15 @@ class ScreepsWorldView:
         # print('缓存目录创建成功')
 
 
-    def draw_background(self):
+    @instrument('background')
+    def draw_background(self, save_cache=True):
         """绘制底图
         下载区块瓦片，并拼接成整个世界底图
         该方法会自动将底图缓存起来
 
+        Args:
+            save_cache: 是否缓存绘制好的底图，为 False 时只返回内存中的底图
+
         Returns:
             Image: 绘制好的世界底图
         """
@@ -121,34 +451,217 @@ class ScreepsWorldView:
 
         x_sectors_name, y_sectors_name = self._get_sectors_name()
         total_sector_num = len(x_sectors_name) * len(y_sectors_name)
-        bar = Bar('正在下载房间')
-        
-        # 遍历所有瓦片进行下载并粘贴到指定位置
-        for x in range(len(x_sectors_name)):
-            for y in range(len(y_sectors_name)):
-                sector_name = x_sectors_name[x] + y_sectors_name[y]
-                sector_img_path = f'{self.cache_path}/room/{sector_name}.png'
+        bar = Bar('正在下载房间', self.bar_interval)
+
+        # 并发下载所有瓦片，哪个先下载好就先粘贴哪个
+        with ThreadPoolExecutor(max_workers=self.tile_workers) as executor:
+            tasks = {}
+            for x in range(len(x_sectors_name)):
+                for y in range(len(y_sectors_name)):
+                    sector_name = x_sectors_name[x] + y_sectors_name[y]
+                    tasks[executor.submit(self._get_sector_image, sector_name)] = (sector_name, x, y)
+
+            for i, task in enumerate(as_completed(tasks)):
+                sector_name, x, y = tasks[task]
                 # 更新进度
-                bar.update(f'{sector_name} {len(y_sectors_name) * x + y + 1}/{total_sector_num}')
-
-                # 有缓存的话直接用，底图永远不会发生变化
-                if path.exists(sector_img_path):
-                    img = Image.open(sector_img_path)
-                else:
-                    img = Image.open(BytesIO(requests.get(f'https://d3os7yery2usni.cloudfront.net/map/shard{self.shard}/zoom1/{sector_name}.png').content))
-                    img.save(sector_img_path)
-                background.paste(img, (x * ROOM_PIXEL * ROOM_PRE_SECTOR, y * ROOM_PIXEL * ROOM_PRE_SECTOR))
+                bar.update(f'{sector_name} {i + 1}/{total_sector_num}')
+                background.paste(task.result(), (x * ROOM_PIXEL * ROOM_PRE_SECTOR, y * ROOM_PIXEL * ROOM_PRE_SECTOR))
 
         bar.close()
 
+        if save_cache:
+            self.tile_cache.save()
+
         # 缩放为指定大小
         background = self._resize(background)
+        if not save_cache:
+            return background
+
         # 保存下载供以后使用
-        background.save(f'{self.cache_path}/background.png')
+        self._save_cached_image(f'{self.cache_path}/background', background)
+
+        return self._keep_warm_background(background)
+
+
+    @instrument('background')
+    def draw_background_bands(self):
+        """按行绘制底图
+        和 draw_background 一样下载区块瓦片并放大，但是每次只处理一行区块，并将每行分别缓存到 background 目录下
+        已经缓存的行会直接跳过
+
+        Returns:
+            self: 自身
+        """
+        sector_num = self._get_sector_num()
+        sector_pixel = ROOM_PIXEL * ROOM_PRE_SECTOR
+        if any(self._has_cached_image(self._get_band_path(row)) for row in range(sector_num)):
+            # 瓦片发生变化的行需要重新绘制，放大时会用到下一行的第一行像素，所以上一行也要重新绘制
+            for row in self._revalidate_tiles():
+                for changed_row in (row, (row - 1) % sector_num):
+                    self._remove_cached_image(self._get_band_path(changed_row))
+
+        missing_rows = [ row for row in range(sector_num) if not self._has_cached_image(self._get_band_path(row)) ]
+        if not missing_rows:
+            print('使用缓存地图 ✔')
+            return self
+
+        makedirs(f'{self.cache_path}/background', exist_ok=True)
+        bar = Bar('正在绘制底图', self.bar_interval)
+        row_images = {}
+        for i, row in enumerate(missing_rows):
+            bar.update(f'{i + 1}/{len(missing_rows)}')
+            # 放大时整张底图会上移 ZOOM 行（见 _resize_by_pixel），所以这里要多拼上下一行区块的第一行像素
+            # 最后一行区块拼上的则是第一行区块的第一行像素，这样和整张绘制时的结果完全一致
+            next_row = (row + 1) % sector_num
+            for needed_row in (row, next_row):
+                if needed_row not in row_images:
+                    row_images[needed_row] = self._draw_background_row(needed_row)
+
+            band = Image.new('RGBA', (sector_num * sector_pixel, sector_pixel + 1))
+            band.paste(row_images.pop(row), (0, 0))
+            band.paste(row_images[next_row].crop((0, 0, sector_num * sector_pixel, 1)), (0, sector_pixel))
+            band = self._resize(band, show_bar=False).crop((0, 0, sector_num * sector_pixel * ZOOM, sector_pixel * ZOOM))
+
+            self._save_cached_image(self._get_band_path(row), band)
+
+        self.tile_cache.save()
+        bar.close()
+        return self
+
+
+    def _draw_background_row(self, row):
+        """拼接一行区块的瓦片
+        注意这里没有使用缩放
+
+        Args:
+            row: 区块的行号
+
+        Returns:
+            Image: 该行区块拼接成的图片，没有区块的位置为白色
+        """
+        sector_pixel = ROOM_PIXEL * ROOM_PRE_SECTOR
+        image = Image.new('RGBA', (self._get_sector_num() * sector_pixel, sector_pixel), (0xff,) * 4)
+
+        x_sectors_name, y_sectors_name = self._get_sectors_name()
+        if row >= len(y_sectors_name):
+            return image
+
+        with ThreadPoolExecutor(max_workers=self.tile_workers) as executor:
+            sectors = executor.map(self._get_sector_image, [ x_name + y_sectors_name[row] for x_name in x_sectors_name ])
+            for x, sector in enumerate(sectors):
+                image.paste(sector, (x * sector_pixel, 0))
+
+        return image
+
+
+    def _get_band_path(self, row):
+        """获取按行缓存的底图路径
 
-        return background
+        Args:
+            row: 区块的行号
+
+        Returns:
+            string: 该行底图不带扩展名的缓存路径
+        """
+        return f'{self.cache_path}/background/{row}'
+
+
+    def _get_sector_image(self, sector_name):
+        """获取指定区块的瓦片
+        有缓存并且不需要重新验证的话直接用，否则下载或者重新验证后缓存下来
+
+        Args:
+            sector_name: string 区块名（区块右下角的房间名）
+
+        Returns:
+            Image: 区块瓦片
+        """
+        key = f'{sector_name}.png'
+        if self.archive_date:
+            return self._read_sector_tile(sector_name)
+
+        if self.tile_cache.is_fresh(key):
+            self._count('cache_hit')
+            self.tile_cache.touch(key)
+        else:
+            self._update_sector_tile(sector_name)
+
+        img = Image.open(self.tile_cache.get_path(key))
+        # 在线程中完成解码，避免粘贴时再阻塞主线程
+        img.load()
+        return img
+
+
+    def _read_sector_tile(self, sector_name):
+        """只读地获取指定区块的瓦片，用于从历史房间信息绘制
+        有缓存时直接使用，不会重新验证，缓存中没有的瓦片下载后只在内存中使用
+
+        Args:
+            sector_name: string 区块名
+
+        Returns:
+            Image: 区块瓦片
+        """
+        key = f'{sector_name}.png'
+        if self.tile_cache.has(key):
+            self._count('cache_hit')
+            img = Image.open(self.tile_cache.get_path(key))
+        else:
+            r = self.session.get(f'{self.tile_url}/shard{self.shard}/zoom1/{sector_name}.png', timeout=REQUEST_TIMEOUT)
+            r.raise_for_status()
+            self._count('cache_miss')
+            self._count('bytes_downloaded', len(r.content))
+            img = Image.open(BytesIO(r.content))
+
+        img.load()
+        return img
+
+
+    def _update_sector_tile(self, sector_name):
+        """下载区块瓦片到缓存中，已有缓存时会带上 ETag / Last-Modified 进行条件请求
+
+        Args:
+            sector_name: string 区块名
+
+        Returns:
+            bool: 瓦片内容是否发生了变化
+        """
+        url = f'{self.tile_url}/shard{self.shard}/zoom1/{sector_name}.png'
+        key = f'{sector_name}.png'
+        r = self.tile_cache.fetch(key, lambda headers: self.session.get(url, headers=headers, timeout=REQUEST_TIMEOUT))
+        if r is None:
+            self._count('not_modified')
+            return False
 
+        self._count('cache_miss')
+        self._count('bytes_downloaded', len(r.content))
+        return self.tile_cache.put(key, r.content, r)
 
+
+    @instrument('revalidate')
+    def _revalidate_tiles(self):
+        """向服务器重新验证超过 TILE_REVALIDATE_AFTER 的区块瓦片
+        服务器返回 304 或者内容没有变化时继续使用缓存，缺少的瓦片会直接下载
+
+        Returns:
+            list: 瓦片发生了变化的区块行号
+        """
+        x_sectors_name, y_sectors_name = self._get_sectors_name()
+        stale_sectors = [
+            (row, x_name + y_name) for row, y_name in enumerate(y_sectors_name) for x_name in x_sectors_name
+            if not self.tile_cache.is_fresh(f'{x_name + y_name}.png')
+        ]
+        if not stale_sectors:
+            return []
+
+        with ThreadPoolExecutor(max_workers=self.tile_workers) as executor:
+            changed = list(executor.map(self._update_sector_tile, [ sector_name for _, sector_name in stale_sectors ]))
+        self.tile_cache.save()
+
+        return sorted({ row for (row, _), is_changed in zip(stale_sectors, changed) if is_changed })
+
+
+    @instrument('draw-world')
     def draw_world(self):
         """绘制用户信息
         将用户头像及区域添加到底图上
@@ -156,59 +669,615 @@ class ScreepsWorldView:
         Returns:
             self: 自身
         """
-        bar = Bar('正在绘制世界')
+        # 加载之前渲染好的头像
+        self._load_sprite_atlas()
 
-        sector_num = self._get_sector_num()
+        if self.tiled:
+            result_path = self._draw_world_by_band()
+        else:
+            bar = Bar('正在绘制世界', self.bar_interval)
+
+            last_render = self._load_last_render() if self.delta_render else None
+            if last_render:
+                # 只重新绘制发生变化的房间
+                self._draw_world_by_delta(last_render, bar)
+            else:
+                # 只遍历有信息的房间进行绘制
+                self._draw_rooms(self._get_room_rows(), bar)
 
-        # 从像素角度挨个遍历所有房间进行绘制
-        for x in range(0, sector_num * ROOM_PRE_SECTOR * ROOM_PIXEL * ZOOM, ROOM_PIXEL * ZOOM):
-            for y in range(0, sector_num * ROOM_PRE_SECTOR * ROOM_PIXEL * ZOOM * 2, ROOM_PIXEL * ZOOM):
-                room_name = self._pixel2room((x, y))
-                bar.update(room_name)
+            result_path = self._save_world(bar)
 
-                if room_name not in self.rooms:
-                    continue
-                room = self.rooms[room_name]
-
-                # 绘制区域
-                if room['status'] == 'out of borders':
-                    self.add_inactivated_mask(x, y, 'inactivated')
-                elif room['status'] == 'respawn':
-                    self.add_inactivated_mask(x, y, 'respawn')
-                elif room['status'] == 'novice':
-                    self.add_inactivated_mask(x, y, 'novice')
-                
-                # 将用户头像贴上去
-                if 'owner' in room:
-                    avatar = self._draw_avatar(room['owner'], rcl=room['rcl'])
-                    if not avatar: continue
-                    # 粘贴到指定位置
-                    self.background.paste(avatar, (x + int(((ROOM_PIXEL * ZOOM) - avatar.size[0]) / 2), y + int(((ROOM_PIXEL * ZOOM) - avatar.size[1]) / 2)), mask=avatar)
+        # 把本次渲染的头像保存下来
+        self._save_sprite_atlas()
 
+        print(f'已保存至 {result_path}')
+        return self
+
+
+    def _save_world(self, bar):
+        """保存绘制好的完整结果，并记录本次绘制的信息用于下次增量绘制
+
+        Args:
+            bar: Bar 用于显示进度，保存完成后会关闭
+
+        Returns:
+            string: 结果保存的路径
+        """
         bar.update('保存中')
-        # 按照日期进行保存
-        result_path = f'{self.dist_path}/{self.result_name}.png'
-        self.background.save(result_path)
+        # 按照日期进行保存，从历史房间信息绘制的结果不会用于下次增量绘制
+        result_path = self._save_result(self.background)
+        if not self.archive_date:
+            self._save_last_render(result_path)
         bar.close()
 
+        if self.pyramid_output:
+            self._save_pyramid(self.background)
+        return result_path
+
+
+    @instrument('pipeline')
+    def draw_by_pipeline(self):
+        """以流水线方式绘制地图
+        底图、房间信息和头像同时下载，底图准备好之后，每个区块的房间信息获取到后就会立刻绘制区域蒙版，
+        房间所有者的头像准备好后就会立刻贴上头像，所有内容都绘制完成后保存结果
+
+        Returns:
+            self: 自身
+        """
+        self.background = None
+        # 各个任务完成时都会往这里发送事件，绘制只在当前线程中进行
+        events = queue.Queue()
+        # 头像已经可以使用的玩家，及等待头像准备好后再绘制的房间
+        ready_users = set()
+        waiting_rooms = {}
+        # 底图准备好之前获取到的房间
+        pending_rooms = []
+        avatar_tasks = {}
+
+        def draw_rooms(rooms):
+            # 所有者的头像还没有准备好的房间先暂存起来，头像准备好后再和区域蒙版一起绘制
+            ready_rooms = []
+            for room in rooms:
+                owner = room[4]
+                if owner is None or owner in ready_users:
+                    ready_rooms.append(room)
+                else:
+                    waiting_rooms.setdefault(owner, []).append(room)
+            self._draw_rooms(ready_rooms)
+
+        # 瓦片、房间信息和头像同时下载，三者的线程数之和不超过连接池大小，避免请求阻塞在等待连接上
+        self.stats_workers = max(min(STATS_WORKERS, DOWNLOAD_WORKERS // 2), 1)
+        self.tile_workers = max((DOWNLOAD_WORKERS - self.stats_workers) // 2, 1)
+        self.avatar_workers = max(DOWNLOAD_WORKERS - self.stats_workers - self.tile_workers, 1)
+
+        bar = Bar('正在流水线绘制', self.bar_interval)
+        with create_rasterizer() as rasterizer, ThreadPoolExecutor(max_workers=2) as stages, ThreadPoolExecutor(max_workers=self.avatar_workers) as downloader:
+            background_task = stages.submit(self._prepare_background)
+            background_task.add_done_callback(lambda task: events.put(('background', None)))
+            stats_task = stages.submit(self.get_world_stats, lambda room_names: events.put(('rooms', room_names)))
+            stats_task.add_done_callback(lambda task: events.put(('stats', None)))
+
+            stats_done = False
+            # 只等待实际获取到的房间中出现的玩家的头像
+            while not (self.background is not None and stats_done and not avatar_tasks):
+                event, value = events.get()
+                if event == 'background':
+                    self.background = background_task.result()
+                    draw_rooms(pending_rooms)
+                    pending_rooms = []
+                elif event == 'stats':
+                    stats_task.result()
+                    stats_done = True
+                elif event == 'avatar':
+                    avatar_tasks.pop(value).result()
+                    ready_users.add(value)
+                    self._draw_rooms(waiting_rooms.pop(value, []))
+                elif event == 'rooms':
+                    rooms = self._get_room_rows([ self.room_index.get_index(room_name) for room_name in value ])
+                    # 新出现的玩家头像没有变化的话可以直接使用，否则开始下载
+                    for owner in { room[4] for room in rooms if room[4] is not None } - ready_users - set(avatar_tasks):
+                        if self._is_avatar_cached(owner):
+                            self._count('cache_hit')
+                            ready_users.add(owner)
+                            self._load_sprite_atlas([ owner ])
+                        else:
+                            self._count('cache_miss')
+                            avatar_tasks[owner] = downloader.submit(self._fetch_avatar, owner, rasterizer)
+                            avatar_tasks[owner].add_done_callback(lambda task, owner=owner: events.put(('avatar', owner)))
+
+                    if self.background is None:
+                        pending_rooms.extend(rooms)
+                    else:
+                        draw_rooms(rooms)
+                bar.update(f'玩家头像 {len(ready_users)}/{len(ready_users) + len(avatar_tasks)}')
+
+        self._save_avatar_cache()
+        result_path = self._save_world(bar)
+        self._save_sprite_atlas()
+
         print(f'已保存至 {result_path}')
         return self
 
 
-    def _resize(self, background):
+    def draw_region(self, left, top, right, bottom):
+        """绘制世界中的一块区域，用于按需绘制，不会修改 self.background
+        需要准备好 self.background 和 self.rooms
+
+        Args:
+            left, top: 区域左上角房间的网格位置
+            right, bottom: 区域右下角房间的下一个网格位置
+
+        Returns:
+            Image: 绘制好的区域
+        """
+        side = self.room_index.side
+        room_size = ROOM_PIXEL * ZOOM
+        indexes = [ y * side + x for y in range(top, bottom) for x in range(left, right) ]
+        rows = [ (room_name, x - left * room_size, y - top * room_size, *room) for room_name, x, y, *room in self._get_room_rows(indexes) ]
+
+        background = self.background
+        try:
+            self.background = background.crop((left * room_size, top * room_size, right * room_size, bottom * room_size))
+            self._draw_rooms(rows)
+            return self.background
+        finally:
+            self.background = background
+
+
+    def _load_last_render(self):
+        """加载上次绘制时的房间信息
+        只有上次绘制的结果还在，并且放大倍数和世界尺寸都没有变化时才能用于增量绘制
+
+        Returns:
+            dict: 上次绘制的信息，见 _save_last_render，无法使用时为 None
+        """
+        last_render_path = f'{self.cache_path}/last_render.json'
+        if not path.exists(last_render_path):
+            return None
+
+        with open(last_render_path) as last_render_file:
+            last_render = json.load(last_render_file)
+
+        if last_render['zoom'] != ZOOM or last_render['shard_info'] != self.shard_info or not path.exists(last_render['result']):
+            return None
+        # 旧版本保存的房间信息为字典，无法用于比较
+        if 'columns' not in last_render['rooms']:
+            return None
+
+        last_render['rooms'] = RoomStore.from_dict(last_render['rooms'])
+        return last_render
+
+
+    def _save_last_render(self, result_path):
+        """保存本次绘制的房间信息，用于下次增量绘制
+        增量绘制需要无损的绘制结果，结果不是无损 png 或者缓存格式为 raw 时会把绘制结果额外缓存一份
+
+        Args:
+            result_path: 本次绘制的结果路径
+        """
+        if self.output_format != 'png' or self.cache_format == 'raw':
+            result_path = self._save_cached_image(f'{self.cache_path}/last_render', self.background)
+
+        last_render = {
+            'result': result_path,
+            'zoom': ZOOM,
+            'shard_info': self.shard_info,
+            'rooms': self.rooms.to_dict(),
+            'missing_avatars': sorted(self.missing_avatars)
+        }
+        write_atomic(f'{self.cache_path}/last_render.json', json.dumps(last_render))
+
+        # 常驻模式下把结果保留在内存中，下次增量绘制时不需要重新加载
+        if self.warm is not None and self.delta_render:
+            self.warm.result = (result_path, self.background)
+
+
+    def _discard_last_render(self):
+        """删除上次绘制的信息，下次绘制时会完整绘制整个世界
+        """
+        last_render_path = f'{self.cache_path}/last_render.json'
+        if path.exists(last_render_path):
+            remove(last_render_path)
+        if self.warm is not None:
+            self.warm.result = None
+
+
+    def _get_changed_rooms(self, last_render):
+        """获取和上次绘制相比发生变化的房间
+        房间状态、所有者、等级发生变化，所有者更换了头像，或者上次绘制时所有者的头像缺失的房间都需要重新绘制
+
+        Args:
+            last_render: 上次绘制的信息，见 _load_last_render
+
+        Returns:
+            array: 需要重新绘制的房间编号，见 RoomStore
+        """
+        return self.rooms.get_changed_indexes(last_render['rooms'], last_render.get('missing_avatars', []))
+
+
+    def _draw_world_by_delta(self, last_render, bar=None):
+        """增量绘制用户信息
+        以上次绘制的结果为基础，只把发生变化的房间从底图中恢复出来再重新绘制
+
+        Args:
+            last_render: 上次绘制的信息，见 _load_last_render
+            bar: Bar 用于显示进度，可以不传
+
+        Returns:
+            self: 自身
+        """
+        changed_rooms = self._get_changed_rooms(last_render)
+
+        rendered = self.warm.take_result(last_render['result']) if self.warm is not None else None
+        if rendered is not None:
+            self._count('warm_hit')
+        else:
+            rendered = self._open_image(last_render['result'])
+        for index in changed_rooms:
+            rect = self.room_index.get_pixel_rect(index, ROOM_PIXEL * ZOOM)
+            rendered.paste(self.background.crop(rect), rect[:2])
+
+        self.background = rendered
+        self._draw_rooms(self._get_room_rows(changed_rooms), bar)
+
+        return self
+
+
+    def _save_cached_image(self, cache_name, image):
+        """按照 self.cache_format 缓存图片
+
+        Args:
+            cache_name: 不带扩展名的缓存路径
+            image: Image 要缓存的图片
+
+        Returns:
+            string: 缓存文件的路径
+        """
+        if self.cache_format == 'raw':
+            save_raw(f'{cache_name}.raw', image)
+            return f'{cache_name}.raw'
+
+        content = BytesIO()
+        image.save(content, 'PNG', compress_level=PNG_COMPRESS_LEVEL)
+        write_atomic(f'{cache_name}.png', content.getvalue())
+        return f'{cache_name}.png'
+
+
+    def _load_cached_image(self, cache_name):
+        """加载缓存的图片
+        优先加载 self.cache_format 格式的缓存，只有另一种格式的缓存时也会加载，并转换为当前格式
+
+        Args:
+            cache_name: 不带扩展名的缓存路径
+
+        Returns:
+            Image: 缓存的图片，没有缓存时为 None
+        """
+        formats = [ self.cache_format ] + [ cache_format for cache_format in ('raw', 'png') if cache_format != self.cache_format ]
+        for cache_format in formats:
+            cache_path = f'{cache_name}.{cache_format}'
+            if not path.exists(cache_path):
+                continue
+
+            image = self._open_image(cache_path)
+            # 从历史房间信息绘制时不会修改缓存
+            if cache_format != self.cache_format and not self.archive_date:
+                self._save_cached_image(cache_name, image)
+            return image
+
+        return None
+
+
+    def _remove_cached_image(self, cache_name):
+        """删除任意格式的图片缓存
+
+        Args:
+            cache_name: 不带扩展名的缓存路径
+        """
+        for cache_format in ('raw', 'png'):
+            if path.exists(f'{cache_name}.{cache_format}'):
+                remove(f'{cache_name}.{cache_format}')
+
+
+    def _has_cached_image(self, cache_name):
+        """是否有任意格式的图片缓存
+
+        Args:
+            cache_name: 不带扩展名的缓存路径
+
+        Returns:
+            bool: 是否有缓存
+        """
+        return path.exists(f'{cache_name}.raw') or path.exists(f'{cache_name}.png')
+
+
+    def _open_image(self, image_path):
+        """打开图片并完成解码
+        .raw 结尾的图片会通过内存映射加载，不需要解码
+
+        Args:
+            image_path: 图片路径
+
+        Returns:
+            Image: 打开的图片
+        """
+        if image_path.endswith('.raw'):
+            return load_raw(image_path)
+
+        image = Image.open(image_path)
+        image.load()
+        return image
+
+
+    @instrument('save')
+    def _save_result(self, image):
+        """按照 self.output_format 保存绘制结果
+
+        Args:
+            image: Image 绘制好的地图
+
+        Returns:
+            string: 结果保存的路径
+        """
+        if self.output_format == 'webp':
+            result_path = f'{self.dist_path}/{self.result_name}.webp'
+            # 无损压缩时 quality 表示压缩的努力程度，exact 用于保留透明像素的颜色
+            image.save(result_path, 'WEBP', lossless=WEBP_QUALITY is None, quality=100 if WEBP_QUALITY is None else WEBP_QUALITY, exact=True)
+        elif self.output_format == 'palette':
+            result_path = f'{self.dist_path}/{self.result_name}.png'
+            image.quantize(256, method=Image.FASTOCTREE).save(result_path, 'PNG', optimize=True)
+        else:
+            result_path = f'{self.dist_path}/{self.result_name}.png'
+            image.save(result_path, 'PNG', compress_level=PNG_COMPRESS_LEVEL)
+
+        return result_path
+
+
+    def _draw_world_by_band(self):
+        """按行绘制用户信息
+        每次只加载一行区块的底图进行绘制，绘制好后立刻写入结果，内存占用和世界大小无关
+        结果会根据 self.tiled_output 保存为单张 png 或者瓦片金字塔
+
+        Returns:
+            string: 结果保存的路径
+        """
+        sector_num = self._get_sector_num()
+        band_pixel = ROOM_PIXEL * ROOM_PRE_SECTOR * ZOOM
+
+        # 把房间按照所在的行分组，并转换为行内的像素位置
+        band_rooms = {}
+        for room_name, x, y, *room in self._get_room_rows():
+            band_rooms.setdefault(y // band_pixel, []).append((room_name, x, y % band_pixel, *room))
+
+        if self.tiled_output == 'pyramid':
+            writer = self._get_pyramid()
+            result_path = writer.root
+        else:
+            result_path = f'{self.dist_path}/{self.result_name}.png'
+            writer = PngWriter(result_path, (sector_num * band_pixel,) * 2, PNG_COMPRESS_LEVEL)
+
+        bar = Bar('正在绘制世界', self.bar_interval)
+        try:
+            for row in range(sector_num):
+                bar.update(f'{row + 1}/{sector_num}')
+                self.background = self._load_cached_image(self._get_band_path(row))
+                self._draw_rooms(band_rooms.get(row, []))
+
+                if self.tiled_output == 'pyramid':
+                    writer.write_row(row, self.background)
+                else:
+                    writer.write(self.background)
+        except BaseException:
+            if self.tiled_output != 'pyramid': writer.abort()
+            raise
+        finally:
+            self.background = None
+
+        bar.update('保存中')
+        if self.tiled_output == 'pyramid':
+            writer.build()
+            self._count('tiles_written', writer.written)
+            self._count('tiles_skipped', writer.skipped)
+        else:
+            writer.close()
+        bar.close()
+
+        return result_path
+
+
+    def _get_pyramid(self):
+        """获取该 shard 的瓦片金字塔
+        最底层的每个瓦片对应一个区块，顺序和 self._get_sectors_name() 一致
+
+        Returns:
+            TilePyramid: 瓦片金字塔
+        """
+        return TilePyramid(f'{self.dist_path}/{PYRAMID_PATH}', self._get_sector_num(), ROOM_PIXEL * ROOM_PRE_SECTOR * ZOOM, self._get_sectors_name())
+
+
+    @instrument('pyramid')
+    def _save_pyramid(self, image):
+        """把完整的绘制结果切分并更新到瓦片金字塔中
+        内容没有变化的瓦片会被跳过
+
+        Args:
+            image: Image 完整的绘制结果
+
+        Returns:
+            string: 瓦片金字塔的保存路径
+        """
+        pyramid = self._get_pyramid()
+        tile_size = pyramid.tile_size
+
+        bar = Bar('正在更新瓦片', self.bar_interval)
+        for y in range(pyramid.tile_num):
+            bar.update(f'{y + 1}/{pyramid.tile_num}')
+            for x in range(pyramid.tile_num):
+                pyramid.write(x, y, image.crop((x * tile_size, y * tile_size, (x + 1) * tile_size, (y + 1) * tile_size)))
+        pyramid.build()
+        bar.close()
+
+        self._count('tiles_written', pyramid.written)
+        self._count('tiles_skipped', pyramid.skipped)
+        print(f'瓦片已更新至 {pyramid.root}，更新 {pyramid.written} 个，跳过 {pyramid.skipped} 个')
+        return pyramid.root
+
+
+    def _get_room_rows(self, indexes=None):
+        """获取要绘制的房间
+        会把 self.rooms 中的网格位置换算为房间左上角在整个世界中的像素位置
+
+        Args:
+            indexes: 要获取的房间编号，默认为所有有信息的房间
+
+        Returns:
+            list: 元素为 (房间名, x, y, 房间状态, 所有者名或 None, 等级)
+        """
+        get_pixel_rect = self.room_index.get_pixel_rect
+        names = self.room_index.names
+        return [
+            (names[index], *get_pixel_rect(index, ROOM_PIXEL * ZOOM)[:2], status, owner, rcl)
+            for index, status, owner, rcl in self.rooms.rows(indexes)
+        ]
+
+
+    def _draw_rooms(self, rooms, bar=None):
+        """绘制多个房间
+        先一次性绘制所有区域蒙版，再贴上房间所有者的头像
+
+        Args:
+            rooms: 要绘制的房间列表，元素为 (房间名, x, y, 房间状态, 所有者名或 None, 等级)，x y 为房间左上角在 self.background 上的像素位置，见 _get_room_rows
+            bar: Bar 用于显示进度，可以不传
+
+        Returns:
+            self: 自身
+        """
+        if bar: bar.update('绘制区域')
+        self.add_status_masks([ (x, y, STATUS_MASKS[status]) for _, x, y, status, _, _ in rooms if status in STATUS_MASKS ])
+
+        for room_name, x, y, _, owner, rcl in rooms:
+            if owner is None:
+                continue
+            if bar: bar.update(room_name)
+            self._paste_avatar(x, y, owner, rcl)
+
+        self._count('rooms_drawn', len(rooms))
+        return self
+
+
+    def _paste_avatar(self, x, y, owner, rcl):
+        """将房间所有者的头像贴到房间中央
+        头像失效时不做任何操作，只记录到 self.missing_avatars 中
+
+        Args:
+            x: 房间左上角的 x 轴像素位置
+            y: 房间左上角的 y 轴像素位置
+            owner: string 房间所有者
+            rcl: 0-8 房间等级
+
+        Returns:
+            self: 自身
+        """
+        avatar = self._get_avatar_sprite(owner, rcl=rcl)
+        if not avatar:
+            self.missing_avatars.add(owner)
+            return self
+        # 粘贴到指定位置
+        self.background.paste(avatar, (x + int(((ROOM_PIXEL * ZOOM) - avatar.size[0]) / 2), y + int(((ROOM_PIXEL * ZOOM) - avatar.size[1]) / 2)), mask=avatar)
+
+        return self
+
+
+    @instrument('resize')
+    def _resize(self, background, show_bar=True):
         """放大底图
-        更好的放大，Image.resize 会导致底图失真
+        更好的放大，Image.resize 的默认重采样会导致底图失真，所以这里只做最近邻放大
+        会根据 self.resize_engine 选择放大的实现，所有引擎的结果逐像素一致
 
         Args:
             background: Image 要放大的底图
+            show_bar: 是否显示进度
+
+        Returns:
+            Image 放大后的底图
+        """
+        engine = self.resize_engine
+        # 没有安装 numpy 时退回到 pillow 引擎
+        if engine == 'numpy' and numpy is None:
+            engine = 'pillow'
+
+        if engine == 'numpy':
+            resize = self._resize_by_numpy
+        elif engine == 'pillow':
+            resize = self._resize_by_pillow
+        elif engine == 'pixel':
+            resize = self._resize_by_pixel
+        else:
+            raise ValueError(f'未知的放大引擎 {engine}')
+
+        bar = Bar('正在放大底图', self.bar_interval) if show_bar else None
+        new_background = resize(background, bar)
+        if bar: bar.close()
+
+        return new_background
+
+
+    def _resize_by_numpy(self, background, bar=None):
+        """使用 numpy 整行整列地重复像素来放大底图
+
+        Args:
+            background: Image 要放大的底图
+            bar: Bar 用于显示进度，可以不传
+
+        Returns:
+            Image 放大后的底图
+        """
+        pixels = numpy.asarray(background.convert('RGBA'))
+        pixels = pixels.repeat(ZOOM, axis=0).repeat(ZOOM, axis=1)
+        # 和逐像素实现保持一致，见 _resize_by_pixel
+        pixels = numpy.roll(pixels, -ZOOM, axis=0)
+
+        return Image.fromarray(pixels, 'RGBA')
+
+
+    def _resize_by_pillow(self, background, bar=None):
+        """使用 pillow 的最近邻重采样放大底图
+        放大倍数为整数时最近邻重采样就是把每个像素重复 ZOOM 份，不会失真
+
+        Args:
+            background: Image 要放大的底图
+            bar: Bar 用于显示进度，可以不传
 
         Returns:
             Image 放大后的底图
         """
         size = background.size
-        new_background = Image.new('RGBA', (self._get_sector_num() * ROOM_PIXEL * ROOM_PRE_SECTOR * ZOOM,) * 2, (0xff,) * 4)
+        resized = background.convert('RGBA').resize((size[0] * ZOOM, size[1] * ZOOM), Image.NEAREST)
+
+        # 和逐像素实现保持一致，整体上移 ZOOM 行，第一行像素被放到最底部，见 _resize_by_pixel
+        new_background = Image.new('RGBA', resized.size)
+        new_background.paste(resized.crop((0, ZOOM, resized.size[0], resized.size[1])), (0, 0))
+        new_background.paste(resized.crop((0, 0, resized.size[0], ZOOM)), (0, resized.size[1] - ZOOM))
+
+        return new_background
+
+
+    def _resize_by_pixel(self, background, bar=None):
+        """逐像素放大底图
+        最早的实现，每个像素都要调用一次 getpixel / putpixel，非常慢
+        注意这里的行范围为 ZOOM * y - ZOOM 到 ZOOM * y，所以第一行像素会以负数下标写到底图的最后 ZOOM 行，
+        整张图会因此上移 ZOOM 行，其他引擎为了保证结果一致也保留了这个偏移
+
+        Args:
+            background: Image 要放大的底图
+            bar: Bar 用于显示进度，可以不传
+
+        Returns:
+            Image 放大后的底图
+        """
+        size = background.size
+        new_background = Image.new('RGBA', (size[0] * ZOOM, size[1] * ZOOM), (0xff,) * 4)
 
-        bar = Bar('正在放大底图')
         # 遍历所有行
         for y in range(size[1]):
             row = []
@@ -221,8 +1290,7 @@ class ScreepsWorldView:
                 for new_x, pixel in enumerate(row):
                     # print(new_x, new_y, pixel)
                     new_background.putpixel((new_x, new_y), pixel)
-            bar.update(f'{y}/{size[1]}')
-        bar.close()
+            if bar: bar.update(f'{y}/{size[1]}')
 
         return new_background
 
@@ -237,7 +1305,7 @@ class ScreepsWorldView:
         Return:
             Image: 绘制好的玩家头像
         """
-        avatar_path = f'{self.avatar_path}/{player}.png'
+        avatar_path = self.avatar_cache.get_path(self._get_avatar_key(player))
         if path.exists(avatar_path):
             # 外矿的话就比占领房间要小一号（没有按房间等级进行绘制）
             correct_size = (6 * ZOOM, 6 * ZOOM) if rcl == 0 else (10 * ZOOM, 10 * ZOOM)
@@ -265,52 +1333,298 @@ class ScreepsWorldView:
             return None
 
 
+    def _get_avatar_sprite(self, player, rcl=8):
+        """获取指定玩家渲染好的头像
+        同一个玩家的头像在一次绘制中只会渲染一次，外矿和占领房间分别渲染
+
+        Args:
+            player: string 要绘制的玩家名
+            rcl: 0-8 要绘制的 rcl 等级
+
+        Return:
+            Image: 绘制好的玩家头像，头像失效时为 None
+        """
+        key = (player, rcl == 0, ZOOM)
+        if key not in self.sprites:
+            self.sprites[key] = self._draw_avatar(player, rcl=rcl)
+            if self.sprites[key] is not None:
+                self.sprites_changed = True
+                self._count('sprite_rendered')
+
+        return self.sprites[key]
+
+
+    def _get_sprite_atlas_path(self):
+        """获取头像精灵图及其索引的路径
+        不同放大倍数渲染出的头像尺寸不同，所以分开保存
+
+        Return:
+            atlas_path, index_path: 精灵图路径及索引路径
+        """
+        return f'{self.cache_path}/sprite_z{ZOOM}.png', f'{self.cache_path}/sprite_z{ZOOM}.json'
+
+
+    def _load_sprite_atlas(self, players=None):
+        """加载磁盘上的头像精灵图
+        需要调用 self.get_avatar()
+        只会加载头像设置和 self.avatars_setting 完全一致的玩家，头像有变化的玩家会在绘制时重新渲染，
+        常驻模式下会优先使用常驻内存中的头像
+
+        Args:
+            players: 要加载的玩家，默认为精灵图中的所有玩家，精灵图只会在第一次加载时读取
+
+        Returns:
+            self: 自身
+        """
+        warm_players = set()
+        if self.warm is not None:
+            warm_sprites = self.warm.get_sprites(self.users if players is None else players, self.avatars_setting)
+            self.sprites.update(warm_sprites)
+            self._count('warm_hit', len(warm_sprites))
+            warm_players = { key[0] for key in warm_sprites }
+
+        if not self.sprite_atlas:
+            return self
+        atlas, index = self._open_sprite_atlas()
+        if index is None:
+            return self
+
+        valid_index = {
+            player: index[player] for player in (index if players is None else players)
+            if player in index and player not in warm_players and player in self.avatars_setting and index[player]['badge'] == self.avatars_setting[player]
+        }
+        if not valid_index:
+            return self
+
+        atlas.load()
+        for player, entry in valid_index.items():
+            for sprite_type, is_reserved in (('owned', False), ('reserved', True)):
+                if entry[sprite_type]:
+                    self.sprites[(player, is_reserved, ZOOM)] = atlas.crop(tuple(entry[sprite_type]))
+                    self._count('sprite_loaded')
+
+        return self
+
+
+    def _open_sprite_atlas(self):
+        """打开磁盘上的头像精灵图及其索引，同一次绘制中只会读取一次
+
+        Returns:
+            atlas, index: 精灵图 Image 及索引，没有精灵图时均为 None
+        """
+        if self.sprite_atlas_file is None:
+            atlas_path, index_path = self._get_sprite_atlas_path()
+            if not path.exists(atlas_path) or not path.exists(index_path):
+                self.sprite_atlas_file = (None, None)
+            else:
+                with open(index_path) as index_file:
+                    self.sprite_atlas_file = (Image.open(atlas_path), json.load(index_file))
+
+        return self.sprite_atlas_file
+
+
+    def _save_sprite_atlas(self):
+        """将渲染好的头像保存为精灵图
+        每个玩家占一格，格子左侧为占领房间的头像，右侧为外矿的头像，索引中会记录玩家的头像设置用于判断是否失效
+
+        Returns:
+            self: 自身
+        """
+        if self.warm is not None:
+            self.warm.set_sprites(self.sprites, self.avatars_setting)
+        # 从历史房间信息绘制时使用的是当时的头像设置，不会覆盖每天绘制使用的精灵图
+        if not self.sprite_atlas or not self.sprites_changed or self.archive_date:
+            return self
+
+        sprites = { key: sprite for key, sprite in self.sprites.items() if sprite and key[0] in self.avatars_setting }
+        players = sorted({ key[0] for key in sprites })
+        if not players:
+            return self
+
+        owned_width = max([sprite.size[0] for key, sprite in sprites.items() if not key[1]], default=0)
+        cell_size = (
+            owned_width + max([sprite.size[0] for key, sprite in sprites.items() if key[1]], default=0),
+            max(sprite.size[1] for sprite in sprites.values())
+        )
+        rows = math.ceil(len(players) / SPRITE_ATLAS_COLUMNS)
+        atlas = Image.new('RGBA', (cell_size[0] * min(len(players), SPRITE_ATLAS_COLUMNS), cell_size[1] * rows))
+
+        index = {}
+        for i, player in enumerate(players):
+            left = (i % SPRITE_ATLAS_COLUMNS) * cell_size[0]
+            top = (i // SPRITE_ATLAS_COLUMNS) * cell_size[1]
+            index[player] = { 'badge': self.avatars_setting[player], 'owned': None, 'reserved': None }
+
+            for sprite_type, is_reserved, offset in (('owned', False, 0), ('reserved', True, owned_width)):
+                sprite = sprites.get((player, is_reserved, ZOOM))
+                if not sprite: continue
+                atlas.paste(sprite, (left + offset, top))
+                index[player][sprite_type] = [left + offset, top, left + offset + sprite.size[0], top + sprite.size[1]]
+
+        atlas_path, index_path = self._get_sprite_atlas_path()
+        content = BytesIO()
+        atlas.save(content, 'PNG')
+        write_atomic(atlas_path, content.getvalue())
+        write_atomic(index_path, json.dumps(index))
+
+        return self
+
+
     def _get_room_name(self):
         """获取所有房间名
-        按照房间尺寸遍历出所有房间名
+        需要调用 self._init_world()
 
         Returns:
-            array: 所有的房间名列表
+            array: 所有的房间名列表，顺序和房间编号一致，见 RoomIndex
         """
-        quadrant_size = self._get_quadrant_size()
-
-        name_x = [f'W{i}' for i in range(0, quadrant_size)] + [f'E{i}' for i in range(0, quadrant_size)]
-        name_y = [f'S{i}' for i in range(0, quadrant_size)] + [f'N{i}' for i in range(0, quadrant_size)]
-        return [x + y for x in name_x for y in name_y]
+        return list(self.room_index.names)
 
 
-    def get_world_stats(self):
+    @instrument('map-stats')
+    def get_world_stats(self, on_chunk=None):
         """获取房间信息
         登陆后获取整个世界的房间信息，会将房间信息保存到 self.rooms 中
+        会按照区块分批并发获取，每个区块获取并格式化后都会缓存到 stats 目录下，
+        获取失败时重新调用本方法只会获取当天还没有成功获取的区块
+
+        Args:
+            on_chunk: 每个区块的房间信息保存到 self.rooms 后都会以该区块的房间名列表调用，用于流水线绘制
 
         Returns:
             self: 自身
         """
-        bar = Bar('正在加载世界信息')
-        time.sleep(0.1)
+        bar = Bar('正在加载世界信息', self.bar_interval)
+        stats_path = self._get_stats_path()
+
+        # 先加载当天已经获取过的区块
+        pending_chunks = {}
+        for sector_name, room_names in self._get_stats_chunks().items():
+            chunk_path = f'{stats_path}/{sector_name}.json'
+            if path.exists(chunk_path):
+                self._count('cache_hit')
+                self._load_stats_chunk(chunk_path)
+                if on_chunk: on_chunk(room_names)
+            else:
+                self._count('cache_miss')
+                pending_chunks[sector_name] = room_names
+
+        # 获取剩下的区块，会话会自动登陆
+        failures = {}
+        with ThreadPoolExecutor(max_workers=self.stats_workers) as executor:
+            tasks = { executor.submit(self._fetch_stats_chunk, room_names): sector_name for sector_name, room_names in pending_chunks.items() }
+            for i, task in enumerate(as_completed(tasks)):
+                sector_name = tasks[task]
+                bar.update(f'{sector_name} {i + 1}/{len(tasks)}')
+                try:
+                    world_stats = task.result()
+                except (RequestException, ValueError) as err:
+                    failures[sector_name] = err
+                    continue
+
+                # 将获取到的信息格式化成需要的样子，并把该区块的结果缓存下来
+                self._format_room(world_stats)
+                self._save_stats_chunk(f'{stats_path}/{sector_name}.json', world_stats["stats"].keys())
+                if on_chunk: on_chunk(pending_chunks[sector_name])
+
+        if failures:
+            raise RuntimeError(f'{len(failures)} 个区块的房间信息获取失败: {", ".join(failures)}，首个错误: {next(iter(failures.values()))}')
 
-        with open("config.json") as auth:
-            d = json.load(auth)
-            username = d["username"]
-            password = d["password"]
-        
-        # 进行登陆
-        r = requests.post('https://screeps.com/api/auth/signin', json={'email': username, 'password': password})
-        r.raise_for_status()
-        token = json.loads(r.text)["token"]
-
-        # 登陆后获取所有房间的信息
-        # 这里可能比较慢，所以调大了超时时间
-        params = {'rooms': self._get_room_name(), 'shard': f'shard{self.shard}', 'statName': 'owner0'}
-        r = requests.post('https://screeps.com/api/game/map-stats', json=params, headers={ 'X-Token': token, 'X-Username': token }, timeout=120)
-        token = r.headers["X-Token"]
-
-        # 将获取到的信息格式化成需要的样子
-        self._format_room(json.loads(r.text))
         bar.close()
         return self
 
 
+    def _get_stats_path(self):
+        """获取当天房间信息的缓存路径
+        会顺便清理掉之前日期的缓存
+
+        Returns:
+            string: 缓存路径
+        """
+        stats_root = f'{self.cache_path}/stats'
+        if path.exists(stats_root):
+            for date in listdir(stats_root):
+                if date != self.result_name:
+                    rmtree(f'{stats_root}/{date}')
+
+        stats_path = f'{stats_root}/{self.result_name}'
+        makedirs(stats_path, exist_ok=True)
+        return stats_path
+
+
+    def _get_stats_chunks(self):
+        """按照区块划分要获取信息的房间
+        需要调用 self._init_world()
+        只包含 shard_info 对应的区块中的房间
+
+        Returns:
+            dict: 键为区块名，值为该区块中的所有房间名
+        """
+        x_sectors_name, y_sectors_name = self._get_sectors_name()
+        return { x_name + y_name: self._get_sector_rooms(x_name, y_name) for x_name in x_sectors_name for y_name in y_sectors_name }
+
+
+    def _get_sector_rooms(self, x_sector_name, y_sector_name):
+        """获取区块中的所有房间名
+
+        Args:
+            x_sector_name: string 区块名的 x 轴部分，如 W9
+            y_sector_name: string 区块名的 y 轴部分，如 N9
+
+        Returns:
+            array: 该区块中的所有房间名
+        """
+        names = self.room_index.names
+        return [ names[index] for index in self.room_index.get_sector_indexes(x_sector_name, y_sector_name, ROOM_PRE_SECTOR) ]
+
+
+    def _fetch_stats_chunk(self, room_names):
+        """获取指定房间的信息
+        失败后会等待一段时间后重试，最多重试 STATS_RETRIES 次
+
+        Args:
+            room_names: 要获取的房间名列表
+
+        Returns:
+            dict: map-stats 接口返回的房间信息
+        """
+        params = {'rooms': room_names, 'shard': f'shard{self.shard}', 'statName': 'owner0'}
+        for retry in range(STATS_RETRIES + 1):
+            try:
+                r = self.api.post('/game/map-stats', auth=True, json=params, timeout=STATS_TIMEOUT)
+                self._count('bytes_downloaded', len(r.content))
+                return json.loads(r.text)
+            except RequestException:
+                if retry >= STATS_RETRIES: raise
+                time.sleep(REQUEST_BACKOFF * 2 ** retry)
+
+
+    def _save_stats_chunk(self, chunk_path, room_names):
+        """缓存一个区块格式化后的房间信息
+
+        Args:
+            chunk_path: 缓存路径
+            room_names: 该区块中获取到的房间名
+        """
+        rooms = { room_name: room for room_name, room in ((room_name, self.rooms.get(room_name)) for room_name in room_names) if room }
+        avatars_setting = { room['owner']: self.avatars_setting[room['owner']] for room in rooms.values() if 'owner' in room }
+        write_atomic(chunk_path, json.dumps({ 'rooms': rooms, 'avatars_setting': avatars_setting }))
+
+
+    def _load_stats_chunk(self, chunk_path):
+        """加载一个区块缓存的房间信息，见 _save_stats_chunk
+
+        Args:
+            chunk_path: 缓存路径
+        """
+        with open(chunk_path) as chunk_file:
+            chunk = json.load(chunk_file)
+
+        for username, setting in chunk['avatars_setting'].items():
+            self.rooms.add_owner(username, setting)
+        for room_name, room in chunk['rooms'].items():
+            self.rooms.set(room_name, room['status'], room.get('owner'), room.get('rcl', 0))
+
+
     def _format_room(self, world_stats):
         """格式化房间信息
 
@@ -322,66 +1636,135 @@ class ScreepsWorldView:
         """
         now_timestamp = int(time.time()) * 1000
 
-        for room_name in world_stats["stats"]:
-            room = world_stats["stats"][room_name]
-            self.rooms[room_name] = {
-                "status": room["status"]
-            }
+        for room_name, room in world_stats["stats"].items():
+            status = room["status"]
+            owner = None
+            rcl = 0
             if ("own" in room):
-                user_id = room["own"]["user"]
-                user_info = world_stats["users"][user_id]
-
-                self.rooms[room_name]["owner"] = user_info["username"]
-                self.rooms[room_name]["rcl"] = room["own"]["level"]
-
-                # 把用户加入用户列表中
-                if (self.rooms[room_name]["owner"] not in self.users):
-                    self.users.append(self.rooms[room_name]["owner"])
-                    # 保留用户头像设置
-                    self.avatars_setting[self.rooms[room_name]["owner"]] = json.dumps(user_info["badge"])
+                user_info = world_stats["users"][room["own"]["user"]]
+                owner = user_info["username"]
+                rcl = room["own"]["level"]
+                # 把用户加入用户列表中，并保留用户头像设置
+                self.rooms.add_owner(owner, user_info["badge"])
             
             # 尚不清楚新手区和重生区的渲染规则
             if 'novice' in room and room['novice'] and room['novice'] >= now_timestamp:
-                self.rooms[room_name]["status"] = 'novice'
+                status = 'novice'
             elif 'respawnArea' in room and room['respawnArea'] and room['respawnArea'] >= now_timestamp:
-                self.rooms[room_name]["status"] = 'respawn'
+                status = 'respawn'
+
+            self.rooms.set(room_name, status, owner, rcl)
 
         return self
 
 
+    @instrument('avatar')
     def get_avatar(self):
         """下载头像
-        会遍历 self.users 并下载对应的头像，该方法会自动缓存下载好的头像，并在后续使用时通过 badge 的配置变动来局部更新头像
+        会遍历 self.users 并下载对应的头像，头像按照头像设置的哈希缓存，所有 shard 共用，
+        头像设置没有变化的玩家会直接使用缓存，超过 AVATAR_REVALIDATE_AFTER 的缓存会向服务器重新验证
 
         Returns:
             self: 自身
         """
-        avatars_setting_json_path = f'{self.avatar_path}/shard{self.shard}_player_setting.json'
+        changed_users = [ username for username in self.users if not self._is_avatar_cached(username) ]
+        self._count('cache_hit', len(self.users) - len(changed_users))
+        self._count('cache_miss', len(changed_users))
+        # 头像设置相同的玩家共用一个头像文件，只需要下载一次
+        changed_keys = { self._get_avatar_key(username): username for username in changed_users }
+
+        bar = Bar('下载头像', self.bar_interval)
+        if changed_keys:
+            # 下载在线程池中进行，每下载好一个就交给进程池转换为 png，下载和转换可以同时进行
+            with ThreadPoolExecutor(max_workers=self.avatar_workers) as downloader, create_rasterizer() as rasterizer:
+                downloads = { downloader.submit(self._get_badge_svg, username): key for key, username in changed_keys.items() }
+                rasterizes = {}
+                for task in as_completed(downloads):
+                    r = task.result()
+                    # 服务器返回 304 时缓存的头像仍然可以使用
+                    if r is not None:
+                        rasterizes[rasterizer.submit(svg2png, r.content)] = (downloads[task], r)
+
+                for i, task in enumerate(as_completed(rasterizes)):
+                    key, r = rasterizes[task]
+                    bar.update(f'{changed_keys[key]} {i + 1}/{len(rasterizes)}')
+                    self.avatar_cache.put(key, task.result(), r)
+
+        self._save_avatar_cache()
+        bar.close()
+        return self
 
-        # 获取之前缓存的玩家头像配置，用于和最新的用户设置做比对，如果有不同则更新其头像，否则使用缓存好的头像
-        cache_avatars_setting = None
-        if path.exists(avatars_setting_json_path):
-            with open(avatars_setting_json_path) as avatars:
-                cache_avatars_setting = json.loads(avatars.read())
 
-        bar = Bar('下载头像')
-        for i, username in enumerate(self.users):
-            avatar_path = f'{self.avatar_path}/{username}.png'
-            bar.update(f'{username} {i + 1}/{len(self.users)}')
+    def _get_avatar_key(self, username):
+        """获取玩家头像在缓存目录中的文件名，见 get_avatar_key
 
-            # 头像存在就比较头像配置是否相同，完全一样就不需要下载
-            if path.exists(avatar_path) and cache_avatars_setting and username in cache_avatars_setting and self.avatars_setting[username] == cache_avatars_setting[username]:
-                continue
-            else:
-                svg = requests.get(f'https://screeps.com/api/user/badge-svg?username={username}').content
-                cairosvg.svg2png(bytestring=svg, write_to=avatar_path)
+        Args:
+            username: string 玩家名
 
-        # 把最新的用户配置保存下来供下次绘制时使用
-        with open(avatars_setting_json_path, 'w') as avatars:
-            avatars.write(json.dumps(self.avatars_setting))
+        Returns:
+            string: 头像文件名
+        """
+        return get_avatar_key(self.avatars_setting.get(username))
 
-        bar.close()
-        return self
+
+    def _is_avatar_cached(self, username):
+        """判断玩家缓存的头像是否可以直接使用
+        可以使用的头像会被标记为已使用，不会在本次绘制中被淘汰
+
+        Args:
+            username: string 玩家名
+
+        Returns:
+            bool: 是否可以直接使用
+        """
+        key = self._get_avatar_key(username)
+        if not self.avatar_cache.is_fresh(key):
+            return False
+
+        self.avatar_cache.touch(key)
+        return True
+
+
+    def _fetch_avatar(self, username, rasterizer):
+        """下载玩家头像并转换为 png 保存
+        会在下载线程中调用，转换在进程池中进行
+
+        Args:
+            username: string 玩家名
+            rasterizer: ProcessPoolExecutor 用于转换头像的进程池
+        """
+        r = self._get_badge_svg(username)
+        if r is not None:
+            self.avatar_cache.put(self._get_avatar_key(username), rasterizer.submit(svg2png, r.content).result(), r)
+
+
+    def _save_avatar_cache(self):
+        """淘汰超出 AVATAR_CACHE_SIZE 的头像并保存头像缓存的验证信息
+        """
+        removed = self.avatar_cache.evict()
+        if removed:
+            self._count('bytes_evicted', removed)
+        self.avatar_cache.save()
+
+
+    def _get_badge_svg(self, username):
+        """下载指定玩家的头像 svg，已有该头像的缓存时会进行条件请求
+
+        Args:
+            username: string 玩家名
+
+        Returns:
+            requests.Response: 头像 svg 的响应，缓存的头像仍然有效时为 None
+        """
+        r = self.avatar_cache.fetch(
+            self._get_avatar_key(username),
+            lambda headers: self.api.get('/user/badge-svg', params={ 'username': username }, headers=headers)
+        )
+        if r is None:
+            self._count('not_modified')
+        else:
+            self._count('bytes_downloaded', len(r.content))
+        return r
 
 
     def _pixel2room(self, pos):
@@ -391,47 +1774,84 @@ class ScreepsWorldView:
             pos: tuple, 包含位置的 x y 值，如 (1400, 1400)
         
         Returns:
-            string, 该位置所在的房间名称
+            string, 该位置所在的房间名称，不在世界范围内时为 None
         """
-        room = ''
-        quadrant_size = self._get_quadrant_size()
-        pos_direction = ( ('E', 'W'), ('S', 'N'))
-        
-        for i, axis in enumerate(pos):
-            code = quadrant_size - axis / (ROOM_PIXEL * ZOOM)
-            # 根据 code 的正负判断其所在象限
-            room += f'{pos_direction[i][0]}{math.floor(-code)}' if code <= 0 else f'{pos_direction[i][1]}{math.floor(code - 1)}'
+        index = self.room_index.get_pixel_index(*pos, ROOM_PIXEL * ZOOM)
+        return None if index is None else self.room_index.names[index]
 
-        return room
 
+    def add_status_masks(self, masks):
+        """一次性在多个房间上添加蒙版
+        同类型且相邻的房间会合并成一个矩形，每个矩形只需要查表混色一次，结果和逐个调用 Image.blend 一致
 
-    def add_inactivated_mask(self, x, y, mask_type='inactivated'):
-        """在指定位置添加未开放房间蒙版
-        
         Args:
-            x: 要添加到的房间左上角的 x 轴像素位置
-            y: 要添加到的房间左上角的 y 轴像素位置
-            mask_type: 蒙版类型, inactivated respawn novice 三者之一
+            masks: 要添加的蒙版列表，元素为 (x, y, mask_type)，x y 为房间左上角的像素位置，mask_type 为 inactivated respawn novice 三者之一
 
         Returns:
             self 自身
         """
         size = ROOM_PIXEL * ZOOM
-        mask = Image.new('RGBA', (size, size), COLORS[mask_type])
-        # 取出指定位置的房间
-        room = self.background.crop((x, y, x + size, y + size))
-        # 将取出的位置和蒙版贴在一起然后粘回去
-        self.background.paste(Image.blend(room, mask, 0.3), (x, y))
+
+        # 先把每一行中连续的房间合并成线段，键为 (蒙版类型, y)，值为 [x 起点, x 终点]
+        rows = {}
+        for x, y, mask_type in sorted(masks, key=lambda mask: (mask[2], mask[1], mask[0])):
+            segments = rows.setdefault((mask_type, y), [])
+            if segments and segments[-1][1] == x:
+                segments[-1][1] = x + size
+            else:
+                segments.append([x, x + size])
+
+        # 再把上下相邻且左右对齐的线段合并成矩形，键为 (蒙版类型, x 起点, x 终点)，值为 [y 起点, y 终点]
+        rects = []
+        opened = {}
+        for (mask_type, y), segments in sorted(rows.items(), key=lambda row: row[0][1]):
+            for left, right in segments:
+                key = (mask_type, left, right)
+                if key in opened and opened[key][1] == y:
+                    opened[key][1] = y + size
+                else:
+                    if key in opened: rects.append((mask_type, left, *opened[key], right))
+                    opened[key] = [y, y + size]
+        rects += [ (mask_type, left, top, bottom, right) for (mask_type, left, right), (top, bottom) in opened.items() ]
+
+        for mask_type, left, top, bottom, right in rects:
+            room = self.background.crop((left, top, right, bottom))
+            self.background.paste(room.point(self._get_mask_lut(mask_type)), (left, top))
 
         return self
 
-    
+
+    def _get_mask_lut(self, mask_type):
+        """获取蒙版的混色查找表
+        查找表由 Image.blend 直接生成，所以查表的结果和使用 Image.blend 混合完全一致
+
+        Args:
+            mask_type: 蒙版类型, inactivated respawn novice 三者之一
+
+        Returns:
+            list: 可以直接传给 Image.point 的 RGBA 查找表
+        """
+        if mask_type not in MASK_LUTS:
+            gradient = Image.frombytes('RGBA', (256, 1), bytes(value for value in range(256) for _ in range(4)))
+            blended = Image.blend(gradient, Image.new('RGBA', gradient.size, COLORS[mask_type]), 0.3)
+            MASK_LUTS[mask_type] = [ value for band in blended.split() for value in band.tobytes() ]
+
+        return MASK_LUTS[mask_type]
+
+
+    @instrument('world-size')
     def _init_world(self):
         """初始化世界信息
         会加载世界的尺寸，没有返回值
         """
-        bar = Bar('正在加载世界尺寸')
-        self.shard_info = json.loads(requests.get(f'https://screeps.com/api/game/world-size?shard=shard{self.shard}').content)
+        if self.archive_date:
+            self.shard_info = self.archive.get_shard_info(self.shard, self.archive_date)
+            return
+
+        bar = Bar('正在加载世界尺寸', self.bar_interval)
+        r = self.api.get('/game/world-size', params={ 'shard': f'shard{self.shard}' })
+        self._count('bytes_downloaded', len(r.content))
+        self.shard_info = json.loads(r.content)
         bar.close()
 
     def _get_sectors_name(self):
@@ -1,3 +1,6 @@
+import time
+
+
 class Bar:
     """
     简单的单行显示条
@@ -8,14 +11,19 @@ class Bar:
         bar.close()
     """
     title = ''
+    # 两次刷新之间的最小间隔（秒），为 0 时每次更新都会刷新
+    interval = 0
 
-    def __init__(self, title):
+    def __init__(self, title, interval=0):
         """初始化显示条
 
         Args:
             title: 将会一直显示在该行最前部
+            interval: 两次刷新之间的最小间隔（秒），间隔内的更新会被忽略，用于减少频繁刷新的开销
         """
         self.title = title
+        self.interval = interval
+        self._last_update = 0
         print(title, end='', flush=True)
 
     def update(self, info):
@@ -24,10 +32,16 @@ class Bar:
         Args:
             info: 追加显示在标题后的内容
         """
+        if self.interval:
+            now = time.monotonic()
+            if now - self._last_update < self.interval:
+                return
+            self._last_update = now
+
         content = f'\r{" " * 100}\r{self.title} {info}'
         print(content, end='')
     
     def close(self):
         """结束本行显示
         """
-        print(f'\r{" " * 100}\r{self.title} ✔')
\ No newline at end of file
+        print(f'\r{" " * 100}\r{self.title} ✔')
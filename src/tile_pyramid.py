@@ -0,0 +1,159 @@
+import hashlib
+import json
+import math
+from os import path, makedirs
+from shutil import rmtree
+
+from PIL import Image
+
+from file_utils import write_atomic
+
+
+class TilePyramid:
+    """
+    z/x/y 格式的瓦片金字塔
+    只需要写入最底层（最大 z）的瓦片，上层瓦片会在 build 时由下一层的 2 * 2 个瓦片缩小拼接而成
+    每个瓦片的内容哈希都会记录在 root 下的 tiles.json 中，内容没有变化的瓦片不会重新保存，
+    上层瓦片也只会重新生成下层有变化的那些，所以重复写入同一个目录时只有变化的瓦片会被更新
+
+    Usage:
+        pyramid = TilePyramid('dist/3/tiles', 8, 600)
+        pyramid.write(x, y, tile)
+        pyramid.build()
+    """
+    # 瓦片保存路径
+    root = ''
+    # 最底层每条边上的瓦片数量
+    tile_num = 0
+    # 瓦片边长像素值
+    tile_size = 0
+    # 最底层的 z 值，最顶层为 0 且只有一个瓦片
+    max_zoom = 0
+    # 最底层瓦片对应的区块名，见 ScreepsWorldView._get_sectors_name
+    sectors = None
+    # 本次重新保存及因为内容没有变化而跳过的瓦片数量
+    written = 0
+    skipped = 0
+
+    def __init__(self, root, tile_num, tile_size, sectors=None):
+        """
+        Args:
+            root: 瓦片保存路径
+            tile_num: 最底层每条边上的瓦片数量
+            tile_size: 瓦片边长像素值
+            sectors: (x 轴区块名列表, y 轴区块名列表)，会记录到 tiles.json 中，最底层的每个瓦片正好对应一个区块
+        """
+        self.root = root
+        self.tile_num = tile_num
+        self.tile_size = tile_size
+        self.max_zoom = math.ceil(math.log2(tile_num)) if tile_num > 1 else 0
+        self.sectors = sectors
+        self.written = 0
+        self.skipped = 0
+        # 本次内容发生变化的瓦片 (z, x, y)
+        self._changed = set()
+        self._hashes = self._load_hashes()
+
+    def get_tile_path(self, z, x, y):
+        """获取瓦片路径
+
+        Returns:
+            string: 瓦片路径
+        """
+        return f'{self.root}/{z}/{x}/{y}.png'
+
+    def get_level_size(self, z):
+        """获取指定层每条边上的瓦片数量
+
+        Returns:
+            number: 瓦片数量
+        """
+        return math.ceil(self.tile_num / 2 ** (self.max_zoom - z))
+
+    def write(self, x, y, tile, z=None):
+        """保存一个瓦片
+
+        Args:
+            x: 瓦片的列号
+            y: 瓦片的行号
+            tile: Image 瓦片
+            z: 瓦片所在的层，默认为最底层
+        """
+        z = self.max_zoom if z is None else z
+        tile_path = self.get_tile_path(z, x, y)
+        key = f'{z}/{x}/{y}'
+        digest = hashlib.sha1(tile.tobytes()).hexdigest()
+        if self._hashes.get(key) == digest and path.exists(tile_path):
+            self.skipped += 1
+            return
+
+        makedirs(path.dirname(tile_path), exist_ok=True)
+        tile.save(tile_path)
+        self._hashes[key] = digest
+        self._changed.add((z, x, y))
+        self.written += 1
+
+    def write_row(self, y, band):
+        """把一整行瓦片拼成的图片切开并保存为最底层的瓦片
+
+        Args:
+            y: 瓦片的行号
+            band: Image 高度为 tile_size 的图片
+        """
+        for x in range(math.ceil(band.size[0] / self.tile_size)):
+            self.write(x, y, band.crop((x * self.tile_size, 0, (x + 1) * self.tile_size, self.tile_size)))
+
+    def build(self):
+        """由最底层的瓦片逐层生成上层瓦片，并保存 tiles.json
+        只会重新生成下层瓦片有变化的上层瓦片，每次只会打开 4 个瓦片，内存占用和世界大小无关
+        """
+        half = self.tile_size // 2
+        for z in range(self.max_zoom - 1, -1, -1):
+            child_num = self.get_level_size(z + 1)
+            parents = sorted({ (x // 2, y // 2) for child_z, x, y in self._changed if child_z == z + 1 })
+            for x, y in parents:
+                tile = Image.new('RGBA', (self.tile_size, self.tile_size))
+                for dx in range(2):
+                    for dy in range(2):
+                        child_x, child_y = x * 2 + dx, y * 2 + dy
+                        if child_x >= child_num or child_y >= child_num:
+                            continue
+                        with Image.open(self.get_tile_path(z + 1, child_x, child_y)) as child:
+                            tile.paste(child.resize((half, half), Image.BOX), (dx * half, dy * half))
+                self.write(x, y, tile, z)
+
+        self._save_hashes()
+
+    def _get_manifest_path(self):
+        return f'{self.root}/tiles.json'
+
+    def _load_hashes(self):
+        """加载之前保存的瓦片哈希
+        瓦片的数量或尺寸发生变化时之前的瓦片都无法使用，会直接清空 root
+
+        Returns:
+            dict: 键为 z/x/y，值为瓦片内容的哈希
+        """
+        manifest_path = self._get_manifest_path()
+        if not path.exists(manifest_path):
+            return {}
+
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest['tile_num'] == self.tile_num and manifest['tile_size'] == self.tile_size:
+            return manifest['hashes']
+
+        rmtree(self.root)
+        return {}
+
+    def _save_hashes(self):
+        """保存瓦片哈希及金字塔的基本信息，供下次写入和前端查看时使用
+        """
+        makedirs(self.root, exist_ok=True)
+        write_atomic(self._get_manifest_path(), json.dumps({
+            'tile_num': self.tile_num,
+            'tile_size': self.tile_size,
+            'max_zoom': self.max_zoom,
+            'sectors': self.sectors,
+            'hashes': self._hashes
+        }))
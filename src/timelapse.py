@@ -0,0 +1,185 @@
+import argparse
+import re
+from os import listdir
+
+from PIL import Image, ImageChops
+
+from simple_bar import Bar
+from animation_writer import GifWriter, WebpWriter, FrameSequenceWriter
+
+# 延时动画的格式，gif / webp 为动画文件，frames 为可以交给 ffmpeg 合成视频的 png 帧序列
+TIMELAPSE_FORMAT = 'webp'
+# 缩小倍数，必须为正整数，每天的结果在读取后会立刻缩小，1 为不缩小
+TIMELAPSE_REDUCE = 4
+# 每天对应的显示时间（毫秒）
+TIMELAPSE_DURATION = 200
+# webp 的质量，0 - 100，为 None 时使用无损压缩
+TIMELAPSE_WEBP_QUALITY = 80
+# 每天的绘制结果的文件名，见 screeps_world_view.OUTPUT_FORMAT
+FRAME_NAME_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2})\.(png|webp)')
+
+
+class Timelapse:
+    """
+    由每天的绘制结果生成延时动画
+    逐天读取 dist/{shard} 下的结果，同一时间只会持有上一天和当天的画面，
+    每天只编码和前一天相比发生变化的区域，没有变化的日期会合并到上一帧中
+
+    Usage:
+        Timelapse(3).export()
+    """
+    # 要生成的 shard
+    shard = 3
+    # 结果所在的路径
+    dist_path = None
+
+    def __init__(self, shard=3, output_format=TIMELAPSE_FORMAT, reduce=TIMELAPSE_REDUCE, duration=TIMELAPSE_DURATION, start=None, end=None):
+        """
+        Args:
+            shard: 要生成的 shard
+            output_format: 见 TIMELAPSE_FORMAT
+            reduce: 见 TIMELAPSE_REDUCE
+            duration: 见 TIMELAPSE_DURATION
+            start: 开始日期，如 2020-05-01，为 None 时从最早的结果开始
+            end: 结束日期（包含），为 None 时到最新的结果结束
+        """
+        self.shard = shard
+        self.output_format = output_format
+        self.reduce = reduce
+        self.duration = duration
+        self.start = start
+        self.end = end
+        self.dist_path = f'dist/{shard}'
+
+    def get_frame_paths(self):
+        """获取要使用的每天的绘制结果
+        同一天同时有 png 和 webp 时使用 png
+
+        Returns:
+            list: 按日期排序的 (日期, 路径)
+        """
+        frames = {}
+        for file_name in sorted(listdir(self.dist_path), reverse=True):
+            match = FRAME_NAME_PATTERN.fullmatch(file_name)
+            if not match:
+                continue
+            date = match[1]
+            if (self.start and date < self.start) or (self.end and date > self.end):
+                continue
+            frames[date] = f'{self.dist_path}/{file_name}'
+
+        return sorted(frames.items())
+
+    def export(self, output_path=None):
+        """生成延时动画
+
+        Args:
+            output_path: 保存路径，为 None 时保存为 dist/{shard}/timelapse.{格式}，帧序列保存在 dist/{shard}/timelapse 目录下
+
+        Returns:
+            string: 保存路径
+        """
+        frame_paths = self.get_frame_paths()
+        if not frame_paths:
+            raise ValueError(f'{self.dist_path} 中没有可用的绘制结果')
+
+        if output_path is None:
+            output_path = f'{self.dist_path}/timelapse' + ('' if self.output_format == 'frames' else f'.{self.output_format}')
+
+        bar = Bar('正在生成延时动画')
+        writer = None
+        previous = None
+        # 等待写入的帧，没有变化的日期会累加到它的显示时间上
+        pending = None
+        try:
+            for i, (date, frame_path) in enumerate(frame_paths):
+                bar.update(f'{date} {i + 1}/{len(frame_paths)}')
+                frame = self._load_frame(frame_path, previous.size if previous else None)
+                if writer is None:
+                    writer = self._create_writer(output_path, frame.size)
+                    pending = [frame, (0, 0), self.duration]
+                    previous = frame
+                    continue
+
+                bbox = self._get_changed_box(previous, frame)
+                if bbox is None:
+                    pending[2] += self.duration
+                    continue
+
+                writer.write(*pending)
+                pending = [frame.crop(bbox), bbox[:2], self.duration]
+                previous = frame
+
+            writer.write(*pending)
+        except BaseException:
+            if writer: writer.abort()
+            raise
+
+        writer.close()
+        bar.close()
+        print(f'已保存至 {output_path}')
+        return output_path
+
+    def _create_writer(self, output_path, size):
+        """根据格式创建动画文件
+
+        Returns:
+            AnimationWriter: 动画文件
+        """
+        if self.output_format == 'gif':
+            return GifWriter(output_path, size)
+        if self.output_format == 'webp':
+            return WebpWriter(output_path, size, TIMELAPSE_WEBP_QUALITY)
+        if self.output_format == 'frames':
+            return FrameSequenceWriter(output_path, size, self.duration)
+        raise ValueError(f'不支持的延时动画格式 {self.output_format}')
+
+    def _load_frame(self, frame_path, size=None):
+        """读取一天的绘制结果并缩小
+        世界尺寸发生变化时会裁剪或补齐到第一帧的尺寸
+
+        Args:
+            frame_path: 结果路径
+            size: 画面尺寸，为 None 时使用该结果缩小后的尺寸
+
+        Returns:
+            Image: RGB 画面
+        """
+        with Image.open(frame_path) as image:
+            frame = image.convert('RGB')
+        if self.reduce > 1:
+            frame = frame.reduce(self.reduce)
+
+        if size and frame.size != size:
+            canvas = Image.new('RGB', size)
+            canvas.paste(frame)
+            frame = canvas
+        return frame
+
+    def _get_changed_box(self, previous, frame):
+        """获取两天之间发生变化的区域
+        webp 要求帧的位置为偶数，所以左上角会向前对齐到偶数
+
+        Returns:
+            tuple: 变化区域 (left, top, right, bottom)，没有变化时为 None
+        """
+        bbox = ImageChops.difference(previous, frame).getbbox()
+        if bbox is None:
+            return None
+
+        left, top, right, bottom = bbox
+        return (left - left % 2, top - top % 2, right, bottom)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='由每天的绘制结果生成延时动画')
+    parser.add_argument('shard', type=int, help='要生成的 shard')
+    parser.add_argument('--format', default=TIMELAPSE_FORMAT, choices=['webp', 'gif', 'frames'], help='动画格式')
+    parser.add_argument('--reduce', type=int, default=TIMELAPSE_REDUCE, help='缩小倍数')
+    parser.add_argument('--duration', type=int, default=TIMELAPSE_DURATION, help='每天对应的显示时间（毫秒）')
+    parser.add_argument('--start', help='开始日期，如 2020-05-01')
+    parser.add_argument('--end', help='结束日期（包含）')
+    parser.add_argument('--output', help='保存路径')
+    args = parser.parse_args()
+
+    Timelapse(args.shard, args.format, args.reduce, args.duration, args.start, args.end).export(args.output)
@@ -1,5 +1,6 @@
 import time, sched, datetime
-from screeps_world_view import ScreepsWorldView
+from render_scheduler import render_shards, RENDER_WORKERS
+from warm_cache import WarmCache
 
 # 要绘制的 shard
 DRAW_SHARD = [ 3, 2, 1, 0 ]
@@ -7,9 +8,16 @@ DRAW_SHARD = [ 3, 2, 1, 0 ]
 RETRY_INTERVAL = 200
 # 零点到任务执行时的秒间隔，用于指定任务在每天的何时调用，默认为中午 12 点
 CALL_TIME = 43200
+# 是否开启常驻模式，开启后所有 shard 会在本进程中依次绘制，并把底图、上次的结果和头像保留在内存中，
+# 之后每天只需要完成新的工作，世界尺寸或者玩家头像发生变化时才会重新加载对应的内容
+DAEMON = False
+# 常驻模式下保留内容的内存上限（MB），shard0 的底图和结果各占约 600 MB
+DAEMON_MEMORY_BUDGET = 2048
 
 # 新建调度器
 s = sched.scheduler(time.time, time.sleep)
+# 常驻模式下保留的内容
+warm = WarmCache(DAEMON_MEMORY_BUDGET) if DAEMON else None
 
 
 def get_draw_interval():
@@ -28,26 +36,31 @@ def get_draw_interval():
 
 
 #被调度触发的函数
-def draw():
+def draw(shards=DRAW_SHARD):
     """执行绘制任务
     若成功执行完绘制任务则第二天零点再次绘制
-    否则间隔 RETRY_INTERVAL 秒后重试
+    否则间隔 RETRY_INTERVAL 秒后只重试绘制失败的 shard
+
+    Args:
+        shards: 要绘制的 shard 列表
     """
     try:
-        # 遍历所有 shard 进行绘制
-        for i in DRAW_SHARD:
-            view = ScreepsWorldView(i)
-            view.draw()
-        
-        # 如果正常绘制完成则安排下一次绘制任务
-        interval = get_draw_interval()
-        s.enter(interval, 0, draw)
-        print(f'\n绘制完成，将在 {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() + interval))} 重新绘制，请确保本任务在后台运行。\n')
-    
-    # 绘制异常则尝试重试
+        failures = render_shards(shards, RENDER_WORKERS, warm)
     except Exception as err:
-        print(f'绘制出现异常，将在 {RETRY_INTERVAL} 秒后重试:\n', err)
-        s.enter(RETRY_INTERVAL, 0, draw)
+        failures = { shard: err for shard in shards }
+
+    # 绘制异常则尝试重试
+    if failures:
+        for shard, err in failures.items():
+            print(f'Shard{shard} 绘制出现异常:\n', err)
+        print(f'将在 {RETRY_INTERVAL} 秒后重试 {", ".join(f"Shard{shard}" for shard in failures)}')
+        s.enter(RETRY_INTERVAL, 0, draw, ([ shard for shard in shards if shard in failures ],))
+        return
+
+    # 如果正常绘制完成则安排下一次绘制任务
+    interval = get_draw_interval()
+    s.enter(interval, 0, draw)
+    print(f'\n绘制完成，将在 {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() + interval))} 重新绘制，请确保本任务在后台运行。\n')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+import time
+
+
+def get_image_size(image):
+    """估算图片占用的内存
+
+    Args:
+        image: Image 图片，可以为 None
+
+    Returns:
+        number: 字节数
+    """
+    if image is None:
+        return 0
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+class WarmState:
+    """
+    常驻进程中单个 shard 在两次绘制之间保留的内容
+    世界尺寸变化时会全部清空，底图缓存发生变化时由 ScreepsWorldView 替换，头像按照头像设置判断是否还能使用
+    """
+    # 保留这些内容时的世界尺寸信息，见 ScreepsWorldView.shard_info
+    shard_info = None
+    # 还没有绘制房间的原始底图，绘制时需要复制一份再使用
+    background = None
+    # 上次绘制的结果，为 (上次绘制信息中的结果路径, Image)，见 ScreepsWorldView._save_last_render
+    result = None
+    # 渲染好的头像，键和 ScreepsWorldView.sprites 相同
+    sprites = None
+    # 渲染头像时使用的头像设置，键为玩家名
+    badges = None
+    # 最后一次使用的时间，用于按照 LRU 释放内存
+    used = 0
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, shard_info=None):
+        """清空保留的内容
+
+        Args:
+            shard_info: 新的世界尺寸信息
+        """
+        self.shard_info = shard_info
+        self.background = None
+        self.result = None
+        self.sprites = {}
+        self.badges = {}
+
+    def take_result(self, result_path):
+        """取出上次绘制的结果，取出后调用方可以直接修改，绘制中途失败也不会留下修改了一半的结果
+
+        Args:
+            result_path: 磁盘上上次绘制的结果路径
+
+        Returns:
+            Image: 上次绘制的结果，没有保留或者和 result_path 不一致时为 None
+        """
+        result, self.result = self.result, None
+        if result is None or result[0] != result_path:
+            return None
+        return result[1]
+
+    def get_sprites(self, players, badges):
+        """获取头像设置没有变化的玩家的头像
+
+        Args:
+            players: 要获取的玩家
+            badges: dict 玩家最新的头像设置
+
+        Returns:
+            dict: 可以直接使用的头像，键和 ScreepsWorldView.sprites 相同
+        """
+        players = { player for player in players if player in self.badges and badges.get(player) == self.badges[player] }
+        return { key: sprite for key, sprite in self.sprites.items() if key[0] in players }
+
+    def set_sprites(self, sprites, badges):
+        """保存本次绘制的头像，本次没有出现的玩家会被丢弃
+
+        Args:
+            sprites: dict 渲染好的头像，见 ScreepsWorldView.sprites
+            badges: dict 玩家最新的头像设置
+        """
+        self.sprites = { key: sprite for key, sprite in sprites.items() if sprite is not None and key[0] in badges }
+        self.badges = { player: badges[player] for player, _, _ in self.sprites }
+
+    def get_memory(self):
+        """估算保留的内容占用的内存
+
+        Returns:
+            number: 字节数
+        """
+        return (
+            get_image_size(self.background) + get_image_size(self.result[1] if self.result else None) +
+            sum(get_image_size(sprite) for sprite in self.sprites.values())
+        )
+
+
+class WarmCache:
+    """
+    常驻进程中所有 shard 保留的内容
+    所有 shard 保留的图片总大小不会超过 memory_budget，超出时会从最久没有绘制的 shard 开始，
+    依次释放上次绘制的结果、原始底图和头像，被释放的内容会在下次绘制时从磁盘重新加载
+
+    Usage:
+        warm = WarmCache(2048)
+        view = ScreepsWorldView(3, warm=warm.get(3))
+        view.draw()
+        warm.trim()
+    """
+    # 保留内容的内存上限（MB）
+    memory_budget = 0
+
+    def __init__(self, memory_budget):
+        """
+        Args:
+            memory_budget: 保留内容的内存上限（MB）
+        """
+        self.memory_budget = memory_budget
+        self.states = {}
+
+    def get(self, shard):
+        """获取 shard 保留的内容，没有时新建
+
+        Returns:
+            WarmState: 保留的内容
+        """
+        if shard not in self.states:
+            self.states[shard] = WarmState()
+        self.states[shard].used = time.time()
+        return self.states[shard]
+
+    def get_memory(self):
+        return sum(state.get_memory() for state in self.states.values())
+
+    def trim(self):
+        """释放超出内存上限的内容
+
+        Returns:
+            number: 释放后保留的内容占用的内存（字节）
+        """
+        budget = self.memory_budget * 1024 * 1024
+        memory = self.get_memory()
+        for state in sorted(self.states.values(), key=lambda state: state.used):
+            for name in ('result', 'background', 'sprites'):
+                if memory <= budget:
+                    return memory
+                before = state.get_memory()
+                if name == 'sprites':
+                    state.sprites, state.badges = {}, {}
+                else:
+                    setattr(state, name, None)
+                memory -= before - state.get_memory()
+
+        return memory
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import sys
+from os import path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'src'))
+
+import fake_server
+import screeps_world_view
+from fake_server import FakeScreepsServer
+from room_index import RoomIndex
+from screeps_session import ScreepsSession
+from screeps_world_view import ScreepsWorldView, ROOM_PIXEL, ROOM_PRE_SECTOR, ZOOM
+
+# 历史上较小的世界和现在扩张后的世界宽度
+OLD_WIDTH = 22
+NEW_WIDTH = 42
+
+
+def hash_cache(cache_path):
+    """计算缓存目录下所有文件的内容摘要
+
+    Returns:
+        dict: 键为相对路径，值为内容的 sha1
+    """
+    hashes = {}
+    for root, _, files in os.walk(cache_path):
+        for file_name in files:
+            file_path = path.join(root, file_name)
+            with open(file_path, 'rb') as cache_file:
+                hashes[path.relpath(file_path, cache_path)] = hashlib.sha1(cache_file.read()).hexdigest()
+    return hashes
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """在临时目录中启动离线的接口服务器
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(fake_server.FAKE_SHARD_WIDTH, 3, OLD_WIDTH)
+    monkeypatch.setitem(fake_server.FAKE_SHARD_PLAYERS, 3, 20)
+    with open('config.json', 'w') as config:
+        json.dump({ 'username': 'test', 'password': 'test' }, config)
+
+    with FakeScreepsServer() as server:
+        yield server
+
+
+def draw_daily(server, date):
+    """模拟在指定日期完成的一次每日绘制
+    """
+    view = ScreepsWorldView(3, api=ScreepsSession(api_url=server.api_url, token_path=None), tile_url=server.tile_url, quiet=True)
+    view.result_name = date
+    view.draw()
+    return view
+
+
+def test_archive_render_keeps_daily_cache(server, monkeypatch):
+    draw_daily(server, '2020-01-01')
+    fake_server.FAKE_SHARD_WIDTH[3] = NEW_WIDTH
+    daily = draw_daily(server, '2020-01-02')
+
+    cache_path = '.screeps_cache/3'
+    assert path.exists(f'{cache_path}/last_render.json')
+    daily_cache = hash_cache(cache_path)
+
+    # 和 room_archive.py render 一样在新的进程中绘制，并且所有瓦片都需要重新验证
+    monkeypatch.setattr(RoomIndex, '_cache', {})
+    monkeypatch.setattr(screeps_world_view, 'TILE_REVALIDATE_AFTER', 0)
+    view = ScreepsWorldView(3, api=ScreepsSession(api_url=server.api_url, token_path=None), tile_url=server.tile_url, quiet=True, archive_date='2020-01-01')
+    view.draw()
+
+    # 历史上的世界更小，底图只在内存中重新拼接
+    with Image.open('dist/3/archive/2020-01-01.png') as result:
+        assert result.size == (view._get_sector_num() * ROOM_PIXEL * ROOM_PRE_SECTOR * ZOOM,) * 2
+        assert result.size != daily.background.size
+    assert hash_cache(cache_path) == daily_cache
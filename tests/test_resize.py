@@ -0,0 +1,61 @@
+import random
+import sys
+from os import path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'src'))
+
+from screeps_world_view import ScreepsWorldView, ZOOM, numpy
+
+
+def create_view(engine):
+    """新建只用于放大底图的实例，不会初始化世界和下载任何内容
+    """
+    view = ScreepsWorldView.__new__(ScreepsWorldView)
+    view.resize_engine = engine
+    view.report = None
+    view.bar_interval = 0
+    return view
+
+
+def create_image(size=(17, 11)):
+    """新建随机内容的 RGBA 图片
+    """
+    rng = random.Random(20200519)
+    image = Image.new('RGBA', size)
+    image.putdata([ tuple(rng.randrange(256) for _ in range(4)) for _ in range(size[0] * size[1]) ])
+    return image
+
+
+@pytest.mark.parametrize('engine', [
+    pytest.param('numpy', marks=pytest.mark.skipif(numpy is None, reason='numpy 未安装')),
+    'pillow'
+])
+def test_resize_matches_pixel_engine(engine):
+    image = create_image()
+    expected = create_view('pixel')._resize(image, show_bar=False)
+    resized = create_view(engine)._resize(image, show_bar=False)
+
+    assert resized.mode == 'RGBA'
+    assert resized.size == (image.size[0] * ZOOM, image.size[1] * ZOOM)
+    assert resized.tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize('engine', [ 'pixel', 'pillow' ] + ([ 'numpy' ] if numpy is not None else []))
+def test_resize_wraps_first_row(engine):
+    image = create_image()
+    resized = create_view(engine)._resize(image, show_bar=False)
+    width, height = resized.size
+
+    # 整张图上移 ZOOM 行，最后 ZOOM 行来自原图的第一行
+    for y in range(height - ZOOM, height):
+        assert [ resized.getpixel((x, y)) for x in range(width) ] == [ image.getpixel((x // ZOOM, 0)) for x in range(width) ]
+    for y in range(height - ZOOM):
+        assert resized.getpixel((0, y)) == image.getpixel((0, y // ZOOM + 1))
+
+
+def test_resize_unknown_engine():
+    with pytest.raises(ValueError):
+        create_view('bilinear')._resize(create_image(), show_bar=False)